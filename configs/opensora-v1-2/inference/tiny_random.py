@@ -0,0 +1,44 @@
+# Tiny randomly initialized models for tests and serving smoke runs, no pretrained weights are downloaded.
+resolution = "144p"
+aspect_ratio = "1:1"
+num_frames = 4
+fps = 24
+frame_interval = 1
+save_fps = 24
+
+save_dir = "./samples/tiny_random/"
+seed = 42
+batch_size = 2
+multi_resolution = "STDiT2"
+dtype = "fp32"
+
+model = dict(
+    type="STDiT3-Tiny/2",
+    qk_norm=True,
+    enable_flash_attn=False,
+    enable_layernorm_kernel=False,
+)
+vae = dict(
+    type="VideoAutoencoderKL",
+    from_pretrained=None,
+    micro_batch_size=4,
+    config=dict(
+        block_out_channels=(32, 32, 32, 32),
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        layers_per_block=1,
+        norm_num_groups=8,
+        latent_channels=4,
+    ),
+)
+text_encoder = dict(
+    type="random_text",
+    output_dim=64,
+    model_max_length=20,
+)
+scheduler = dict(
+    type="rflow",
+    use_timestep_transform=True,
+    num_sampling_steps=4,
+    cfg_scale=7.0,
+)
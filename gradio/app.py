@@ -139,6 +139,12 @@ def parse_args():
         action="store_true",
         help="Whether to enable optimization such as flash attention and fused layernorm",
     )
+    parser.add_argument(
+        "--text-embedding-cache",
+        default=None,
+        type=str,
+        help="Directory of the persistent T5 embedding cache, prompts seen before skip the text encoder",
+    )
     return parser.parse_args()
 
 
@@ -152,6 +158,8 @@ def parse_args():
 # read config
 args = parse_args()
 config = read_config(CONFIG_MAP[args.model_type])
+if args.text_embedding_cache is not None:
+    config.text_encoder["embedding_cache_dir"] = args.text_embedding_cache
 torch.backends.cuda.matmul.allow_tf32 = True
 torch.backends.cudnn.allow_tf32 = True
 
@@ -330,6 +338,7 @@ def run_inference(
         # Generate image/video
         # =========================
         video_clips = []
+        latent_clips = []
 
         for loop_i in range(num_loop):
             # 4.4 sample in hidden space
@@ -338,7 +347,14 @@ def run_inference(
             # == loop ==
             if loop_i > 0:
                 refs, mask_strategy = append_generated(
-                    vae, video_clips[-1], refs, mask_strategy, loop_i, condition_frame_length, condition_frame_edit
+                    vae,
+                    video_clips[-1],
+                    refs,
+                    mask_strategy,
+                    loop_i,
+                    condition_frame_length,
+                    condition_frame_edit,
+                    generated_latent=latent_clips[-1],
                 )
 
             # == sampling ==
@@ -363,6 +379,7 @@ def run_inference(
                 progress=True,
                 mask=masks,
             )
+            latent_clips.append(samples)
             samples = vae.decode(samples.to(dtype), num_frames=num_frames)
             video_clips.append(samples)
 
@@ -0,0 +1,154 @@
+import fnmatch
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# timestep, fps and output layers are small and sensitive to rounding, they stay in full precision
+STDIT3_QUANT_EXCLUDE = ("t_embedder.*", "t_block.*", "fps_embedder.*", "y_embedder.*", "final_layer.*")
+
+QUANT_BITS = {"int8": 8, "int4": 4}
+
+
+def quantize_weight(weight, bits=8, group_size=None):
+    """
+    Symmetric round-to-nearest quantization of a 2D weight with one scale per output channel and group.
+
+    Args:
+        weight (torch.Tensor): [out_features, in_features] weight
+        bits (int): 8, or 4 for two values packed per byte
+        group_size (int): input features sharing a scale, None for one scale per output channel
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor]: int8 weight ([out_features, in_features // 2] when packed) and float32
+            scales of shape [out_features, num_groups]
+    """
+    out_features, in_features = weight.shape
+    group_size = group_size or in_features
+    assert in_features % group_size == 0, f"in_features {in_features} is not divisible by group_size {group_size}"
+    qmax = 2 ** (bits - 1) - 1
+    w = weight.detach().float().reshape(out_features, -1, group_size)
+    scale = w.abs().amax(dim=-1, keepdim=True).clamp(min=1e-8) / qmax
+    q = torch.round(w / scale).clamp(-qmax - 1, qmax).to(torch.int8).reshape(out_features, in_features)
+    if bits == 4:
+        q = q.view(torch.uint8) & 0xF
+        q = (q[:, 0::2] | (q[:, 1::2] << 4)).view(torch.int8)
+    return q, scale.squeeze(-1)
+
+
+def dequantize_weight(qweight, scale, bits=8, dtype=torch.float):
+    """
+    Inverse of `quantize_weight`.
+    """
+    if bits == 4:
+        packed = qweight.view(torch.uint8)
+        # sign-extend the 4-bit values
+        low = (packed << 4).view(torch.int8) >> 4
+        high = packed.view(torch.int8) >> 4
+        qweight = torch.stack([low, high], dim=-1).flatten(1)
+    out_features, in_features = qweight.shape
+    w = qweight.reshape(out_features, scale.size(1), -1).to(scale.dtype) * scale.unsqueeze(-1)
+    return w.reshape(out_features, in_features).to(dtype)
+
+
+class QuantLinear(nn.Module):
+    """
+    Linear layer with weight-only int8 or grouped int4 weights.
+
+    The weight is dequantized to the dtype of the input right before the matmul, so activations and accumulation keep
+    their precision and only the resident weights shrink (2x for int8 and about 4x for int4 compared to bf16).
+    `weight` is an int8 buffer, which e.g. lets the T5 feed-forward skip casting its activations to the weight dtype.
+    """
+
+    def __init__(self, in_features, out_features, bias=True, bits=8, group_size=None, device=None, dtype=None):
+        super().__init__()
+        assert bits in (4, 8), f"Unsupported number of bits {bits}"
+        group_size = group_size or in_features
+        assert in_features % group_size == 0, f"in_features {in_features} is not divisible by group_size {group_size}"
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size
+        packed_features = in_features // 2 if bits == 4 else in_features
+        self.register_buffer("weight", torch.zeros(out_features, packed_features, dtype=torch.int8, device=device))
+        self.register_buffer(
+            "scale", torch.ones(out_features, in_features // group_size, dtype=torch.float, device=device)
+        )
+        if bias:
+            self.bias = nn.Parameter(torch.zeros(out_features, device=device, dtype=dtype), requires_grad=False)
+        else:
+            self.register_parameter("bias", None)
+
+    @classmethod
+    def from_linear(cls, linear, bits=8, group_size=None):
+        module = cls(
+            linear.in_features,
+            linear.out_features,
+            bias=linear.bias is not None,
+            bits=bits,
+            group_size=group_size,
+            device=linear.weight.device,
+            dtype=linear.weight.dtype,
+        )
+        module.weight, module.scale = quantize_weight(linear.weight, bits, group_size)
+        if linear.bias is not None:
+            module.bias.data = linear.bias.detach()
+        return module
+
+    def _apply(self, fn, *args, **kwargs):
+        # .to(dtype) must not cast the scales, their precision matters more than their size
+        scale = self.scale
+        super()._apply(fn, *args, **kwargs)
+        self.scale = scale.to(self.weight.device)
+        return self
+
+    def dequantize(self, dtype=torch.float):
+        return dequantize_weight(self.weight, self.scale, self.bits, dtype)
+
+    def forward(self, x):
+        return F.linear(x, self.dequantize(x.dtype), self.bias)
+
+    def extra_repr(self):
+        return (
+            f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}, "
+            f"bits={self.bits}, group_size={self.group_size}"
+        )
+
+
+def quantize_model(model, bits=8, group_size=None, exclude=()):
+    """
+    Replace the `nn.Linear` layers of `model` in place by `QuantLinear`.
+
+    Args:
+        model (nn.Module): model whose weights are already loaded
+        bits (int or str): 8, 4, "int8" or "int4"
+        group_size (int): input features sharing a scale, None for per-channel scales with int8 and groups of 128
+            with int4. Layers whose input features are not divisible by it keep per-channel scales.
+        exclude (tuple[str]): fnmatch patterns of module names to keep in full precision
+
+    Returns:
+        int: number of quantized layers
+    """
+    bits = QUANT_BITS.get(bits, bits)
+    if bits == 4 and group_size is None:
+        group_size = 128
+    num_quantized = 0
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            full_name = f"{name}.{child_name}" if name else child_name
+            if type(child) is not nn.Linear or any(fnmatch.fnmatch(full_name, p) for p in exclude):
+                continue
+            layer_group_size = group_size if group_size and child.in_features % group_size == 0 else None
+            if bits == 4 and layer_group_size is None and child.in_features % 2 != 0:
+                continue
+            setattr(module, child_name, QuantLinear.from_linear(child, bits, layer_group_size))
+            num_quantized += 1
+    return num_quantized
+
+
+def get_model_size(model):
+    """
+    Size of the parameters and buffers of `model` in bytes.
+    """
+    tensors = {id(t): t for t in list(model.parameters()) + list(model.buffers())}
+    return sum(t.numel() * t.element_size() for t in tensors.values())
@@ -1,2 +1,2 @@
 from .datasets import IMG_FPS, BatchFeatureDataset, VariableVideoTextDataset, VideoTextDataset
-from .utils import get_transforms_image, get_transforms_video, is_img, is_vid, save_sample
+from .utils import VideoWriter, get_transforms_image, get_transforms_video, is_img, is_vid, save_sample, to_uint8_frames
@@ -474,6 +474,12 @@ def get_image_size(resolution, ar_ratio):
     return rs_dict[ar_key]
 
 
+def get_closest_image_size(resolution, image_size):
+    # the bucket of `resolution` whose aspect ratio is closest to that of `image_size` (height, width)
+    rs_dict = ASPECT_RATIOS[resolution][1]
+    return rs_dict[get_closest_ratio(*image_size, rs_dict)]
+
+
 NUM_FRAMES_MAP = {
     "1x": 51,
     "2x": 102,
@@ -169,18 +169,71 @@ def save_sample(x, save_path=None, fps=8, normalize=True, value_range=(-1, 1), f
         save_image([x], save_path, normalize=normalize, value_range=value_range)
     else:
         save_path += ".mp4"
-        if normalize:
-            low, high = value_range
-            x.clamp_(min=low, max=high)
-            x.sub_(low).div_(max(high - low, 1e-5))
-
-        x = x.mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 3, 0).to("cpu", torch.uint8)
+        x = to_uint8_frames(x, normalize=normalize, value_range=value_range)
         write_video(save_path, x, fps=fps, video_codec="h264")
     if verbose:
         print(f"Saved to {save_path}")
     return save_path
 
 
+def to_uint8_frames(x, normalize=True, value_range=(-1, 1)):
+    """
+    Args:
+        x (Tensor): shape [C, T, H, W], modified in place when normalize is True
+
+    Returns:
+        Tensor: uint8 frames of shape [T, H, W, C] on cpu
+    """
+    if normalize:
+        low, high = value_range
+        x.clamp_(min=low, max=high)
+        x.sub_(low).div_(max(high - low, 1e-5))
+    return x.mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 3, 0).to("cpu", torch.uint8)
+
+
+class VideoWriter:
+    """
+    Incremental mp4 writer. Frames are encoded as they are written, so a video can be saved chunk by chunk
+    without holding the full clip in memory. The output matches `torchvision.io.write_video`.
+
+    Args:
+        save_path (str): output path including the extension
+        fps (float): frames per second
+        video_codec (str): codec passed to PyAV
+    """
+
+    def __init__(self, save_path, fps=8, video_codec="h264", options=None):
+        import av
+
+        self.av = av
+        self.save_path = save_path
+        self.container = av.open(save_path, mode="w")
+        self.stream = self.container.add_stream(video_codec, rate=round(fps))
+        self.stream.pix_fmt = "yuv420p" if video_codec != "libx264rgb" else "rgb24"
+        self.stream.options = options or {}
+        self.num_frames = 0
+
+    def write(self, frames):
+        """
+        Args:
+            frames (Tensor): uint8 frames of shape [T, H, W, C]
+        """
+        frames = frames.numpy()
+        if self.num_frames == 0:
+            self.stream.height, self.stream.width = frames.shape[1], frames.shape[2]
+        for img in frames:
+            frame = self.av.VideoFrame.from_ndarray(img, format="rgb24")
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+        self.num_frames += len(frames)
+
+    def close(self):
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+        return self.save_path
+
+
 def center_crop_arr(pil_image, image_size):
     """
     Center cropping implementation from ADM.
@@ -463,12 +463,18 @@ class MultiHeadCrossAttention(nn.Module):
         self.proj = nn.Linear(d_model, d_model)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x, cond, mask=None):
+    def get_kv(self, cond):
+        # cond: [1, N_token, C] -> kv: [1, N_token, 2, NUM_HEADS, HEAD_DIM]
+        return self.kv_linear(cond).view(1, -1, 2, self.num_heads, self.head_dim)
+
+    def forward(self, x, cond, mask=None, kv=None):
         # query/value: img tokens; key: condition; mask: if padding tokens
+        # kv: optional precomputed self.get_kv(cond), cond is ignored if given
         B, N, C = x.shape
 
         q = self.q_linear(x).view(1, -1, self.num_heads, self.head_dim)
-        kv = self.kv_linear(cond).view(1, -1, 2, self.num_heads, self.head_dim)
+        if kv is None:
+            kv = self.get_kv(cond)
         k, v = kv.unbind(2)
 
         attn_bias = None
@@ -497,7 +503,7 @@ class SeqParallelMultiHeadCrossAttention(MultiHeadCrossAttention):
             proj_drop=proj_drop,
         )
 
-    def forward(self, x, cond, mask=None):
+    def forward(self, x, cond, mask=None, kv=None):
         # query/value: img tokens; key: condition; mask: if padding tokens
         sp_group = get_sequence_parallel_group()
         sp_size = dist.get_world_size(sp_group)
@@ -507,7 +513,8 @@ class SeqParallelMultiHeadCrossAttention(MultiHeadCrossAttention):
         # shape:
         # q, k, v: [B, SUB_N, NUM_HEADS, HEAD_DIM]
         q = self.q_linear(x).view(B, -1, self.num_heads, self.head_dim)
-        kv = self.kv_linear(cond).view(1, -1, 2, self.num_heads, self.head_dim)
+        if kv is None:
+            kv = self.get_kv(cond)
         kv = split_forward_gather_backward(kv, get_sequence_parallel_group(), dim=3, grad_scale="down")
         k, v = kv.unbind(2)
 
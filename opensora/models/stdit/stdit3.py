@@ -1,3 +1,4 @@
+import copy
 import os
 
 import numpy as np
@@ -32,6 +33,60 @@ from opensora.models.layers.blocks import (
 from opensora.registry import MODELS
 from opensora.utils.ckpt_utils import load_checkpoint
 
+_COMPILED_REGIONS = {}
+
+
+class RegionSkeleton(nn.Module):
+    """
+    Runs `fn(block, *args)` on a copy of `block` whose parameters and buffers live on the meta device, the compiled
+    regions substitute those of the calling block.
+    """
+
+    def __init__(self, block, fn):
+        super().__init__()
+        self.block = copy.deepcopy(block).to("meta")
+        self.fn = fn
+
+    def forward(self, *args):
+        return self.fn(self.block, *args)
+
+
+def get_compiled_region(block, fn, mode=None):
+    """
+    Compile `fn` once and share it between all blocks of the same structure, so that every block reuses the same
+    graphs.
+
+    Sizes are dynamic from the first call, so the frame count T, the number of patches S and the batch size vary
+    across buckets and resolutions without recompiling. The graphs run on a shared skeleton and the weights of the
+    calling block are passed as inputs with `torch.func.functional_call`. Compiling `fn` on the blocks themselves
+    would guard on every block module on torch versions without `inline_inbuilt_nn_modules` (e.g. 2.2), recompile
+    once per block until `cache_size_limit` and silently run the remaining blocks eagerly.
+
+    Returns:
+        Callable: `region(block, *args)`
+    """
+    if block.region_key is None:
+        # the repr covers the layers and their hyperparameters, e.g. the drop path rate and quantized linears
+        block.region_key = (block.temporal, block.enable_flash_attn, repr(block))
+    key = (fn, mode, block.region_key)
+    if key not in _COMPILED_REGIONS:
+        skeleton = RegionSkeleton(block, fn)
+
+        def run(state, args):
+            return torch.func.functional_call(skeleton, state, args)
+
+        compiled = torch.compile(run, dynamic=True, mode=mode)
+
+        def region(block, *args):
+            if skeleton.training != block.training:
+                skeleton.train(block.training)
+            state = {f"block.{name}": tensor for name, tensor in block.named_parameters()}
+            state.update((f"block.{name}", tensor) for name, tensor in block.named_buffers())
+            return compiled(state, args)
+
+        _COMPILED_REGIONS[key] = region
+    return _COMPILED_REGIONS[key]
+
 
 class STDiT3Block(nn.Module):
     def __init__(
@@ -77,6 +132,11 @@ class STDiT3Block(nn.Module):
         self.drop_path = DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
         self.scale_shift_table = nn.Parameter(torch.randn(6, hidden_size) / hidden_size**0.5)
 
+        # regional compilation, see STDiT3.compile_blocks
+        self.compiled = False
+        self.compile_mode = None
+        self.region_key = None
+
     def t_mask_select(self, x_mask, x, masked_x, T, S):
         # x: [B, (T, S), C]
         # mased_x: [B, (T, S), C]
@@ -87,26 +147,21 @@ class STDiT3Block(nn.Module):
         x = rearrange(x, "B T S C -> B (T S) C")
         return x
 
-    def forward(
-        self,
-        x,
-        y,
-        t,
-        mask=None,  # text mask
-        x_mask=None,  # temporal mask
-        t0=None,  # t with timestamp=0
-        T=None,  # number of frames
-        S=None,  # number of pixel patches
-    ):
+    def get_modulation(self, t, t0, B):
+        modulation = (self.scale_shift_table[None] + t.reshape(B, 6, -1)).chunk(6, dim=1)
+        modulation_zero = None
+        if t0 is not None:
+            modulation_zero = (self.scale_shift_table[None] + t0.reshape(B, 6, -1)).chunk(6, dim=1)
+        return modulation, modulation_zero
+
+    def forward_attn(self, x, t, x_mask, t0, T, S):
         # prepare modulate parameters
         B, N, C = x.shape
-        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = (
-            self.scale_shift_table[None] + t.reshape(B, 6, -1)
-        ).chunk(6, dim=1)
+        (shift_msa, scale_msa, gate_msa, _, _, _), modulation_zero = self.get_modulation(
+            t, t0 if x_mask is not None else None, B
+        )
         if x_mask is not None:
-            shift_msa_zero, scale_msa_zero, gate_msa_zero, shift_mlp_zero, scale_mlp_zero, gate_mlp_zero = (
-                self.scale_shift_table[None] + t0.reshape(B, 6, -1)
-            ).chunk(6, dim=1)
+            shift_msa_zero, scale_msa_zero, gate_msa_zero, _, _, _ = modulation_zero
 
         # modulate (attention)
         x_m = t2i_modulate(self.norm1(x), shift_msa, scale_msa)
@@ -131,10 +186,16 @@ class STDiT3Block(nn.Module):
             x_m_s = self.t_mask_select(x_mask, x_m_s, x_m_s_zero, T, S)
 
         # residual
-        x = x + self.drop_path(x_m_s)
+        return x + self.drop_path(x_m_s)
 
-        # cross attention
-        x = x + self.cross_attn(x, y, mask)
+    def forward_mlp(self, x, t, x_mask, t0, T, S):
+        # prepare modulate parameters
+        B, N, C = x.shape
+        (_, _, _, shift_mlp, scale_mlp, gate_mlp), modulation_zero = self.get_modulation(
+            t, t0 if x_mask is not None else None, B
+        )
+        if x_mask is not None:
+            _, _, _, shift_mlp_zero, scale_mlp_zero, gate_mlp_zero = modulation_zero
 
         # modulate (MLP)
         x_m = t2i_modulate(self.norm2(x), shift_mlp, scale_mlp)
@@ -152,7 +213,34 @@ class STDiT3Block(nn.Module):
             x_m_s = self.t_mask_select(x_mask, x_m_s, x_m_s_zero, T, S)
 
         # residual
-        x = x + self.drop_path(x_m_s)
+        return x + self.drop_path(x_m_s)
+
+    def forward(
+        self,
+        x,
+        y,
+        t,
+        mask=None,  # text mask
+        x_mask=None,  # temporal mask
+        t0=None,  # t with timestamp=0
+        T=None,  # number of frames
+        S=None,  # number of pixel patches
+        kv=None,  # precomputed cross attention key/value of y
+    ):
+        if self.compiled:
+            forward_attn = get_compiled_region(self, STDiT3Block.forward_attn, self.compile_mode)
+            forward_mlp = get_compiled_region(self, STDiT3Block.forward_mlp, self.compile_mode)
+        else:
+            forward_attn, forward_mlp = STDiT3Block.forward_attn, STDiT3Block.forward_mlp
+
+        # modulate, self attention and residual
+        x = forward_attn(self, x, t, x_mask, t0, T, S)
+
+        # cross attention, eager since the packed captions and their lengths change with every prompt batch
+        x = x + self.cross_attn(x, y, mask, kv=kv)
+
+        # modulate, MLP and residual
+        x = forward_mlp(self, x, t, x_mask, t0, T, S)
 
         return x
 
@@ -182,6 +270,8 @@ class STDiT3Config(PretrainedConfig):
         only_train_temporal=False,
         freeze_y_embedder=False,
         skip_y_embedder=False,
+        compile_blocks=False,
+        compile_mode=None,
         **kwargs,
     ):
         self.input_size = input_size
@@ -204,6 +294,8 @@ class STDiT3Config(PretrainedConfig):
         self.only_train_temporal = only_train_temporal
         self.freeze_y_embedder = freeze_y_embedder
         self.skip_y_embedder = skip_y_embedder
+        self.compile_blocks = compile_blocks
+        self.compile_mode = compile_mode
         super().__init__(**kwargs)
 
 
@@ -304,6 +396,13 @@ class STDiT3(PreTrainedModel):
             for param in self.y_embedder.parameters():
                 param.requires_grad = False
 
+        # text condition cache for sampling, see cache_text_condition
+        self.text_cache = None
+        # step-to-step block residual cache for sampling, see enable_block_cache
+        self.block_cache = None
+        if config.compile_blocks:
+            self.compile_blocks(config.compile_mode)
+
     def initialize_weights(self):
         # Initialize transformer layers:
         def _basic_init(module):
@@ -352,6 +451,91 @@ class STDiT3(PreTrainedModel):
             y = y.squeeze(1).view(1, -1, self.hidden_size)
         return y, y_lens
 
+    def prepare_text_condition(self, y, mask=None):
+        if self.config.skip_y_embedder:
+            y_lens = mask
+            if isinstance(y_lens, torch.Tensor):
+                y_lens = y_lens.long().tolist()
+        else:
+            y, y_lens = self.encode_text(y, mask)
+        return y, y_lens
+
+    @torch.no_grad()
+    def cache_text_condition(self, y, mask=None):
+        """
+        Precompute the packed caption tokens, their lengths and the cross attention key/value of every block.
+
+        During sampling the caption is the same for all denoising steps, so the cached values are reused by every
+        forward call until clear_text_cache is called. This avoids running kv_linear in each block and the host sync
+        of encode_text at every step.
+        """
+        dtype = self.x_embedder.proj.weight.dtype
+        y, y_lens = self.prepare_text_condition(y.to(dtype), mask)
+        kv = [
+            (spatial_block.cross_attn.get_kv(y), temporal_block.cross_attn.get_kv(y))
+            for spatial_block, temporal_block in zip(self.spatial_blocks, self.temporal_blocks)
+        ]
+        self.text_cache = dict(y=y, y_lens=y_lens, kv=kv)
+
+    def get_text_cache(self, B):
+        """
+        Return the cached (y, y_lens, kv) for a batch of size B, or None if the cache cannot serve it.
+        A smaller batch uses the leading captions, e.g. the conditional half on steps without guidance.
+        """
+        if self.text_cache is None or B > len(self.text_cache["y_lens"]):
+            return None
+        y, y_lens, kv = self.text_cache["y"], self.text_cache["y_lens"], self.text_cache["kv"]
+        if B < len(y_lens):
+            # captions are packed along the token dim, so the first B captions are a prefix
+            num_tokens = sum(y_lens[:B])
+            y, y_lens = y[:, :num_tokens], y_lens[:B]
+            kv = [(spatial_kv[:, :num_tokens], temporal_kv[:, :num_tokens]) for spatial_kv, temporal_kv in kv]
+        return y, y_lens, kv
+
+    def clear_text_cache(self):
+        self.text_cache = None
+
+    def enable_block_cache(self, start, end):
+        """
+        Reuse the residual of block pairs [start, end) from the last refresh step.
+
+        When `self.block_cache["refresh"]` is True, the blocks are computed and their combined residual
+        (output minus input) is stored; otherwise only the blocks outside the range are computed and the stored
+        residual is added instead. The caller (e.g. RFLOW.sample) toggles `refresh` per denoising step.
+        Residuals are kept per input shape, so steps with and without guidance batches do not evict each other.
+        """
+        assert 0 <= start < end <= self.depth, f"Invalid block range [{start}, {end}) for depth {self.depth}"
+        self.block_cache = dict(start=start, end=end, refresh=True, residuals={})
+
+    def disable_block_cache(self):
+        self.block_cache = None
+
+    def compile_blocks(self, mode=None, enabled=True):
+        """
+        Compile the modulation, self-attention and MLP regions of the blocks with torch.compile.
+
+        The regions are compiled once and shared by all spatial and temporal blocks with dynamic shapes, see
+        `get_compiled_region`, so compilation cost does not grow with depth and new (T, H, W) buckets do not
+        recompile. Separate graphs are only built for spatial/temporal blocks, blocks with different drop path
+        rates, with/without `x_mask`, and for T == 1 or S == 1, which dynamo specializes. Cross attention stays eager.
+
+        Args:
+            mode (str): torch.compile mode, e.g. "max-autotune-no-cudagraphs"
+            enabled (bool): False to restore eager blocks
+        """
+        assert not (enabled and self.enable_sequence_parallelism), "Compiled blocks do not support sequence parallel"
+        for block in list(self.spatial_blocks) + list(self.temporal_blocks):
+            block.compiled, block.compile_mode = enabled, mode
+            block.region_key = None  # recomputed on the next call, the layers may have been replaced meanwhile
+
+    def forward_blocks(self, x, y, t_mlp, y_lens, x_mask, t0_mlp, T, S, text_kv, start=0, end=None):
+        end = self.depth if end is None else end
+        for i in range(start, end):
+            spatial_kv, temporal_kv = text_kv[i]
+            x = auto_grad_checkpoint(self.spatial_blocks[i], x, y, t_mlp, y_lens, x_mask, t0_mlp, T, S, spatial_kv)
+            x = auto_grad_checkpoint(self.temporal_blocks[i], x, y, t_mlp, y_lens, x_mask, t0_mlp, T, S, temporal_kv)
+        return x
+
     def forward(self, x, timestep, y, mask=None, x_mask=None, fps=None, height=None, width=None, **kwargs):
         dtype = self.x_embedder.proj.weight.dtype
         B = x.size(0)
@@ -399,12 +583,12 @@ class STDiT3(PreTrainedModel):
             t0_mlp = self.t_block(t0)
 
         # === get y embed ===
-        if self.config.skip_y_embedder:
-            y_lens = mask
-            if isinstance(y_lens, torch.Tensor):
-                y_lens = y_lens.long().tolist()
+        text_cache = self.get_text_cache(B)
+        if text_cache is not None:
+            y, y_lens, text_kv = text_cache
         else:
-            y, y_lens = self.encode_text(y, mask)
+            y, y_lens = self.prepare_text_condition(y, mask)
+            text_kv = [(None, None)] * self.depth
 
         # === get x embed ===
         x = self.x_embedder(x)  # [B, N, C]
@@ -419,9 +603,20 @@ class STDiT3(PreTrainedModel):
         x = rearrange(x, "B T S C -> B (T S) C", T=T, S=S)
 
         # === blocks ===
-        for spatial_block, temporal_block in zip(self.spatial_blocks, self.temporal_blocks):
-            x = auto_grad_checkpoint(spatial_block, x, y, t_mlp, y_lens, x_mask, t0_mlp, T, S)
-            x = auto_grad_checkpoint(temporal_block, x, y, t_mlp, y_lens, x_mask, t0_mlp, T, S)
+        block_args = (y, t_mlp, y_lens, x_mask, t0_mlp, T, S, text_kv)
+        if self.block_cache is None:
+            x = self.forward_blocks(x, *block_args)
+        else:
+            start, end = self.block_cache["start"], self.block_cache["end"]
+            x = self.forward_blocks(x, *block_args, end=start)
+            residual = self.block_cache["residuals"].get(x.shape)
+            if self.block_cache["refresh"] or residual is None:
+                x_start = x
+                x = self.forward_blocks(x, *block_args, start=start, end=end)
+                self.block_cache["residuals"][x.shape] = x - x_start
+            else:
+                x = x + residual
+            x = self.forward_blocks(x, *block_args, start=end)
 
         if self.enable_sequence_parallelism:
             x = rearrange(x, "B (T S) C -> B T S C", T=T, S=S)
@@ -477,6 +672,16 @@ def STDiT3_XL_2(from_pretrained=None, **kwargs):
     return model
 
 
+@MODELS.register_module("STDiT3-Tiny/2")
+def STDiT3_Tiny_2(from_pretrained=None, **kwargs):
+    # randomly initialized by default, for tests and serving smoke runs
+    config = STDiT3Config(depth=2, hidden_size=128, patch_size=(1, 2, 2), num_heads=4, **kwargs)
+    model = STDiT3(config)
+    if from_pretrained is not None:
+        load_checkpoint(model, from_pretrained)
+    return model
+
+
 @MODELS.register_module("STDiT3-3B/2")
 def STDiT3_3B_2(from_pretrained=None, **kwargs):
     force_huggingface = kwargs.pop("force_huggingface", False)
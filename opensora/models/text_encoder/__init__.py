@@ -1,3 +1,4 @@
 from .classes import ClassEncoder
 from .clip import ClipEncoder
+from .random_text import RandomTextEncoder
 from .t5 import T5Encoder
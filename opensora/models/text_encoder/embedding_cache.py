@@ -0,0 +1,112 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class TextEmbeddingCache:
+    """
+    Content-addressed cache for text encoder outputs.
+
+    Entries are keyed by (model id, max length, preprocessed prompt). A bounded LRU dict keeps recently used
+    embeddings in host memory, and an optional on-disk tier stores one file per prompt holding only the unpadded
+    tokens; those files are memory-mapped on load. The mask is implied by the number of stored tokens, and the
+    padded positions are filled with zeros when the batch is assembled.
+
+    Args:
+        model_id (str): identifies the encoder weights, e.g. the `from_pretrained` path and dtype
+        model_max_length (int): padded sequence length
+        cache_dir (str): directory of the on-disk tier, None to keep the cache in memory only
+        max_memory_items (int): number of prompts kept in the in-memory LRU tier
+    """
+
+    def __init__(self, model_id, model_max_length, cache_dir=None, max_memory_items=256):
+        self.model_id = model_id
+        self.model_max_length = model_max_length
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.memory = OrderedDict()
+        # prompts are encoded from the prefetch thread while the main thread may encode as well
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, text):
+        content = f"{self.model_id}\0{self.model_max_length}\0{text}"
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pt")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        if self.cache_dir is not None and os.path.exists(self.path(key)):
+            emb = torch.load(self.path(key), map_location="cpu", mmap=True)
+            self.put_memory(key, emb)
+            return emb
+        return None
+
+    def put_memory(self, key, emb):
+        if self.max_memory_items <= 0:
+            return
+        with self.lock:
+            self.memory[key] = emb
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_items:
+                self.memory.popitem(last=False)
+
+    def put(self, key, emb):
+        emb = emb.detach().to("cpu").contiguous().clone()
+        self.put_memory(key, emb)
+        if self.cache_dir is not None:
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first so that concurrent readers never see partial entries
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            torch.save(emb, tmp_path)
+            os.replace(tmp_path, path)
+
+    def get_text_embeddings(self, texts, encode_fn, device):
+        """
+        Look up `texts` in the cache and run `encode_fn` only on the misses.
+
+        Args:
+            texts (list[str]): preprocessed prompts
+            encode_fn (Callable): returns padded embeddings [B, N, C] and attention mask [B, N] for a list of texts
+            device (torch.device): device of the returned tensors
+
+        Returns:
+            tuple: zero-padded embeddings [B, N, C] and mask [B, N]
+        """
+        keys = [self.key(text) for text in texts]
+        embs = [self.get(key) for key in keys]
+
+        miss_idx = [i for i, emb in enumerate(embs) if emb is None]
+        with self.lock:
+            self.hits += len(texts) - len(miss_idx)
+            self.misses += len(miss_idx)
+        if len(miss_idx) > 0:
+            # deduplicate so that repeated prompts in a batch are encoded once
+            miss_texts = list(OrderedDict.fromkeys(texts[i] for i in miss_idx))
+            miss_embs, miss_masks = encode_fn(miss_texts)
+            computed = {}
+            for text, emb, length in zip(miss_texts, miss_embs, miss_masks.sum(dim=1).tolist()):
+                computed[text] = emb[:length]
+                self.put(self.key(text), emb[:length])
+            for i in miss_idx:
+                embs[i] = computed[texts[i]]
+
+        dim = embs[0].shape[-1]
+        dtype = embs[0].dtype
+        y = torch.zeros(len(texts), self.model_max_length, dim, dtype=dtype, device=device)
+        mask = torch.zeros(len(texts), self.model_max_length, dtype=torch.long, device=device)
+        for i, emb in enumerate(embs):
+            y[i, : emb.shape[0]] = emb.to(device)
+            mask[i, : emb.shape[0]] = 1
+        return y, mask
@@ -0,0 +1,34 @@
+import hashlib
+
+import torch
+
+from opensora.registry import MODELS
+
+
+@MODELS.register_module("random_text")
+class RandomTextEncoder:
+    """
+    Text encoder stand-in with deterministic pseudo-random embeddings, for tiny test configs without T5 weights.
+    The same prompt always maps to the same embedding, and its mask covers one token per word.
+    """
+
+    def __init__(self, output_dim=64, model_max_length=20, device="cuda", dtype=torch.float):
+        self.output_dim = output_dim
+        self.model_max_length = model_max_length
+        self.device = device
+        self.dtype = dtype
+        self.y_embedder = None
+
+    def encode(self, text):
+        y = torch.zeros(len(text), 1, self.model_max_length, self.output_dim, dtype=self.dtype)
+        mask = torch.zeros(len(text), self.model_max_length, dtype=torch.long)
+        for i, t in enumerate(text):
+            seed = int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:8], 16)
+            generator = torch.Generator().manual_seed(seed)
+            y[i, 0] = torch.randn(self.model_max_length, self.output_dim, generator=generator)
+            mask[i, : max(1, min(len(t.split()), self.model_max_length))] = 1
+        return dict(y=y.to(self.device), mask=mask.to(self.device))
+
+    def null(self, n):
+        null_y = self.y_embedder.y_embedding[None].repeat(n, 1, 1)[:, None]
+        return null_y
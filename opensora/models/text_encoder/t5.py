@@ -30,6 +30,8 @@ from transformers import AutoTokenizer, T5EncoderModel
 
 from opensora.registry import MODELS
 
+from .embedding_cache import TextEmbeddingCache
+
 
 class T5Embedder:
     def __init__(
@@ -142,6 +144,9 @@ class T5Encoder:
         cache_dir=None,
         shardformer=False,
         local_files_only=False,
+        embedding_cache=False,
+        embedding_cache_dir=None,
+        embedding_cache_size=256,
     ):
         assert from_pretrained is not None, "Please specify the path to the T5 model"
 
@@ -163,6 +168,15 @@ class T5Encoder:
         if shardformer:
             self.shardformer_t5()
 
+        self.embedding_cache = None
+        if embedding_cache or embedding_cache_dir is not None:
+            self.embedding_cache = TextEmbeddingCache(
+                model_id=f"{from_pretrained}:{dtype}",
+                model_max_length=model_max_length,
+                cache_dir=embedding_cache_dir,
+                max_memory_items=embedding_cache_size,
+            )
+
     def shardformer_t5(self):
         from colossalai.shardformer import ShardConfig, ShardFormer
 
@@ -187,7 +201,12 @@ class T5Encoder:
         requires_grad(self.t5.model, False)
 
     def encode(self, text):
-        caption_embs, emb_masks = self.t5.get_text_embeddings(text)
+        if self.embedding_cache is not None:
+            caption_embs, emb_masks = self.embedding_cache.get_text_embeddings(
+                text, self.t5.get_text_embeddings, self.t5.device
+            )
+        else:
+            caption_embs, emb_masks = self.t5.get_text_embeddings(text)
         caption_embs = caption_embs[:, None]
         return dict(y=caption_embs, mask=emb_masks)
 
@@ -1,3 +1,4 @@
 from .discriminator import DISCRIMINATOR_3D
+from .preview import LatentPreviewDecoder
 from .vae import VideoAutoencoderKL, VideoAutoencoderKLTemporalDecoder
 from .vae_temporal import VAE_Temporal
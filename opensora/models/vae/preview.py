@@ -0,0 +1,77 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from opensora.registry import MODELS
+from opensora.utils.ckpt_utils import load_checkpoint
+
+
+@MODELS.register_module()
+class LatentPreviewDecoder(nn.Module):
+    """
+    Cheap latent-to-RGB decoder for progressive previews.
+
+    Every latent pixel is mapped to an RGB value in [-1, 1] by a linear projection fitted against the full VAE decoder
+    with `fit`, so a preview costs a 1x1 convolution instead of a VAE decode. Previews have one frame per latent frame
+    and the spatial resolution of the latent, optionally upsampled by `upsample`.
+
+    Args:
+        in_channels (int): latent channels
+        upsample (int): spatial upsampling factor of the previews
+        from_pretrained (str): path of a fitted state dict
+    """
+
+    def __init__(self, in_channels=4, upsample=1, from_pretrained=None):
+        super().__init__()
+        self.in_channels = in_channels
+        self.upsample = upsample
+        self.proj = nn.Conv3d(in_channels, 3, kernel_size=1)
+        if from_pretrained is not None:
+            load_checkpoint(self, from_pretrained, strict=True)
+
+    def forward(self, z):
+        """
+        Args:
+            z (torch.Tensor): [B, C, T, H, W] latents
+
+        Returns:
+            torch.Tensor: [B, 3, T, H * upsample, W * upsample] frames in [-1, 1]
+        """
+        x = self.proj(z.to(self.proj.weight.dtype)).clamp(-1, 1)
+        if self.upsample > 1:
+            x = F.interpolate(x, scale_factor=(1, self.upsample, self.upsample), mode="nearest")
+        return x
+
+    @staticmethod
+    def align(z, x):
+        """
+        Pool decoded frames `x` [B, 3, T', H', W'] to the latent grid of `z` [B, C, T, H, W]: spatially by area and
+        temporally by picking evenly spaced frames.
+        """
+        frame_ids = torch.linspace(0, x.size(2) - 1, z.size(2), device=x.device).round().long()
+        x = x.index_select(2, frame_ids)
+        return F.interpolate(x.float(), size=z.shape[2:], mode="area")
+
+    @torch.no_grad()
+    def fit(self, latents, videos):
+        """
+        Least-squares fit of the projection.
+
+        Args:
+            latents (list[torch.Tensor]): [B, C, T, H, W] latents
+            videos (list[torch.Tensor]): [B, 3, T', H', W'] frames decoded from them in [-1, 1]
+
+        Returns:
+            float: PSNR in dB of the fitted previews against the pooled decoded frames
+        """
+        inputs, targets = [], []
+        for z, x in zip(latents, videos):
+            inputs.append(z.float().movedim(1, -1).reshape(-1, z.size(1)))
+            targets.append(self.align(z, x).movedim(1, -1).reshape(-1, 3))
+        inputs, targets = torch.cat(inputs), torch.cat(targets)
+        inputs = torch.cat([inputs, torch.ones_like(inputs[:, :1])], dim=1)  # bias
+        solution = torch.linalg.lstsq(inputs.cpu(), targets.cpu()).solution
+        self.proj.weight.copy_(solution[:-1].T[:, :, None, None, None])
+        self.proj.bias.copy_(solution[-1])
+        mse = (inputs.cpu() @ solution).clamp(-1, 1).sub(targets.cpu()).pow(2).mean()
+        return (10 * torch.log10(4 / mse)).item()  # peak-to-peak range of 2
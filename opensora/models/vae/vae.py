@@ -10,6 +10,68 @@ from opensora.registry import MODELS, build_module
 from opensora.utils.ckpt_utils import load_checkpoint
 
 
+def get_tile_starts(size, tile_size, stride):
+    if size <= tile_size:
+        return [0]
+    starts = list(range(0, size - tile_size + 1, stride))
+    if starts[-1] + tile_size < size:
+        starts.append(size - tile_size)
+    return starts
+
+
+def get_feather_weight(size, ramp, is_first, is_last, device):
+    # linear ramps on the sides that overlap a neighbouring tile, strictly positive so the weights never sum to 0
+    weight = torch.ones(size, device=device)
+    ramp = min(ramp, size // 2)
+    if ramp > 0:
+        ramp_up = torch.arange(1, ramp + 1, device=device, dtype=torch.float32) / (ramp + 1)
+        if not is_first:
+            weight[:ramp] = ramp_up
+        if not is_last:
+            weight[-ramp:] = ramp_up.flip(0)
+    return weight
+
+
+def tiled_forward(fn, x, tile_size, tile_overlap, scale):
+    """
+    Apply a spatial function tile by tile and blend the outputs with feathered weights across the seams.
+
+    Args:
+        fn (Callable): maps [N, C, h, w] to [N, C', h * scale, w * scale]
+        x (Tensor): input of shape [N, C, H, W]
+        tile_size (int): tile size in input pixels
+        tile_overlap (int): overlap between neighbouring tiles in input pixels
+        scale (float): output resolution divided by input resolution, e.g. 1/8 for encode and 8 for decode
+
+    Returns:
+        Tensor: output of shape [N, C', H * scale, W * scale]
+    """
+    H, W = x.shape[-2:]
+    stride = tile_size - tile_overlap
+    assert stride > 0, f"Tile overlap {tile_overlap} must be smaller than tile size {tile_size}"
+    h_starts, w_starts = get_tile_starts(H, tile_size, stride), get_tile_starts(W, tile_size, stride)
+    if len(h_starts) == 1 and len(w_starts) == 1:
+        return fn(x)
+
+    out = weight_sum = None
+    ramp = int(tile_overlap * scale)
+    for i, h in enumerate(h_starts):
+        for j, w in enumerate(w_starts):
+            tile = fn(x[:, :, h : h + tile_size, w : w + tile_size])
+            if out is None:
+                out_shape = (x.shape[0], tile.shape[1], int(H * scale), int(W * scale))
+                out = torch.zeros(out_shape, device=tile.device, dtype=torch.float32)
+                weight_sum = torch.zeros(out_shape[-2:], device=tile.device, dtype=torch.float32)
+            th, tw = tile.shape[-2:]
+            weight_h = get_feather_weight(th, ramp, i == 0, i == len(h_starts) - 1, tile.device)
+            weight_w = get_feather_weight(tw, ramp, j == 0, j == len(w_starts) - 1, tile.device)
+            weight = weight_h[:, None] * weight_w[None, :]
+            oh, ow = int(h * scale), int(w * scale)
+            out[:, :, oh : oh + th, ow : ow + tw] += tile.float() * weight
+            weight_sum[oh : oh + th, ow : ow + tw] += weight
+    return (out / weight_sum).to(x.dtype)
+
+
 @MODELS.register_module()
 class VideoAutoencoderKL(nn.Module):
     def __init__(
@@ -20,18 +82,52 @@ class VideoAutoencoderKL(nn.Module):
         local_files_only=False,
         subfolder=None,
         scaling_factor=0.18215,
+        tile_size=None,
+        tile_overlap=64,
+        config=None,
     ):
         super().__init__()
-        self.module = AutoencoderKL.from_pretrained(
-            from_pretrained,
-            cache_dir=cache_dir,
-            local_files_only=local_files_only,
-            subfolder=subfolder,
-        )
+        if from_pretrained is None:
+            # randomly initialized from a diffusers AutoencoderKL config, e.g. for tiny test configs
+            self.module = AutoencoderKL(**(config or {}))
+        else:
+            self.module = AutoencoderKL.from_pretrained(
+                from_pretrained,
+                cache_dir=cache_dir,
+                local_files_only=local_files_only,
+                subfolder=subfolder,
+            )
         self.out_channels = self.module.config.latent_channels
         self.patch_size = (1, 8, 8)
         self.micro_batch_size = micro_batch_size
         self.scaling_factor = scaling_factor
+        # tiles are given in pixels, decoding uses the corresponding latent tiles
+        if tile_size is not None:
+            assert (
+                tile_size % self.patch_size[1] == 0 and tile_overlap % self.patch_size[1] == 0
+            ), f"Tile size and overlap must be divisible by {self.patch_size[1]}"
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+    def encode_frames(self, x):
+        def encode_fn(x):
+            return self.module.encode(x).latent_dist.sample()
+
+        if self.tile_size is None:
+            x = encode_fn(x)
+        else:
+            x = tiled_forward(encode_fn, x, self.tile_size, self.tile_overlap, 1 / self.patch_size[1])
+        return x.mul_(self.scaling_factor)
+
+    def decode_frames(self, x):
+        def decode_fn(x):
+            return self.module.decode(x).sample
+
+        x = x / self.scaling_factor
+        if self.tile_size is None:
+            return decode_fn(x)
+        p = self.patch_size[1]
+        return tiled_forward(decode_fn, x, self.tile_size // p, self.tile_overlap // p, p)
 
     def encode(self, x):
         # x: (B, C, T, H, W)
@@ -39,14 +135,14 @@ class VideoAutoencoderKL(nn.Module):
         x = rearrange(x, "B C T H W -> (B T) C H W")
 
         if self.micro_batch_size is None:
-            x = self.module.encode(x).latent_dist.sample().mul_(self.scaling_factor)
+            x = self.encode_frames(x)
         else:
             # NOTE: cannot be used for training
             bs = self.micro_batch_size
             x_out = []
             for i in range(0, x.shape[0], bs):
                 x_bs = x[i : i + bs]
-                x_bs = self.module.encode(x_bs).latent_dist.sample().mul_(self.scaling_factor)
+                x_bs = self.encode_frames(x_bs)
                 x_out.append(x_bs)
             x = torch.cat(x_out, dim=0)
         x = rearrange(x, "(B T) C H W -> B C T H W", B=B)
@@ -57,14 +153,14 @@ class VideoAutoencoderKL(nn.Module):
         B = x.shape[0]
         x = rearrange(x, "B C T H W -> (B T) C H W")
         if self.micro_batch_size is None:
-            x = self.module.decode(x / self.scaling_factor).sample
+            x = self.decode_frames(x)
         else:
             # NOTE: cannot be used for training
             bs = self.micro_batch_size
             x_out = []
             for i in range(0, x.shape[0], bs):
                 x_bs = x[i : i + bs]
-                x_bs = self.module.decode(x_bs / self.scaling_factor).sample
+                x_bs = self.decode_frames(x_bs)
                 x_out.append(x_bs)
             x = torch.cat(x_out, dim=0)
         x = rearrange(x, "(B T) C H W -> B C T H W", B=B)
@@ -220,6 +316,47 @@ class VideoAutoencoderPipeline(PreTrainedModel):
         else:
             return x
 
+    def decode_chunks(self, z, num_frames=None):
+        """
+        Decode `z` one temporal micro-batch at a time, yielding pixel chunks of shape [B, C, T_chunk, H, W].
+        The concatenated chunks equal `decode(z, num_frames)`, but only one chunk is alive at a time, so a video
+        can be streamed into a writer with memory bounded by `micro_frame_size` frames.
+        """
+        assert not self.cal_loss, "Streaming decode is only available for inference"
+        z = z * self.scale.to(z.dtype) + self.shift.to(z.dtype)
+
+        if self.micro_frame_size is None:
+            yield self.spatial_vae.decode(self.temporal_vae.decode(z, num_frames=num_frames))
+            return
+        for i in range(0, z.size(2), self.micro_z_frame_size):
+            z_bs = z[:, :, i : i + self.micro_z_frame_size]
+            x_z_bs = self.temporal_vae.decode(z_bs, num_frames=min(self.micro_frame_size, num_frames))
+            num_frames -= self.micro_frame_size
+            yield self.spatial_vae.decode(x_z_bs)
+
+    def encode_stream(self, chunks):
+        """
+        Encode an arbitrarily long video chunk by chunk, yielding normalized latent chunks. The temporal VAE keeps its
+        causal context across chunks, so memory is bounded by one chunk. Its GroupNorm layers only see the frames so
+        far, so the latents approximate a whole-clip pass, see `VAE_Temporal.encode_stream`.
+        Unlike `encode`, which restarts the temporal VAE every `micro_frame_size` frames, the latents follow the
+        layout of a single whole-clip pass; decode them with `decode_stream`.
+
+        Args:
+            chunks (Iterable[Tensor]): consecutive chunks [B, C, T_i, H, W], see `VAE_Temporal.encode_stream`
+        """
+        x_z_chunks = (self.spatial_vae.encode(x) for x in chunks)
+        for posterior in self.temporal_vae.encode_stream(x_z_chunks):
+            yield (posterior.sample() - self.shift) / self.scale
+
+    def decode_stream(self, chunks, num_frames):
+        """
+        Decode latent chunks produced by `encode_stream`, yielding pixel chunks [B, C, T_i, H, W].
+        """
+        z_chunks = (z * self.scale.to(z.dtype) + self.shift.to(z.dtype) for z in chunks)
+        for x_z in self.temporal_vae.decode_stream(z_chunks, num_frames):
+            yield self.spatial_vae.decode(x_z)
+
     def forward(self, x):
         assert self.cal_loss, "This method is only available when cal_loss is True"
         z, posterior, x_z = self.encode(x)
@@ -260,6 +397,8 @@ def OpenSoraVAE_V1_2(
     freeze_vae_2d=False,
     cal_loss=False,
     force_huggingface=False,
+    tile_size=None,
+    tile_overlap=64,
 ):
     vae_2d = dict(
         type="VideoAutoencoderKL",
@@ -267,6 +406,8 @@ def OpenSoraVAE_V1_2(
         subfolder="vae",
         micro_batch_size=micro_batch_size,
         local_files_only=local_files_only,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
     )
     vae_temporal = dict(
         type="VAE_Temporal_SD",
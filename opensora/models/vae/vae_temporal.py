@@ -1,5 +1,6 @@
 from typing import Tuple, Union
 
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from einops import rearrange
@@ -64,11 +65,64 @@ class CausalConv3d(nn.Module):
         dilation = (dilation, 1, 1)
         self.conv = nn.Conv3d(chan_in, chan_out, kernel_size, stride=stride, dilation=dilation, **kwargs)
 
+        # streaming mode: the frames not yet consumed by the temporal kernel are carried to the next chunk
+        self.streaming = False
+        self.cache = None
+
     def forward(self, x):
+        if self.streaming:
+            return self.forward_stream(x)
         x = F.pad(x, self.time_causal_padding, mode=self.pad_mode)
         x = self.conv(x)
         return x
 
+    def forward_stream(self, x):
+        if self.cache is None:
+            x = F.pad(x, self.time_causal_padding, mode=self.pad_mode)
+        else:
+            # only the first chunk is padded in time, later chunks continue from the cached frames
+            x = F.pad(x, (*self.time_causal_padding[:4], 0, 0), mode=self.pad_mode)
+            x = torch.cat([self.cache, x], dim=2)
+        kernel_size = self.conv.dilation[0] * (self.conv.kernel_size[0] - 1) + 1
+        stride = self.conv.stride[0]
+        num_out = (x.size(2) - kernel_size) // stride + 1
+        assert num_out > 0, f"Chunk of {x.size(2)} frames is too short for a temporal kernel of {kernel_size}"
+        self.cache = x[:, :, num_out * stride :]
+        return self.conv(x)
+
+
+class StreamingGroupNorm(nn.GroupNorm):
+    """
+    GroupNorm that, in streaming mode, normalizes each chunk with the running statistics of all frames seen so far.
+
+    A whole-clip pass normalizes with statistics over every frame, including future ones, which a causal stream
+    cannot know. Carrying the running sums keeps the statistics from jumping between chunks and makes them converge to
+    the whole-clip ones, but streamed outputs are an approximation unless the whole clip fits in one chunk. The
+    parameters are those of `nn.GroupNorm`, so checkpoints load unchanged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streaming = False
+        self.stats = None  # running sum, sum of squares and count per sample and group
+
+    def forward(self, x):
+        if not self.streaming:
+            return super().forward(x)
+        x_group = x.float().reshape(x.size(0), self.num_groups, -1)
+        stats = (x_group.sum(-1), x_group.pow(2).sum(-1), x_group.size(-1))
+        if self.stats is not None:
+            stats = tuple(prev + cur for prev, cur in zip(self.stats, stats))
+        self.stats = stats
+        mean = stats[0] / stats[2]
+        var = (stats[1] / stats[2] - mean.pow(2)).clamp_min(0)
+        x_group = (x_group - mean[..., None]) * torch.rsqrt(var[..., None] + self.eps)
+        x = x_group.reshape(x.shape).to(x.dtype)
+        if self.affine:
+            shape = (1, -1) + (1,) * (x.ndim - 2)
+            x = x * self.weight.view(shape) + self.bias.view(shape)
+        return x
+
 
 class ResBlock(nn.Module):
     def __init__(
@@ -87,9 +141,9 @@ class ResBlock(nn.Module):
         self.use_conv_shortcut = use_conv_shortcut
 
         # SCH: MAGVIT uses GroupNorm by default
-        self.norm1 = nn.GroupNorm(num_groups, in_channels)
+        self.norm1 = StreamingGroupNorm(num_groups, in_channels)
         self.conv1 = conv_fn(in_channels, self.filters, kernel_size=(3, 3, 3), bias=False)
-        self.norm2 = nn.GroupNorm(num_groups, self.filters)
+        self.norm2 = StreamingGroupNorm(num_groups, self.filters)
         self.conv2 = conv_fn(self.filters, self.filters, kernel_size=(3, 3, 3), bias=False)
         if in_channels != filters:
             if self.use_conv_shortcut:
@@ -197,7 +251,7 @@ class Encoder(nn.Module):
             prev_filters = filters  # update in_channels
 
         # MAGVIT uses Group Normalization
-        self.norm1 = nn.GroupNorm(self.num_groups, prev_filters)
+        self.norm1 = StreamingGroupNorm(self.num_groups, prev_filters)
 
         self.conv2 = self.conv_fn(prev_filters, self.embedding_dim, kernel_size=(1, 1, 1), padding="same")
 
@@ -294,7 +348,7 @@ class Decoder(nn.Module):
                         nn.Identity(prev_filters),
                     )
 
-        self.norm1 = nn.GroupNorm(self.num_groups, prev_filters)
+        self.norm1 = StreamingGroupNorm(self.num_groups, prev_filters)
 
         self.conv_out = self.conv_fn(filters, in_out_channels, 3)
 
@@ -408,6 +462,70 @@ class VAE_Temporal(nn.Module):
         x = x[:, :, time_padding:]
         return x
 
+    def set_streaming(self, streaming):
+        """
+        Switch all causal convolutions and group norms to or from streaming mode and clear their left-context caches
+        and running statistics.
+        """
+        for module in self.modules():
+            if isinstance(module, CausalConv3d):
+                module.streaming = streaming
+                module.cache = None
+            elif isinstance(module, StreamingGroupNorm):
+                module.streaming = streaming
+                module.stats = None
+
+    def encode_stream(self, chunks):
+        """
+        Encode a long video chunk by chunk in constant memory. The causal convolutions carry their left context
+        between chunks and are exact, but GroupNorm only knows the frames seen so far and uses their running
+        statistics, so the result approximates one `encode` call on the whole clip and equals it only for a single
+        chunk. Only one stream can run on a model at a time.
+
+        Args:
+            chunks (Iterable[Tensor]): consecutive chunks [B, C, T_i, H, W]. The first chunk is padded at the front to
+                a multiple of `time_downsample_factor`, the following chunks must be multiples of it.
+
+        Yields:
+            DiagonalGaussianDistribution: posterior of each chunk
+        """
+        self.set_streaming(True)
+        try:
+            for i, x in enumerate(chunks):
+                if i == 0:
+                    x = pad_at_dim(x, ((-x.shape[2]) % self.time_downsample_factor, 0), dim=2)
+                assert (
+                    x.shape[2] % self.time_downsample_factor == 0
+                ), f"Chunk length must be a multiple of {self.time_downsample_factor}, got {x.shape[2]}"
+                moments = self.quant_conv(self.encoder(x)).to(x.dtype)
+                yield DiagonalGaussianDistribution(moments)
+        finally:
+            self.set_streaming(False)
+
+    def decode_stream(self, chunks, num_frames):
+        """
+        Decode latents chunk by chunk in constant memory, the counterpart of `encode_stream`, with the same GroupNorm
+        approximation.
+
+        Args:
+            chunks (Iterable[Tensor]): consecutive latent chunks [B, C, t_i, H, W] of any length
+            num_frames (int): number of frames of the whole video
+
+        Yields:
+            Tensor: decoded frames of each chunk
+        """
+        time_padding = (-num_frames) % self.time_downsample_factor
+        self.set_streaming(True)
+        try:
+            for z in chunks:
+                x = self.decoder(self.post_quant_conv(z))
+                # the front padding of the whole video is removed from the first decoded frames
+                drop = min(time_padding, x.size(2))
+                time_padding -= drop
+                yield x[:, :, drop:]
+        finally:
+            self.set_streaming(False)
+
     def forward(self, x, sample_posterior=True):
         posterior = self.encode(x)
         if sample_posterior:
@@ -1,3 +1,3 @@
 from .dpms import DPMS
 from .iddpm import IDDPM
-from .rf import RFLOW
+from .rf import RFLOW, RFLOWDPMSolver, RFLOWHeun
@@ -2,10 +2,91 @@ import torch
 from tqdm import tqdm
 
 from opensora.registry import SCHEDULERS
+from opensora.utils.misc import get_logger, synchronized_time
 
 from .rectified_flow import RFlowScheduler, timestep_transform
 
 
+def randn_per_sample(x, generators=None):
+    """
+    Noise shaped like `x`, drawn from one generator per sample so that it does not depend on the batch composition.
+    Falls back to the global RNG when `generators` is None.
+    """
+    if generators is None:
+        return torch.randn_like(x)
+    return torch.stack(
+        [torch.randn(x.shape[1:], generator=generator, device=x.device, dtype=x.dtype) for generator in generators]
+    )
+
+
+def get_block_cache_refresh_steps(
+    num_sampling_steps, refresh_interval=2, warmup_steps=1, cooldown_steps=0, refresh_steps=None, **kwargs
+):
+    """
+    Decide at which sampling steps the cached blocks are recomputed.
+
+    Args:
+        refresh_interval (int): recompute every `refresh_interval` steps after warmup
+        warmup_steps (int): number of leading steps that are always computed in full
+        cooldown_steps (int): number of trailing steps that are always computed in full
+        refresh_steps (list[int]): explicit step indices to recompute, overrides the options above. The first step
+            always runs in full since there is no cached residual yet, indices outside the schedule are ignored.
+    """
+    if refresh_steps is not None:
+        return [i == 0 or i in refresh_steps for i in range(num_sampling_steps)]
+    return [
+        i < warmup_steps
+        or i >= num_sampling_steps - cooldown_steps
+        or (i - warmup_steps) % max(refresh_interval, 1) == 0
+        for i in range(num_sampling_steps)
+    ]
+
+
+def get_guidance_scales(num_sampling_steps, guidance_scale, scales=None, interval=None, cond_only_steps=None):
+    """
+    Compute the classifier-free guidance scale of every sampling step. A scale of 1.0 means the step has no
+    guidance and only the conditional branch is evaluated.
+
+    Args:
+        guidance_scale (float): scale of the guided steps
+        scales (list[float]): explicit per-step scales, overrides `guidance_scale`
+        interval (tuple[float, float]): guidance is only applied to steps whose position `i / num_sampling_steps`
+            lies in [start, end), e.g. (0.0, 0.7) skips guidance on the last 30% of the steps
+        cond_only_steps (list[int]): step indices that run without guidance
+    """
+    if scales is not None:
+        assert len(scales) == num_sampling_steps, f"Expected {num_sampling_steps} guidance scales, got {len(scales)}"
+        guidance_scales = list(scales)
+    else:
+        guidance_scales = [guidance_scale] * num_sampling_steps
+    if interval is not None:
+        start, end = interval
+        guidance_scales = [
+            scale if start <= i / num_sampling_steps < end else 1.0 for i, scale in enumerate(guidance_scales)
+        ]
+    if cond_only_steps is not None:
+        guidance_scales = [1.0 if i in cond_only_steps else scale for i, scale in enumerate(guidance_scales)]
+    return guidance_scales
+
+
+def resample_cfg_schedule(cfg_schedule, num_steps, num_sampling_steps):
+    """
+    Map a `cfg_schedule` written for `num_steps` sampling steps to `num_sampling_steps` steps by relative position,
+    e.g. for the draft of cascade sampling. `interval` is relative already and kept as is.
+    """
+    if cfg_schedule is None or num_steps == num_sampling_steps:
+        return cfg_schedule
+    cfg_schedule = dict(cfg_schedule)
+    # step of the original schedule at the midpoint of every resampled step
+    source_steps = [(2 * i + 1) * num_steps // (2 * num_sampling_steps) for i in range(num_sampling_steps)]
+    if cfg_schedule.get("scales", None) is not None:
+        cfg_schedule["scales"] = [cfg_schedule["scales"][j] for j in source_steps]
+    if cfg_schedule.get("cond_only_steps", None) is not None:
+        cond_only_steps = set(cfg_schedule["cond_only_steps"])
+        cfg_schedule["cond_only_steps"] = [i for i, j in enumerate(source_steps) if j in cond_only_steps]
+    return cfg_schedule
+
+
 @SCHEDULERS.register_module("rflow")
 class RFLOW:
     def __init__(
@@ -15,6 +96,9 @@ class RFLOW:
         cfg_scale=4.0,
         use_discrete_timesteps=False,
         use_timestep_transform=False,
+        text_kv_cache=False,
+        block_cache=None,
+        cfg_schedule=None,
         **kwargs,
     ):
         self.num_sampling_steps = num_sampling_steps
@@ -22,6 +106,12 @@ class RFLOW:
         self.cfg_scale = cfg_scale
         self.use_discrete_timesteps = use_discrete_timesteps
         self.use_timestep_transform = use_timestep_transform
+        self.text_kv_cache = text_kv_cache
+        # e.g. dict(blocks=(4, 24), refresh_interval=3, warmup_steps=2, cooldown_steps=1, report=False)
+        self.block_cache = block_cache
+        self.block_cache_stats = None
+        # e.g. dict(interval=(0.0, 0.7)), dict(scales=[...]) or dict(cond_only_steps=[...]), see get_guidance_scales
+        self.cfg_schedule = cfg_schedule
 
         self.scheduler = RFlowScheduler(
             num_timesteps=num_timesteps,
@@ -42,6 +132,10 @@ class RFLOW:
         mask=None,
         guidance_scale=None,
         progress=True,
+        x_start=None,
+        start_step=0,
+        callback=None,
+        generators=None,
     ):
         # if no specific guidance scale is provided, use the default scale when initializing the scheduler
         if guidance_scale is None:
@@ -63,17 +157,98 @@ class RFLOW:
         if self.use_timestep_transform:
             timesteps = [timestep_transform(t, additional_args, num_timesteps=self.num_timesteps) for t in timesteps]
 
+        # steps without guidance only run the conditional half of the batch
+        if self.cfg_schedule is not None:
+            guidance_scale = get_guidance_scales(len(timesteps), guidance_scale, **self.cfg_schedule)
+
+        # refinement skips the first `start_step` steps and starts from `x_start`, e.g. an upsampled low-resolution
+        # sample, re-noised to the timestep of `start_step` with the noise `z`
+        if x_start is not None:
+            z = self.scheduler.add_noise(x_start, z, timesteps[start_step])
+        timesteps = timesteps[start_step:]
+        if isinstance(guidance_scale, list):
+            guidance_scale = guidance_scale[start_step:]
+
+        # the caption is constant over all steps, so the model can cache its cross attention key/value
+        use_text_cache = self.text_kv_cache and hasattr(model, "cache_text_condition")
+        if use_text_cache:
+            model.cache_text_condition(model_args["y"], model_args.get("mask", None))
+
+        # adjacent steps have similar activations, so a range of blocks can be skipped on some steps
+        refresh_steps = None
+        if self.block_cache is not None and hasattr(model, "enable_block_cache"):
+            refresh_steps = get_block_cache_refresh_steps(len(timesteps), **self.block_cache)
+            model.enable_block_cache(*self.block_cache["blocks"])
+
+        try:
+            z = self.denoise(
+                model,
+                z,
+                timesteps,
+                model_args,
+                mask,
+                guidance_scale,
+                progress,
+                refresh_steps,
+                callback=callback,
+                generators=generators,
+            )
+        finally:
+            if use_text_cache:
+                model.clear_text_cache()
+            if refresh_steps is not None:
+                model.disable_block_cache()
+        return z
+
+    def predict_velocity(self, model, z, t, model_args, guidance_scale):
+        if guidance_scale == 1.0:
+            # the prompts come first in y, so the conditional branch is the leading half of the batch
+            cond_args = dict(model_args, y=model_args["y"][: z.shape[0]])
+            if model_args.get("x_mask", None) is not None:
+                cond_args["x_mask"] = model_args["x_mask"][: z.shape[0]]
+            return model(z, t, **cond_args).chunk(2, dim=1)[0]
+
+        # classifier-free guidance
+        z_in = torch.cat([z, z], 0)
+        t = torch.cat([t, t], 0)
+        pred = model(z_in, t, **model_args).chunk(2, dim=1)[0]
+        pred_cond, pred_uncond = pred.chunk(2, dim=0)
+        return pred_uncond + guidance_scale * (pred_cond - pred_uncond)
+
+    def denoise(
+        self,
+        model,
+        z,
+        timesteps,
+        model_args,
+        mask=None,
+        guidance_scale=None,
+        progress=True,
+        refresh_steps=None,
+        callback=None,
+        generators=None,
+    ):
+        """
+        Args:
+            generators (list[torch.Generator]): per-sample generators of the noise added to masked frames, the
+                global RNG is used if None
+        """
+        report = refresh_steps is not None and self.block_cache.get("report", False)
+        step_times, deviations = [], []
+        guidance_scales = guidance_scale if isinstance(guidance_scale, list) else [guidance_scale] * len(timesteps)
+
         if mask is not None:
             noise_added = torch.zeros_like(mask, dtype=torch.bool)
             noise_added = noise_added | (mask == 1)
 
+        state = {}  # solver state carried across steps
         progress_wrap = tqdm if progress else (lambda x: x)
         for i, t in progress_wrap(enumerate(timesteps)):
             # mask for adding noise
             if mask is not None:
                 mask_t = mask * self.num_timesteps
                 x0 = z.clone()
-                x_noise = self.scheduler.add_noise(x0, torch.randn_like(x0), t)
+                x_noise = self.scheduler.add_noise(x0, randn_per_sample(x0, generators), t)
 
                 mask_t_upper = mask_t >= t.unsqueeze(1)
                 model_args["x_mask"] = mask_t_upper.repeat(2, 1)
@@ -82,22 +257,148 @@ class RFLOW:
                 z = torch.where(mask_add_noise[:, None, :, None, None], x_noise, x0)
                 noise_added = mask_t_upper
 
-            # classifier-free guidance
-            z_in = torch.cat([z, z], 0)
-            t = torch.cat([t, t], 0)
-            pred = model(z_in, t, **model_args).chunk(2, dim=1)[0]
-            pred_cond, pred_uncond = pred.chunk(2, dim=0)
-            v_pred = pred_uncond + guidance_scale * (pred_cond - pred_uncond)
+            if refresh_steps is not None:
+                model.block_cache["refresh"] = refresh_steps[i]
+            if report:
+                start = synchronized_time(z.device)
+            v_pred = self.predict_velocity(model, z, t, model_args, guidance_scales[i])
+            if report:
+                step_times.append(synchronized_time(z.device) - start)
+                if not refresh_steps[i]:
+                    # compare against the full computation without touching the cached residual
+                    residuals = dict(model.block_cache["residuals"])
+                    model.block_cache["refresh"] = True
+                    v_full = self.predict_velocity(model, z, t, model_args, guidance_scales[i])
+                    model.block_cache["residuals"] = residuals
+                    deviations.append(((v_pred - v_full).norm() / v_full.norm()).item())
+
+            def velocity(z_in, t_in, i=i):
+                # extra evaluations of higher-order solvers keep the condition frames clean
+                if mask is not None:
+                    z_in = torch.where(mask_t_upper[:, None, :, None, None], z_in, x0)
+                return self.predict_velocity(model, z_in, t_in, model_args, guidance_scales[i])
 
             # update z
-            dt = timesteps[i] - timesteps[i + 1] if i < len(timesteps) - 1 else timesteps[i]
-            dt = dt / self.num_timesteps
-            z = z + v_pred * dt[:, None, None, None, None]
+            z_prev = z
+            z = self.step(i, z, v_pred, timesteps, velocity, state)
 
             if mask is not None:
                 z = torch.where(mask_t_upper[:, None, :, None, None], z, x0)
 
+            if callback is not None:
+                # the clean sample predicted at this step makes a sharper preview than the partially denoised z
+                sigma, _ = self.get_sigmas(i, timesteps)
+                callback(i, len(timesteps), z, z_prev + sigma * v_pred)
+
+        if report:
+            self.report_block_cache(model, refresh_steps, step_times, deviations)
         return z
 
+    def get_sigmas(self, i, timesteps):
+        # noise levels in [0, 1] of the current and the next step, the last step goes to 0 (clean data)
+        sigma = timesteps[i] / self.num_timesteps
+        sigma_next = timesteps[i + 1] / self.num_timesteps if i < len(timesteps) - 1 else torch.zeros_like(sigma)
+        return sigma[:, None, None, None, None], sigma_next[:, None, None, None, None]
+
+    def step(self, i, z, v_pred, timesteps, velocity, state):
+        """
+        Advance `z` from `timesteps[i]` to the next timestep given the velocity `v_pred` predicted at `z`.
+        `velocity(z, t)` evaluates the model again for higher-order solvers. This is a first-order Euler step.
+        """
+        sigma, sigma_next = self.get_sigmas(i, timesteps)
+        return z + v_pred * (sigma - sigma_next)
+
+    def report_block_cache(self, model, refresh_steps, step_times, deviations):
+        start, end = self.block_cache["blocks"]
+        num_full = sum(refresh_steps)
+        num_cheap = len(refresh_steps) - num_full
+        full_times = [t for t, refresh in zip(step_times, refresh_steps) if refresh]
+        # block-level speedup is what the schedule promises, measured speedup compares to all-full steps
+        block_evals = num_full * model.depth + num_cheap * (model.depth - (end - start))
+        block_speedup = len(refresh_steps) * model.depth / block_evals
+        measured_speedup = sum(full_times) / len(full_times) * len(step_times) / sum(step_times) if full_times else 1.0
+        self.block_cache_stats = dict(
+            full_steps=num_full,
+            cached_steps=num_cheap,
+            block_speedup=block_speedup,
+            measured_speedup=measured_speedup,
+            mean_deviation=sum(deviations) / len(deviations) if deviations else 0.0,
+            max_deviation=max(deviations, default=0.0),
+        )
+        get_logger().info(
+            "Block cache: %d full / %d cached steps, speedup %.2fx (blocks %.2fx), deviation mean %.4f max %.4f",
+            num_full,
+            num_cheap,
+            measured_speedup,
+            block_speedup,
+            self.block_cache_stats["mean_deviation"],
+            self.block_cache_stats["max_deviation"],
+        )
+
     def training_losses(self, model, x_start, model_kwargs=None, noise=None, mask=None, weights=None, t=None):
         return self.scheduler.training_losses(model, x_start, model_kwargs, noise, mask, weights, t)
+
+
+@SCHEDULERS.register_module("rflow-heun")
+class RFLOWHeun(RFLOW):
+    """
+    Second-order rectified flow sampler.
+
+    `method="heun"` corrects the Euler step with the velocity at its end point and falls back to Euler on the last
+    step, whose end point is the clean sample (2 * num_sampling_steps - 1 model evaluations). `method="midpoint"`
+    takes the step with the velocity at its midpoint (2 * num_sampling_steps evaluations).
+    """
+
+    def __init__(self, *args, method="heun", **kwargs):
+        super().__init__(*args, **kwargs)
+        assert method in ["heun", "midpoint"], f"Unknown method {method}"
+        self.method = method
+
+    def step(self, i, z, v_pred, timesteps, velocity, state):
+        sigma, sigma_next = self.get_sigmas(i, timesteps)
+        t_next = timesteps[i + 1] if i < len(timesteps) - 1 else None
+        if self.method == "midpoint":
+            t_mid = (timesteps[i] + t_next) / 2 if t_next is not None else timesteps[i] / 2
+            z_mid = z + v_pred * (sigma - sigma_next) / 2
+            return z + velocity(z_mid, t_mid) * (sigma - sigma_next)
+
+        z_next = z + v_pred * (sigma - sigma_next)
+        if t_next is None:
+            return z_next
+        return z + (v_pred + velocity(z_next, t_next)) / 2 * (sigma - sigma_next)
+
+
+@SCHEDULERS.register_module("rflow-dpm-solver")
+class RFLOWDPMSolver(RFLOW):
+    """
+    Multistep DPM-Solver++ for rectified flow, one model evaluation per step.
+
+    The path z = (1 - sigma) * x0 + sigma * noise is a diffusion with alpha = 1 - sigma, and the velocity gives the
+    data prediction x0 = z + sigma * v. Each step integrates the data prediction exactly in log-SNR with a linear
+    extrapolation from the previous step (`order=2`), the first and the last step are first order.
+    """
+
+    def __init__(self, *args, order=2, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert order in [1, 2], f"Unsupported order {order}"
+        self.order = order
+
+    def step(self, i, z, v_pred, timesteps, velocity, state):
+        sigma, sigma_next = self.get_sigmas(i, timesteps)
+        alpha, alpha_next = 1 - sigma, 1 - sigma_next
+        x0_pred = z + sigma * v_pred
+        # log-SNR, -inf at pure noise and inf at clean data
+        lambda_, lambda_next = torch.log(alpha) - torch.log(sigma), torch.log(alpha_next) - torch.log(sigma_next)
+        h = lambda_next - lambda_
+
+        d = x0_pred
+        is_last = i == len(timesteps) - 1
+        if self.order == 2 and "x0_pred" in state and not is_last:
+            # after a step from pure noise the ratio is infinite and the extrapolation vanishes
+            r = state["h"] / h
+            d = (1 + 0.5 / r) * x0_pred - 0.5 / r * state["x0_pred"]
+        state.update(x0_pred=x0_pred, h=h)
+
+        # exp(-h) = sigma_next * alpha / (sigma * alpha_next), written without the logs so that the end points are exact
+        exp_neg_h = sigma_next * alpha / (sigma * alpha_next)
+        return sigma_next / sigma * z + alpha_next * (1 - exp_neg_h) * d
@@ -1,7 +1,10 @@
+import copy
 import functools
 import json
 import operator
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
 import torch
@@ -150,32 +153,107 @@ def load_from_sharded_state_dict(model, ckpt_path, model_name="model", strict=Fa
     ckpt_io.load_model(model, os.path.join(ckpt_path, model_name), strict=strict)
 
 
-def model_sharding(model: torch.nn.Module):
-    global_rank = dist.get_rank()
-    world_size = dist.get_world_size()
-    for _, param in model.named_parameters():
-        padding_size = (world_size - param.numel() % world_size) % world_size
-        if padding_size > 0:
-            padding_param = torch.nn.functional.pad(param.data.view(-1), [0, padding_size])
-        else:
-            padding_param = param.data.view(-1)
-        splited_params = padding_param.split(padding_param.numel() // world_size)
-        splited_params = splited_params[global_rank]
-        param.data = splited_params
+class FlatShard:
+    """
+    Local shards of the parameters of a module kept in one flat buffer, with every parameter a view into it.
+
+    Each parameter is sharded like the master parameters of the ZeRO optimizer: flattened, zero-padded to a multiple of
+    the world size and split evenly, rank r keeping the r-th chunk. The buffer is divided into buckets of whole
+    parameters, and gathering issues one collective per bucket instead of one per parameter.
+
+    Args:
+        model (torch.nn.Module): module whose parameters are sharded
+        numels (list[int]): full number of elements of each parameter, in the order of `model.parameters()`
+        dtype (torch.dtype): dtype of the buffer, that of the parameters if None
+        bucket_size_in_m (int): size of the local part of a bucket in MB
+    """
+
+    def __init__(self, model: torch.nn.Module, numels: list, dtype: torch.dtype = None, bucket_size_in_m: int = 32):
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        params = list(model.named_parameters())
+        dtype = dtype or params[0][1].dtype
+        bucket_numel = bucket_size_in_m * 1024**2 // (torch.finfo(dtype).bits // 8)
+
+        self.entries = []  # (name, param, offset, shard numel)
+        self.buckets = []  # (start, end, entries)
+        offset, bucket = 0, []
+        for (name, param), numel in zip(params, numels):
+            shard_numel = (numel + self.world_size - 1) // self.world_size
+            if len(bucket) > 0 and offset + shard_numel - bucket[0][2] > bucket_numel:
+                self.buckets.append((bucket[0][2], offset, bucket))
+                bucket = []
+            entry = (name, param, offset, shard_numel)
+            self.entries.append(entry)
+            bucket.append(entry)
+            offset += shard_numel
+        self.buckets.append((bucket[0][2], offset, bucket))
+        self.buffer = torch.zeros(offset, dtype=dtype, device=params[0][1].device)
+
+    def load_state_dict(self, state_dict: dict) -> dict:
+        """
+        Copy the local chunks of the full tensors in `state_dict` into the shards of the parameters with the same
+        names, and point the parameters at their shards.
+
+        Returns:
+            dict: the entries of `state_dict` that are not parameters
+        """
+        state_dict = dict(state_dict)
+        for name, param, offset, shard_numel in self.entries:
+            shard = self.buffer[offset : offset + shard_numel]
+            if name in state_dict:
+                full = state_dict.pop(name).detach().reshape(-1)
+                chunk = full[self.rank * shard_numel : (self.rank + 1) * shard_numel]
+                shard[: chunk.numel()].copy_(chunk)
+                shard[chunk.numel() :].zero_()
+            param.data = shard
+        return state_dict
+
+    def gather(self, model_shape_dict: dict):
+        """
+        Restore the full parameters on rank 0, the other ranks keep their shards.
+        """
+        for start, end, entries in self.buckets:
+            gathered = torch.empty(self.world_size, end - start, dtype=self.buffer.dtype, device=self.buffer.device)
+            dist.all_gather(list(gathered.unbind(0)), self.buffer[start:end], group=dist.group.WORLD)
+            if self.rank == 0:
+                for name, param, offset, shard_numel in entries:
+                    full = gathered[:, offset - start : offset - start + shard_numel].reshape(-1)
+                    param.data = remove_padding(full, model_shape_dict[name]).view(model_shape_dict[name])
+
+
+def model_sharding(model: torch.nn.Module, bucket_size_in_m: int = 32):
+    """
+    Shard the full parameters of `model` into a `FlatShard`, which is kept as `model.flat_shard` and reused when the
+    module is sharded again after `model_gathering`.
+    """
+    if getattr(model, "flat_shard", None) is None:
+        numels = [param.numel() for param in model.parameters()]
+        model.flat_shard = FlatShard(model, numels, bucket_size_in_m=bucket_size_in_m)
+    model.flat_shard.load_state_dict(dict(model.named_parameters()))
 
 
 def model_gathering(model: torch.nn.Module, model_shape_dict: dict):
-    global_rank = dist.get_rank()
-    global_size = dist.get_world_size()
-    for name, param in model.named_parameters():
-        all_params = [torch.empty_like(param.data) for _ in range(global_size)]
-        dist.all_gather(all_params, param.data, group=dist.group.WORLD)
-        if int(global_rank) == 0:
-            all_params = torch.cat(all_params)
-            param.data = remove_padding(all_params, model_shape_dict[name]).view(model_shape_dict[name])
+    model.flat_shard.gather(model_shape_dict)
     dist.barrier()
 
 
+def build_sharded_ema(model: torch.nn.Module, dtype: torch.dtype = torch.float32, bucket_size_in_m: int = 32):
+    """
+    Build an EMA copy of `model` in the sharded form of `model_sharding` without materializing its full parameters.
+    """
+    # parameters are mapped to empty placeholders, so deepcopy only copies the module structure and the buffers
+    placeholders = {
+        id(param): nn.Parameter(torch.empty(0, dtype=dtype, device=param.device), requires_grad=False)
+        for param in model.parameters()
+    }
+    ema = copy.deepcopy(model, memo=placeholders).to(dtype)
+    numels = [param.numel() for param in model.parameters()]
+    ema.flat_shard = FlatShard(ema, numels, dtype=dtype, bucket_size_in_m=bucket_size_in_m)
+    ema.flat_shard.load_state_dict(dict(model.named_parameters()))
+    return ema
+
+
 def remove_padding(tensor: torch.Tensor, original_shape: Tuple) -> torch.Tensor:
     return tensor[: functools.reduce(operator.mul, original_shape)]
 
@@ -193,6 +271,13 @@ def load_checkpoint(model, ckpt_path, save_as_pt=False, model_name="model", stri
         missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=strict)
         get_logger().info("Missing keys: %s", missing_keys)
         get_logger().info("Unexpected keys: %s", unexpected_keys)
+    elif ckpt_path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+
+        state_dict = reparameter(load_file(ckpt_path), ckpt_path, model=model)
+        missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=strict)
+        get_logger().info("Missing keys: %s", missing_keys)
+        get_logger().info("Unexpected keys: %s", unexpected_keys)
     elif os.path.isdir(ckpt_path):
         load_from_sharded_state_dict(model, ckpt_path, model_name, strict=strict)
         get_logger().info("Model checkpoint loaded from %s", ckpt_path)
@@ -216,6 +301,24 @@ def save_json(data, file_path: str):
 
 # save and load for training
 
+# written last into a checkpoint directory, `load` warns about directories without it
+CKPT_COMPLETE_MARKER = "COMPLETE"
+
+
+def get_ckpt_dir(save_dir: str, epoch: int, global_step: int) -> str:
+    return os.path.join(save_dir, f"epoch{epoch}-global_step{global_step}")
+
+
+def finalize_ckpt_dir(tmp_dir: str, save_dir: str):
+    """
+    Mark the checkpoint written into `tmp_dir` as complete and atomically rename it to `save_dir`.
+    """
+    with open(os.path.join(tmp_dir, CKPT_COMPLETE_MARKER), "w") as f:
+        f.write("")
+    if os.path.exists(save_dir):
+        shutil.rmtree(save_dir)
+    os.rename(tmp_dir, save_dir)
+
 
 def save(
     booster: Booster,
@@ -230,15 +333,19 @@ def save(
     global_step: int = None,
     batch_size: int = None,
 ):
-    save_dir = os.path.join(save_dir, f"epoch{epoch}-global_step{global_step}")
-    os.makedirs(os.path.join(save_dir, "model"), exist_ok=True)
+    save_dir = get_ckpt_dir(save_dir, epoch, global_step)
+    tmp_dir = save_dir + ".tmp"
+    if dist.get_rank() == 0 and os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)  # left over by an interrupted save
+    dist.barrier()
+    os.makedirs(os.path.join(tmp_dir, "model"), exist_ok=True)
 
     if model is not None:
-        booster.save_model(model, os.path.join(save_dir, "model"), shard=True)
+        booster.save_model(model, os.path.join(tmp_dir, "model"), shard=True)
     if optimizer is not None:
-        booster.save_optimizer(optimizer, os.path.join(save_dir, "optimizer"), shard=True, size_per_shard=4096)
+        booster.save_optimizer(optimizer, os.path.join(tmp_dir, "optimizer"), shard=True, size_per_shard=4096)
     if lr_scheduler is not None:
-        booster.save_lr_scheduler(lr_scheduler, os.path.join(save_dir, "lr_scheduler"))
+        booster.save_lr_scheduler(lr_scheduler, os.path.join(tmp_dir, "lr_scheduler"))
     if dist.get_rank() == 0:
         running_states = {
             "epoch": epoch,
@@ -246,18 +353,177 @@ def save(
             "global_step": global_step,
             "batch_size": batch_size,
         }
-        save_json(running_states, os.path.join(save_dir, "running_states.json"))
+        save_json(running_states, os.path.join(tmp_dir, "running_states.json"))
 
         if ema is not None:
-            torch.save(ema.state_dict(), os.path.join(save_dir, "ema.pt"))
+            torch.save(ema.state_dict(), os.path.join(tmp_dir, "ema.pt"))
 
         if sampler is not None:
             # only for VariableVideoBatchSampler
-            torch.save(sampler.state_dict(step), os.path.join(save_dir, "sampler"))
+            torch.save(sampler.state_dict(step), os.path.join(tmp_dir, "sampler"))
+    dist.barrier()
+    if dist.get_rank() == 0:
+        finalize_ckpt_dir(tmp_dir, save_dir)
     dist.barrier()
     return save_dir
 
 
+def pin_state_dict(state, buffers: dict, prefix: str = ""):
+    """
+    Copy the tensors of a (nested) state dict into pinned CPU buffers. The buffers are cached in `buffers` by their
+    path in the state dict and reused by later calls, and the copies from the device are queued without blocking.
+    """
+    if isinstance(state, torch.Tensor):
+        buffer = buffers.get(prefix, None)
+        if buffer is None or buffer.shape != state.shape or buffer.dtype != state.dtype:
+            buffer = torch.empty(state.shape, dtype=state.dtype, pin_memory=torch.cuda.is_available())
+            buffers[prefix] = buffer
+        buffer.copy_(state.detach(), non_blocking=True)
+        return buffer
+    if isinstance(state, dict):
+        return type(state)((k, pin_state_dict(v, buffers, f"{prefix}.{k}")) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(pin_state_dict(v, buffers, f"{prefix}.{i}") for i, v in enumerate(state))
+    return copy.deepcopy(state)
+
+
+class AsyncCheckpointSaver:
+    """
+    Non-blocking counterpart of `save`.
+
+    `save` snapshots the states into pinned CPU buffers and returns as soon as the device-to-host copies are queued,
+    so training resumes while rank 0 writes the files from background threads into `<save_dir>.tmp`, adds the
+    completion marker and renames the directory to `<save_dir>`. The buffers are reused across checkpoints, so only
+    one checkpoint is in flight: the next `save` waits for the previous one, and errors of a background write are
+    raised by the next `save` or by `wait`.
+
+    The optimizer is the exception: ZeRO optimizers gather their sharded states with collectives, and snapshotting
+    them would hold the full fp32 states in host memory on every rank. It is saved synchronously with
+    `booster.save_optimizer` before `save` returns, so only the model, EMA and small states are written in the
+    background. The layout matches `save` and is read by `load`.
+
+    Args:
+        num_threads (int): number of file writing threads
+        size_per_shard (int): maximum size of a model shard in MB
+    """
+
+    def __init__(self, num_threads: int = 4, size_per_shard: int = 1024):
+        self.size_per_shard = size_per_shard
+        self.buffers = {}
+        self.writers = ThreadPoolExecutor(num_threads)
+        self.finalizer = ThreadPoolExecutor(1)
+        self.pending = None
+
+    def save(
+        self,
+        booster: Booster,
+        save_dir: str,
+        model: nn.Module = None,
+        ema: nn.Module = None,
+        optimizer: Optimizer = None,
+        lr_scheduler: _LRScheduler = None,
+        sampler=None,
+        epoch: int = None,
+        step: int = None,
+        global_step: int = None,
+        batch_size: int = None,
+    ):
+        self.wait()
+        save_dir = get_ckpt_dir(save_dir, epoch, global_step)
+        tmp_dir = save_dir + ".tmp"
+        if dist.get_rank() == 0:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)  # left over by an interrupted save
+            os.makedirs(os.path.join(tmp_dir, "model"))
+        dist.barrier()
+        if optimizer is not None:
+            # collective and blocking, every rank writes the shards it gathers
+            booster.save_optimizer(optimizer, os.path.join(tmp_dir, "optimizer"), shard=True, size_per_shard=4096)
+        if dist.get_rank() != 0:
+            return save_dir
+
+        states = {}
+        if model is not None:
+            states["model"] = (model.unwrap() if hasattr(model, "unwrap") else model).state_dict()
+
+        if ema is not None:
+            states["ema"] = ema.state_dict()
+        if lr_scheduler is not None:
+            states["lr_scheduler"] = lr_scheduler.state_dict()
+        if sampler is not None:
+            # only for VariableVideoBatchSampler
+            states["sampler"] = sampler.state_dict(step)
+        states = pin_state_dict(states, self.buffers)
+        copied = None
+        if torch.cuda.is_available():
+            # later kernels on the stream are ordered after the copies, so the states can be updated right away
+            copied = torch.cuda.Event()
+            copied.record()
+        running_states = {
+            "epoch": epoch,
+            "step": step,
+            "global_step": global_step,
+            "batch_size": batch_size,
+        }
+        self.pending = self.finalizer.submit(self._write, save_dir, states, running_states, copied)
+        return save_dir
+
+    def _write_model(self, state_dict: dict, model_dir: str) -> list:
+        # same layout as booster.save_model(shard=True)
+        shards, shard, shard_size, total_size = [], {}, 0, 0
+        for name, tensor in state_dict.items():
+            size = tensor.numel() * tensor.element_size()
+            if len(shard) > 0 and shard_size + size > self.size_per_shard * 1024**2:
+                shards.append(shard)
+                shard, shard_size = {}, 0
+            shard[name] = tensor
+            shard_size += size
+            total_size += size
+        shards.append(shard)
+
+        weight_map, futures = {}, []
+        for i, shard in enumerate(shards):
+            file_name = f"pytorch_model-{i + 1:05d}.bin"
+            weight_map.update(dict.fromkeys(shard, file_name))
+            futures.append(self.writers.submit(torch.save, shard, os.path.join(model_dir, file_name)))
+        index = {"metadata": {"total_size": total_size}, "weight_map": weight_map}
+        save_json(index, os.path.join(model_dir, "pytorch_model.bin.index.json"))
+        return futures
+
+    def _write(self, save_dir: str, states: dict, running_states: dict, copied):
+        if copied is not None:
+            copied.synchronize()
+        tmp_dir = save_dir + ".tmp"
+        futures = []
+        if "model" in states:
+            futures += self._write_model(states["model"], os.path.join(tmp_dir, "model"))
+        for name, file_name in [
+            ("ema", "ema.pt"),
+            ("lr_scheduler", "lr_scheduler"),
+            ("sampler", "sampler"),
+        ]:
+            if name in states:
+                futures.append(self.writers.submit(torch.save, states[name], os.path.join(tmp_dir, file_name)))
+        save_json(running_states, os.path.join(tmp_dir, "running_states.json"))
+        for future in futures:
+            future.result()
+        finalize_ckpt_dir(tmp_dir, save_dir)
+        get_logger().info("Finished writing checkpoint %s", save_dir)
+
+    def wait(self):
+        """
+        Block until the checkpoint in flight is written, raising its error if any.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self.writers.shutdown()
+        self.finalizer.shutdown()
+
+
 def load(
     booster: Booster,
     load_dir: str,
@@ -268,16 +534,21 @@ def load(
     sampler=None,
 ) -> Tuple[int, int, int]:
     assert os.path.exists(load_dir), f"Checkpoint directory {load_dir} does not exist"
+    assert not os.path.normpath(load_dir).endswith(".tmp"), f"Checkpoint {load_dir} was not completely written"
+    if not os.path.exists(os.path.join(load_dir, CKPT_COMPLETE_MARKER)):
+        # checkpoints saved before the marker was introduced do not have it
+        get_logger().warning("Checkpoint %s has no completion marker and may be incomplete", load_dir)
     assert os.path.exists(os.path.join(load_dir, "running_states.json")), "running_states.json does not exist"
     running_states = load_json(os.path.join(load_dir, "running_states.json"))
     if model is not None:
         booster.load_model(model, os.path.join(load_dir, "model"))
     if ema is not None:
         # ema is not boosted, so we don't use booster.load_model
-        ema.load_state_dict(
-            torch.load(os.path.join(load_dir, "ema.pt"), map_location=torch.device("cpu")),
-            strict=False,
-        )
+        state_dict = torch.load(os.path.join(load_dir, "ema.pt"), map_location=torch.device("cpu"))
+        if getattr(ema, "flat_shard", None) is not None:
+            # every rank copies its shards of the parameters, the buffers are loaded below
+            state_dict = ema.flat_shard.load_state_dict(state_dict)
+        ema.load_state_dict(state_dict, strict=False)
     if optimizer is not None:
         booster.load_optimizer(optimizer, os.path.join(load_dir, "optimizer"))
     if lr_scheduler is not None:
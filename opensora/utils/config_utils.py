@@ -43,12 +43,16 @@ def parse_args(training=False):
         parser.add_argument("--num-sample", default=None, type=int, help="number of samples to generate for one prompt")
         parser.add_argument("--prompt-as-path", action="store_true", help="use prompt as path to save samples")
         parser.add_argument("--verbose", default=None, type=int, help="verbose level")
+        parser.add_argument("--sp-size", default=None, type=int, help="sequence-parallel group size")
 
         # prompt
         parser.add_argument("--prompt-path", default=None, type=str, help="path to prompt txt file")
         parser.add_argument("--prompt", default=None, type=str, nargs="+", help="prompt list")
         parser.add_argument("--llm-refine", default=None, type=str2bool, help="enable LLM refine")
         parser.add_argument("--prompt-generator", default=None, type=str, help="prompt generator")
+        parser.add_argument(
+            "--text-embedding-cache", default=None, type=str, help="directory of the persistent T5 embedding cache"
+        )
 
         # image/video
         parser.add_argument("--num-frames", default=None, type=str, help="number of frames")
@@ -62,6 +66,13 @@ def parse_args(training=False):
         # hyperparameters
         parser.add_argument("--num-sampling-steps", default=None, type=int, help="sampling steps")
         parser.add_argument("--cfg-scale", default=None, type=float, help="balance between cond & uncond")
+        parser.add_argument(
+            "--cfg-interval", default=None, type=float, nargs=2, help="fraction of steps [start, end) with guidance"
+        )
+        parser.add_argument("--cfg-scales", default=None, type=float, nargs="+", help="per-step guidance scales")
+        parser.add_argument(
+            "--cfg-cond-only-steps", default=None, type=int, nargs="+", help="step indices without guidance"
+        )
 
         # reference
         parser.add_argument("--loop", default=None, type=int, help="loop")
@@ -107,12 +118,20 @@ def merge_args(cfg, args, training=False):
         if args.num_frames is not None:
             cfg.dataset["num_frames"] = args.num_frames
     if not training:
+        if args.text_embedding_cache is not None:
+            cfg.text_encoder["embedding_cache_dir"] = args.text_embedding_cache
+            args.text_embedding_cache = None
         if args.cfg_scale is not None:
             cfg.scheduler["cfg_scale"] = args.cfg_scale
             args.cfg_scale = None
         if args.num_sampling_steps is not None:
             cfg.scheduler["num_sampling_steps"] = args.num_sampling_steps
             args.num_sampling_steps = None
+        for key in ["interval", "scales", "cond_only_steps"]:
+            value = getattr(args, f"cfg_{key}")
+            if value is not None:
+                cfg.scheduler["cfg_schedule"] = {**(cfg.scheduler.get("cfg_schedule", None) or {}), key: value}
+                setattr(args, f"cfg_{key}", None)
 
     for k, v in vars(args).items():
         if v is not None:
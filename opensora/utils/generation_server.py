@@ -0,0 +1,313 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from opensora.datasets.aspect import get_image_size, get_num_frames
+from opensora.utils.misc import get_logger
+
+
+class GenerationRequest:
+    """
+    One text-to-video request and its lifecycle: queued -> running -> done / failed.
+    """
+
+    def __init__(self, prompt, seed, resolution, aspect_ratio, num_frames, num_sampling_steps, cfg_scale):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.seed = int(seed)
+        self.resolution = resolution
+        self.aspect_ratio = aspect_ratio
+        self.num_frames = num_frames
+        self.num_sampling_steps = int(num_sampling_steps)
+        self.cfg_scale = float(cfg_scale)
+
+        self.status = "queued"
+        self.error = None
+        self.save_path = None
+        self.batch_size = None
+        self.enqueue_time = time.time()
+        self.latency = {}
+        self.done = threading.Event()
+
+    @property
+    def batch_key(self):
+        # requests with the same key can share a batch
+        return (self.resolution, self.aspect_ratio, self.num_frames, self.num_sampling_steps, self.cfg_scale)
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            prompt=self.prompt,
+            seed=self.seed,
+            resolution=self.resolution,
+            aspect_ratio=self.aspect_ratio,
+            num_frames=self.num_frames,
+            num_sampling_steps=self.num_sampling_steps,
+            cfg_scale=self.cfg_scale,
+            status=self.status,
+            error=self.error,
+            batch_size=self.batch_size,
+            latency=self.latency,
+            video=f"/videos/{self.id}" if self.status == "done" else None,
+        )
+
+
+class GenerationServer:
+    """
+    Queue of generation requests served by dynamic batching on a resident `InferenceWorker`.
+
+    A single scheduling thread takes the oldest queued request and batches it with later requests of the same
+    (resolution, aspect ratio, num_frames, steps, cfg scale). A batch is closed when it reaches `max_batch_size`,
+    when adding a request would exceed `max_batch_tokens` latent tokens (the memory budget; activation memory of
+    the diffusion model grows with the number of tokens), or `max_wait` seconds after the oldest request arrived.
+
+    Args:
+        worker (InferenceWorker): worker with the model already loaded
+        save_dir (str): directory of the generated videos
+        max_batch_size (int): maximum number of requests per batch
+        max_batch_tokens (int): maximum number of latent tokens per batch, None for no limit
+        max_wait (float): seconds to wait for compatible requests before running an incomplete batch
+        max_history (int): number of finished requests kept for status queries
+    """
+
+    def __init__(self, worker, save_dir, max_batch_size=4, max_batch_tokens=None, max_wait=0.1, max_history=10000):
+        self.worker = worker
+        self.save_dir = save_dir
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.max_history = max_history
+        self.logger = get_logger()
+        os.makedirs(save_dir, exist_ok=True)
+
+        self.condition = threading.Condition()
+        self.queue = []
+        self.requests = OrderedDict()
+        self.num_batches = 0
+        self.thread = None
+        self.stopped = False
+
+    def submit(
+        self,
+        prompt,
+        seed=1024,
+        resolution=None,
+        aspect_ratio=None,
+        num_frames=None,
+        num_sampling_steps=None,
+        cfg_scale=None,
+    ):
+        # unknown fields raise a TypeError instead of being dropped, so a misspelled field does not silently generate
+        # with the defaults; unset fields take the config defaults, explicit zeros (e.g. cfg_scale=0) are kept
+        cfg = self.worker.cfg
+        request = GenerationRequest(
+            prompt,
+            seed=seed,
+            resolution=cfg.resolution if resolution is None else resolution,
+            aspect_ratio=cfg.aspect_ratio if aspect_ratio is None else aspect_ratio,
+            num_frames=get_num_frames(cfg.num_frames if num_frames is None else num_frames),
+            num_sampling_steps=(
+                self.worker.scheduler.num_sampling_steps if num_sampling_steps is None else num_sampling_steps
+            ),
+            cfg_scale=self.worker.scheduler.cfg_scale if cfg_scale is None else cfg_scale,
+        )
+        # fail early on unknown resolutions instead of inside a batch
+        self.num_tokens(request)
+        with self.condition:
+            self.queue.append(request)
+            self.requests[request.id] = request
+            self.condition.notify_all()
+        return request
+
+    def get(self, request_id):
+        return self.requests.get(request_id, None)
+
+    def num_tokens(self, request):
+        image_size = get_image_size(request.resolution, request.aspect_ratio)
+        T, H, W = self.worker.vae.get_latent_size((request.num_frames, *image_size))
+        patch_size = getattr(self.worker.model.config, "patch_size", (1, 2, 2))
+        return (T // patch_size[0]) * (H // patch_size[1]) * (W // patch_size[2])
+
+    def take_batch(self):
+        with self.condition:
+            while not self.queue and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return []
+            # wait for compatible requests until the batch is full or the oldest request waited long enough
+            while True:
+                key = self.queue[0].batch_key
+                compatible = [request for request in self.queue if request.batch_key == key]
+                remaining = self.queue[0].enqueue_time + self.max_wait - time.time()
+                if len(compatible) >= self.max_batch_size or remaining <= 0 or self.stopped:
+                    break
+                self.condition.wait(remaining)
+
+            batch, num_tokens = [], 0
+            for request in compatible[: self.max_batch_size]:
+                tokens = self.num_tokens(request)
+                if batch and self.max_batch_tokens is not None and num_tokens + tokens > self.max_batch_tokens:
+                    break
+                batch.append(request)
+                num_tokens += tokens
+            for request in batch:
+                self.queue.remove(request)
+            return batch
+
+    def run_batch(self, batch):
+        start = time.time()
+        for request in batch:
+            request.status = "running"
+            request.batch_size = len(batch)
+            request.latency["queue"] = start - request.enqueue_time
+        first = batch[0]
+        try:
+            timings = self.worker.generate_batch(
+                [request.prompt for request in batch],
+                [request.seed for request in batch],
+                [os.path.join(self.save_dir, request.id) for request in batch],
+                num_frames=first.num_frames,
+                resolution=first.resolution,
+                aspect_ratio=first.aspect_ratio,
+                num_sampling_steps=first.num_sampling_steps,
+                cfg_scale=first.cfg_scale,
+            )
+        except Exception as e:
+            self.logger.exception("Batch of %s requests failed", len(batch))
+            for request in batch:
+                request.status, request.error = "failed", repr(e)
+                request.done.set()
+            return
+        for request, save_path in zip(batch, timings["save_paths"]):
+            request.save_path = save_path
+            for stage in ["denoise", "decode", "encode"]:
+                request.latency[stage] = timings[stage]
+            request.latency["total"] = time.time() - request.enqueue_time
+            request.status = "done"
+            request.done.set()
+        self.num_batches += 1
+        self.logger.info(
+            "Batch of %s (%s): denoise %.2fs, decode %.2fs, encode %.2fs",
+            len(batch),
+            first.batch_key,
+            timings["denoise"],
+            timings["decode"],
+            timings["encode"],
+        )
+
+    def prune_history(self):
+        with self.condition:
+            while len(self.requests) > self.max_history:
+                request_id, request = next(iter(self.requests.items()))
+                if not request.done.is_set():
+                    break
+                del self.requests[request_id]
+
+    def loop(self):
+        while not self.stopped:
+            batch = self.take_batch()
+            if batch:
+                self.run_batch(batch)
+                self.prune_history()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop, name="generation-server", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        # the worker thread and other handlers add requests concurrently, iterate over a snapshot
+        with self.condition:
+            requests = list(self.requests.values())
+            num_queued = len(self.queue)
+            num_batches = self.num_batches
+        finished = [request for request in requests if request.status == "done"]
+        mean_latency = {}
+        for stage in ["queue", "denoise", "decode", "encode", "total"]:
+            values = [request.latency[stage] for request in finished]
+            mean_latency[stage] = sum(values) / len(values) if values else None
+        return dict(
+            queued=num_queued,
+            completed=len(finished),
+            failed=sum(request.status == "failed" for request in requests),
+            batches=num_batches,
+            mean_batch_size=len(finished) / num_batches if num_batches else None,
+            mean_latency=mean_latency,
+        )
+
+
+def make_handler(server):
+    class GenerationHandler(BaseHTTPRequestHandler):
+        """
+        POST /generate          {"prompt": ..., "seed", "resolution", "aspect_ratio", "num_frames",
+                                 "num_sampling_steps", "cfg_scale", "wait"} -> request status
+        GET  /requests/<id>     request status and per-stage latencies
+        GET  /videos/<id>       generated video
+        GET  /stats             queue length and mean latencies
+        """
+
+        def send_json(self, obj, code=200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/generate":
+                return self.send_json(dict(error="not found"), 404)
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                wait = body.pop("wait", False)
+                request = server.submit(**body)
+            except (TypeError, ValueError, KeyError, AssertionError) as e:
+                return self.send_json(dict(error=repr(e)), 400)
+            if wait:
+                request.done.wait()
+            self.send_json(request.to_dict(), 200 if wait else 202)
+
+        def do_GET(self):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if parts == ["stats"]:
+                return self.send_json(server.stats())
+            if len(parts) != 2 or parts[0] not in ["requests", "videos"]:
+                return self.send_json(dict(error="not found"), 404)
+            request = server.get(parts[1])
+            if request is None:
+                return self.send_json(dict(error="unknown request"), 404)
+            if parts[0] == "requests":
+                return self.send_json(request.to_dict())
+            if request.status != "done":
+                return self.send_json(request.to_dict(), 409)
+            with open(request.save_path, "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp4" if request.save_path.endswith(".mp4") else "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            server.logger.debug("%s - %s", self.address_string(), format % args)
+
+    return GenerationHandler
+
+
+def serve(server, host="127.0.0.1", port=8000):
+    """
+    Start the batching thread and return a threading HTTP server for `server`; call `serve_forever` on it.
+    """
+    server.start()
+    return ThreadingHTTPServer((host, port), make_handler(server))
@@ -0,0 +1,207 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+import torch
+
+_STOP = object()
+
+
+class StageTimer:
+    """
+    Thread-safe accumulator of wall-clock time per pipeline stage.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.start_time = time.time()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.totals[stage] += seconds
+            self.counts[stage] += 1
+
+    def summary(self):
+        wall_time = time.time() - self.start_time
+        lines = [f"wall time {wall_time:.2f}s"]
+        for stage, total in self.totals.items():
+            count = self.counts[stage]
+            lines.append(
+                f"{stage}: {total:.2f}s over {count} calls ({total / count:.3f}s each, {100 * total / wall_time:.1f}%)"
+            )
+        # stages add up to more than the wall time when they overlap
+        lines.append(f"overlap {sum(self.totals.values()) / max(wall_time, 1e-6):.2f}x")
+        return "\n".join(lines)
+
+
+def _record_stream(obj, stream):
+    # tensors produced on a side stream are consumed on another one, tell the caching allocator about it
+    if isinstance(obj, torch.Tensor):
+        if obj.is_cuda:
+            obj.record_stream(stream)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            _record_stream(v, stream)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            _record_stream(v, stream)
+
+
+def _new_stream(use_cuda_stream):
+    return torch.cuda.Stream() if use_cuda_stream and torch.cuda.is_available() else None
+
+
+def _stream_context(stream):
+    return nullcontext() if stream is None else torch.cuda.stream(stream)
+
+
+class BackgroundWorker:
+    """
+    Run `fn` on submitted items in background threads.
+
+    The queue is bounded, so `submit` blocks once `max_queue_size` items are pending and the producer cannot run
+    arbitrarily far ahead of the consumers. Each thread uses its own CUDA stream if `cuda_stream` is True; it waits
+    for the kernels the submitter queued before `submit` and is synchronized before the item counts as done.
+    Exceptions raised by `fn` are re-raised by the next `submit` or by `close`.
+
+    Args:
+        fn (Callable): called with each submitted item
+        name (str): stage name used for timings
+        timer (StageTimer): records the time spent in `fn`
+        max_queue_size (int): maximum number of pending items
+        num_workers (int): number of threads
+        cuda_stream (bool): run `fn` on a side CUDA stream
+    """
+
+    def __init__(self, fn, name, timer=None, max_queue_size=2, num_workers=1, cuda_stream=False):
+        self.fn = fn
+        self.name = name
+        self.timer = timer
+        self.cuda_stream = cuda_stream
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    @torch.no_grad()
+    def _run(self):
+        stream = _new_stream(self.cuda_stream)
+        while True:
+            item, event = self.queue.get()
+            if item is _STOP:
+                break
+            if self.error is not None:
+                continue  # keep draining so that producers never block on a dead worker
+            try:
+                start = time.time()
+                if stream is not None:
+                    stream.wait_event(event)
+                with _stream_context(stream):
+                    self.fn(item)
+                if stream is not None:
+                    stream.synchronize()
+                if self.timer is not None:
+                    self.timer.add(self.name, time.time() - start)
+            except BaseException as e:
+                self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f"{self.name} worker failed") from self.error
+
+    def submit(self, item):
+        self.check()
+        event = None
+        if self.cuda_stream and torch.cuda.is_available():
+            # the item is referenced until its stream is synchronized, so no record_stream is needed here
+            event = torch.cuda.Event()
+            event.record()
+        self.queue.put((item, event))
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put((_STOP, None))
+        for thread in self.threads:
+            thread.join()
+        self.check()
+
+
+def prefetch(iterable, name="prepare", timer=None, max_queue_size=1, cuda_stream=False):
+    """
+    Iterate over `iterable` while a background thread computes up to `max_queue_size` items ahead.
+
+    With `cuda_stream=True` the producer runs on a side CUDA stream which is synchronized before an item is handed
+    over, so GPU work such as text encoding overlaps with the consumer's kernels. `max_queue_size=0` disables the
+    thread and evaluates the items inline, e.g. when producing an item involves collective communication.
+    """
+    if max_queue_size <= 0:
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            if timer is not None:
+                timer.add(name, time.time() - start)
+            yield item
+
+    items = queue.Queue(maxsize=max_queue_size)
+
+    @torch.no_grad()
+    def produce():
+        stream = _new_stream(cuda_stream)
+        try:
+            iterator = iter(iterable)
+            while True:
+                start = time.time()
+                with _stream_context(stream):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                if stream is not None:
+                    stream.synchronize()
+                if timer is not None:
+                    timer.add(name, time.time() - start)
+                items.put((item, None))
+        except BaseException as e:
+            items.put((None, e))
+            return
+        items.put((_STOP, None))
+
+    threading.Thread(target=produce, name=name, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise RuntimeError(f"{name} stage failed") from error
+        if item is _STOP:
+            return
+        if cuda_stream and torch.cuda.is_available():
+            _record_stream(item, torch.cuda.current_stream())
+        yield item
+
+
+class PrecomputedTextEncoder:
+    """
+    Stand-in for a text encoder whose `encode` returns embeddings computed ahead of time, e.g. by the prefetch
+    stage. Everything else, such as `null`, is delegated to the wrapped encoder.
+    """
+
+    def __init__(self, text_encoder, encoded):
+        self.text_encoder = text_encoder
+        self.encoded = encoded
+
+    def encode(self, prompts):
+        assert len(prompts) == self.encoded["y"].shape[0], "Prompts do not match the precomputed embeddings"
+        return dict(self.encoded)
+
+    def __getattr__(self, name):
+        return getattr(self.text_encoder, name)
@@ -27,6 +27,41 @@ def prepare_multi_resolution_info(info_type, batch_size, image_size, num_frames,
         raise NotImplementedError
 
 
+def get_sample_seed(seed, sample_idx, num_sample=1, k=0):
+    # unique per (sample, repetition), independent of batching and of how prompts are sharded across ranks
+    return seed + sample_idx * num_sample + k
+
+
+# offset of the seeds of the noise drawn during sampling from those of the initial noise
+SAMPLING_SEED_OFFSET = 2**32
+
+
+def get_sample_noise(seeds, shape, device, dtype):
+    """
+    Draw the initial noise of each sample from its own generator.
+
+    Args:
+        seeds (list[int]): one seed per sample
+        shape (tuple): shape of the noise of one sample
+
+    Returns:
+        Tensor: noise of shape [len(seeds), *shape]
+    """
+    noise = [
+        torch.randn(shape, generator=torch.Generator(device).manual_seed(seed), device=device, dtype=dtype)
+        for seed in seeds
+    ]
+    return torch.stack(noise) if len(noise) > 0 else torch.empty(0, *shape, device=device, dtype=dtype)
+
+
+def get_sample_generators(seeds, device):
+    """
+    One generator per sample for the noise drawn during sampling, e.g. for the frames of masked sampling. They are
+    seeded apart from `get_sample_noise`, so that this noise does not repeat the initial noise.
+    """
+    return [torch.Generator(device).manual_seed(seed + SAMPLING_SEED_OFFSET) for seed in seeds]
+
+
 def load_prompts(prompt_path, start_idx=None, end_idx=None):
     with open(prompt_path, "r") as f:
         prompts = [line.strip() for line in f.readlines()]
@@ -83,21 +118,24 @@ def extract_json_from_prompts(prompts, reference, mask_strategy):
     return ret_prompts, reference, mask_strategy
 
 
-def collect_references_batch(reference_paths, vae, image_size):
-    refs_x = []  # refs_x: [batch, ref_num, C, T, H, W]
+def load_references_batch(reference_paths, image_size):
+    refs = []  # refs: [batch, ref_num, C, T, H, W] in pixel space
     for reference_path in reference_paths:
         if reference_path == "":
-            refs_x.append([])
+            refs.append([])
             continue
         ref_path = reference_path.split(";")
-        ref = []
-        for r_path in ref_path:
-            r = read_from_path(r_path, image_size, transform_name="resize_crop")
-            r_x = vae.encode(r.unsqueeze(0).to(vae.device, vae.dtype))
-            r_x = r_x.squeeze(0)
-            ref.append(r_x)
-        refs_x.append(ref)
-    return refs_x
+        refs.append([read_from_path(r_path, image_size, transform_name="resize_crop") for r_path in ref_path])
+    return refs
+
+
+def encode_references_batch(refs, vae):
+    # sampling the VAE posterior draws from the global RNG, so the caller decides which thread encodes
+    return [[vae.encode(r.unsqueeze(0).to(vae.device, vae.dtype)).squeeze(0) for r in ref] for ref in refs]
+
+
+def collect_references_batch(reference_paths, vae, image_size):
+    return encode_references_batch(load_references_batch(reference_paths, image_size), vae)
 
 
 def extract_prompts_loop(prompts, num_loop):
@@ -204,8 +242,22 @@ def apply_mask_strategy(z, refs_x, mask_strategys, loop_i, align=None):
     return masks
 
 
-def append_generated(vae, generated_video, refs_x, mask_strategy, loop_i, condition_frame_length, condition_frame_edit):
-    ref_x = vae.encode(generated_video)
+def append_generated(
+    vae,
+    generated_video,
+    refs_x,
+    mask_strategy,
+    loop_i,
+    condition_frame_length,
+    condition_frame_edit,
+    generated_latent=None,
+):
+    # the latents of the previous loop are the condition directly, which saves a decode and encode roundtrip;
+    # edited condition frames are still encoded from the decoded pixels
+    if generated_latent is not None and condition_frame_edit == 0:
+        ref_x = generated_latent
+    else:
+        ref_x = vae.encode(generated_video)
     for j, refs in enumerate(refs_x):
         if refs is None:
             refs_x[j] = [ref_x[j]]
@@ -0,0 +1,248 @@
+import os
+import time
+from copy import deepcopy
+
+import torch
+
+from opensora.acceleration.quantization import STDIT3_QUANT_EXCLUDE, quantize_model
+from opensora.datasets import save_sample
+from opensora.datasets.aspect import get_image_size, get_num_frames
+from opensora.models.text_encoder.t5 import text_preprocessing
+from opensora.registry import MODELS, SCHEDULERS, build_module
+from opensora.utils.ckpt_utils import load_checkpoint
+from opensora.utils.inference_utils import (
+    append_score_to_prompts,
+    get_sample_noise,
+    get_sample_seed,
+    get_save_path_name,
+    merge_prompt,
+    prepare_multi_resolution_info,
+    split_prompt,
+)
+from opensora.utils.misc import get_logger, synchronized_time, to_torch_dtype
+from opensora.utils.offload import get_offload_module, set_input_device
+
+
+class InferenceWorker:
+    """
+    Long-lived sampling worker for checkpoint sweeps.
+
+    The text encoder, VAE and scheduler are built once from the inference config and stay resident;
+    only the diffusion model weights are swapped when a new checkpoint is loaded.
+
+    Args:
+        cfg (Config): inference config, e.g. configs/opensora-v1-2/inference/sample.py
+        device (str): device to run on, defaults to cuda if available
+    """
+
+    def __init__(self, cfg, device=None):
+        self.cfg = cfg
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.dtype = to_torch_dtype(cfg.get("dtype", "bf16"))
+        self.logger = get_logger()
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+
+        start = synchronized_time(self.device)
+        quantize_text_encoder = cfg.get("quantize_text_encoder", None)
+        # a quantized text encoder is built on the host, so that its full-precision weights never reach the device
+        text_encoder_device = "cpu" if quantize_text_encoder is not None else self.device
+        self.text_encoder = build_module(cfg.text_encoder, MODELS, device=text_encoder_device)
+        if quantize_text_encoder is not None:
+            quantize_model(
+                get_offload_module(self.text_encoder), quantize_text_encoder, cfg.get("quantize_group_size", None)
+            )
+            get_offload_module(self.text_encoder).to(self.device)
+            set_input_device(self.text_encoder, self.device)
+        self.vae = build_module(cfg.vae, MODELS).to(self.device, self.dtype).eval()
+        self.scheduler = build_module(cfg.scheduler, SCHEDULERS)
+        self.model = None
+        self.ckpt_path = None
+        self.logger.info("Resident text encoder and VAE built in %.2fs", synchronized_time(self.device) - start)
+
+    def load_model(self, ckpt_path):
+        """
+        Load diffusion model weights from a checkpoint, building the model on first use.
+
+        Args:
+            ckpt_path (str): an `epochN-global_stepM` directory (sharded `model`), `ema.pt` or `.safetensors` file,
+                None to use `cfg.model.from_pretrained` (random weights if that is not set either)
+
+        Returns:
+            float: seconds spent loading the weights
+        """
+        start = synchronized_time(self.device)
+        quantize = self.cfg.get("quantize_model", None)
+        # quantized weights cannot be overwritten by a full-precision checkpoint, the model is rebuilt instead
+        rebuild = quantize is not None and ckpt_path is not None and ckpt_path != self.ckpt_path
+        if self.model is None or rebuild:
+            self.model = None
+            model_cfg = deepcopy(self.cfg.model)
+            if ckpt_path is not None:
+                model_cfg["from_pretrained"] = ckpt_path
+            model = build_module(
+                model_cfg,
+                MODELS,
+                input_size=(None, None, None),
+                in_channels=self.vae.out_channels,
+                caption_channels=self.text_encoder.output_dim,
+                model_max_length=self.text_encoder.model_max_length,
+            )
+            if quantize is not None:
+                quantize_model(model, quantize, self.cfg.get("quantize_group_size", None), exclude=STDIT3_QUANT_EXCLUDE)
+            self.model = model.to(self.device, self.dtype).eval()
+            self.text_encoder.y_embedder = self.model.y_embedder  # HACK: for classifier-free guidance
+        elif ckpt_path is not None and ckpt_path != self.ckpt_path:
+            load_checkpoint(self.model, ckpt_path)
+        self.ckpt_path = ckpt_path
+        load_time = synchronized_time(self.device) - start
+        self.logger.info("Loaded %s in %.2fs", ckpt_path, load_time)
+        return load_time
+
+    def process_prompts(self, prompts):
+        processed = []
+        for prompt in prompts:
+            prompt_segment_list, loop_idx_list = split_prompt(prompt)
+            prompt_segment_list = append_score_to_prompts(
+                prompt_segment_list,
+                aes=self.cfg.get("aes", None),
+                flow=self.cfg.get("flow", None),
+                camera_motion=self.cfg.get("camera_motion", None),
+            )
+            prompt_segment_list = [text_preprocessing(prompt) for prompt in prompt_segment_list]
+            processed.append(merge_prompt(prompt_segment_list, loop_idx_list))
+        return processed
+
+    @torch.no_grad()
+    def generate(self, prompts, save_dir, num_frames=None, resolution=None, aspect_ratio=None, batch_size=None):
+        """
+        Sample one video per prompt with the currently loaded weights and save them as `sample_{idx:04d}`.
+        Only plain text-to-video is supported, matching what `scripts/inference.py` does without references, and
+        prompt `idx` gets the same noise seed `get_sample_seed(cfg.seed, idx)` as there.
+
+        Returns:
+            float: seconds spent sampling, decoding and saving
+        """
+        assert self.model is not None, "Call load_model before generate"
+        cfg = self.cfg
+        num_frames = get_num_frames(num_frames or cfg.num_frames)
+        image_size = get_image_size(resolution or cfg.resolution, aspect_ratio or cfg.aspect_ratio)
+        latent_size = self.vae.get_latent_size((num_frames, *image_size))
+        batch_size = int(batch_size or cfg.get("batch_size", 1))
+        fps = cfg.fps
+        save_fps = cfg.get("save_fps", fps // cfg.get("frame_interval", 1))
+        os.makedirs(save_dir, exist_ok=True)
+
+        start = synchronized_time(self.device)
+        for i in range(0, len(prompts), batch_size):
+            batch_prompts = self.process_prompts(prompts[i : i + batch_size])
+            model_args = prepare_multi_resolution_info(
+                cfg.get("multi_resolution", None),
+                len(batch_prompts),
+                image_size,
+                num_frames,
+                fps,
+                self.device,
+                self.dtype,
+            )
+
+            seeds = [get_sample_seed(cfg.get("seed", 1024), i + idx) for idx in range(len(batch_prompts))]
+            z = get_sample_noise(seeds, (self.vae.out_channels, *latent_size), self.device, self.dtype)
+            samples = self.scheduler.sample(
+                self.model,
+                self.text_encoder,
+                z=z,
+                prompts=batch_prompts,
+                device=self.device,
+                additional_args=model_args,
+                progress=cfg.get("verbose", 1) >= 2,
+            )
+            samples = self.vae.decode(samples.to(self.dtype), num_frames=num_frames)
+
+            for idx in range(len(batch_prompts)):
+                save_path = get_save_path_name(save_dir, sample_name=cfg.get("sample_name", None), sample_idx=i + idx)
+                save_sample(samples[idx], fps=save_fps, save_path=save_path, verbose=False)
+        sample_time = synchronized_time(self.device) - start
+        self.logger.info("Sampled %s prompts in %.2fs", len(prompts), sample_time)
+        return sample_time
+
+    @torch.no_grad()
+    def generate_batch(
+        self,
+        prompts,
+        seeds,
+        save_paths,
+        num_frames=None,
+        resolution=None,
+        aspect_ratio=None,
+        num_sampling_steps=None,
+        cfg_scale=None,
+    ):
+        """
+        Sample one batch of compatible prompts, each with its own noise seed, and save them to `save_paths`.
+
+        Returns:
+            dict: seconds spent in `denoise` (text encoding and sampling), `decode` (VAE) and `encode` (mp4 writing),
+                and the saved file paths in `save_paths`
+        """
+        assert self.model is not None, "Call load_model before generate_batch"
+        cfg = self.cfg
+        num_frames = get_num_frames(num_frames or cfg.num_frames)
+        image_size = get_image_size(resolution or cfg.resolution, aspect_ratio or cfg.aspect_ratio)
+        latent_size = self.vae.get_latent_size((num_frames, *image_size))
+        save_fps = cfg.get("save_fps", cfg.fps // cfg.get("frame_interval", 1))
+
+        start = synchronized_time(self.device)
+        batch_prompts = self.process_prompts(prompts)
+        model_args = prepare_multi_resolution_info(
+            cfg.get("multi_resolution", None), len(prompts), image_size, num_frames, cfg.fps, self.device, self.dtype
+        )
+        z = get_sample_noise(seeds, (self.vae.out_channels, *latent_size), self.device, self.dtype)
+        default_steps = self.scheduler.num_sampling_steps
+        if num_sampling_steps is not None:
+            self.scheduler.num_sampling_steps = num_sampling_steps
+        try:
+            samples = self.scheduler.sample(
+                self.model,
+                self.text_encoder,
+                z=z,
+                prompts=batch_prompts,
+                device=self.device,
+                additional_args=model_args,
+                progress=cfg.get("verbose", 1) >= 2,
+                guidance_scale=cfg_scale,
+            )
+        finally:
+            self.scheduler.num_sampling_steps = default_steps
+        decode_start = synchronized_time(self.device)
+        samples = self.vae.decode(samples.to(self.dtype), num_frames=num_frames)
+        encode_start = synchronized_time(self.device)
+        saved_paths = [
+            save_sample(sample, fps=save_fps, save_path=save_path, verbose=False)
+            for sample, save_path in zip(samples, save_paths)
+        ]
+        end = time.time()
+        return dict(
+            denoise=decode_start - start,
+            decode=encode_start - decode_start,
+            encode=end - encode_start,
+            save_paths=saved_paths,
+        )
+
+    def run(self, ckpt_path, prompts, save_dir, **kwargs):
+        """
+        Swap in `ckpt_path` and sample all prompts into `save_dir`.
+
+        Returns:
+            dict: per-checkpoint `load_time` and `sample_time` in seconds
+        """
+        load_time = self.load_model(ckpt_path)
+        sample_time = self.generate(prompts, save_dir, **kwargs)
+        self.logger.info(
+            "Checkpoint %s: load %.2fs (%.1f%%), sampling %.2fs",
+            ckpt_path,
+            load_time,
+            100 * load_time / max(load_time + sample_time, 1e-6),
+            sample_time,
+        )
+        return dict(load_time=load_time, sample_time=sample_time)
@@ -3,8 +3,9 @@ import importlib
 import logging
 import os
 import time
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from collections.abc import Sequence
+from contextlib import contextmanager
 from itertools import repeat
 from typing import Optional, Tuple
 
@@ -358,6 +359,12 @@ def all_exists(paths):
 # ======================================================
 
 
+def synchronized_time(device=None):
+    if torch.cuda.is_available() and (device is None or torch.device(device).type == "cuda"):
+        torch.cuda.synchronize()
+    return time.time()
+
+
 class Timer:
     def __init__(self, name, log=False, coordinator: Optional[DistCoordinator] = None):
         self.name = name
@@ -384,6 +391,59 @@ class Timer:
             print(f"Elapsed time for {self.name}: {self.elapsed_time:.2f} s")
 
 
+class EventTimers:
+    """
+    Non-blocking stage timers.
+
+    `with timers(name):` records a pair of CUDA events around the stage on the current stream instead of synchronizing
+    the device, so timing does not serialize the host with the GPU. `summary` reads the pairs whose end event has
+    completed, leaves the others for the next window, and returns the mean duration in seconds of each stage over the
+    window since the previous call. Host time is used without CUDA, and nothing is recorded if `enabled` is False.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.use_cuda = torch.cuda.is_available()
+        self.pending = []
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def _record(self):
+        if not self.use_cuda:
+            return time.perf_counter()
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        return event
+
+    @contextmanager
+    def __call__(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = self._record()
+        try:
+            yield
+        finally:
+            self.pending.append((name, start, self._record()))
+
+    def summary(self) -> dict:
+        pending = []
+        for name, start, end in self.pending:
+            if not self.use_cuda:
+                self.totals[name] += end - start
+            elif end.query():
+                self.totals[name] += start.elapsed_time(end) / 1000
+            else:
+                pending.append((name, start, end))
+                continue
+            self.counts[name] += 1
+        self.pending = pending
+        summary = {name: self.totals[name] / self.counts[name] for name in self.counts}
+        self.totals.clear()
+        self.counts.clear()
+        return summary
+
+
 def get_tensor_memory(tensor, human_readable=True):
     size = tensor.element_size() * tensor.nelement()
     if human_readable:
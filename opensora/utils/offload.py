@@ -0,0 +1,194 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+
+from opensora.utils.misc import get_logger
+
+
+def get_offload_module(component):
+    """
+    Return the nn.Module holding the weights of a model, VAE or text encoder wrapper.
+    """
+    if isinstance(component, nn.Module):
+        return component
+    if hasattr(component, "t5"):  # T5Encoder
+        return component.t5.model
+    if hasattr(component, "text_encoder"):  # ClipEncoder
+        return component.text_encoder
+    raise ValueError(f"Cannot offload {type(component).__name__}")
+
+
+def set_input_device(component, device):
+    """
+    Make a text encoder wrapper built on the host send its token tensors to `device`, where the offload scheduler
+    places its weights for encoding.
+    """
+    if hasattr(component, "t5"):  # T5Encoder
+        component.t5.device = torch.device(device)
+    elif hasattr(component, "text_encoder"):  # ClipEncoder
+        component.text_encoder.device = device
+    elif hasattr(component, "device"):
+        component.device = device
+
+
+class _Component:
+    def __init__(self, name, module, policy, offload_dir):
+        self.name = name
+        self.module = module
+        self.policy = policy
+        self.path = os.path.join(offload_dir, f"{name}.pt") if policy == "disk" else None
+        self.future = None  # pending prefetch, returns the device tensors and the event of their copy
+        self.on_device = True
+
+        # parameters and buffers, tied weights are handled once
+        self.slots = []  # (parameter or buffer dict of a submodule, key, index into the state)
+        index = {}
+        for m in module.modules():
+            for attrs in (m._parameters, m._buffers):
+                for key, tensor in attrs.items():
+                    if tensor is not None:
+                        self.slots.append((attrs, key, index.setdefault(id(tensor), len(index))))
+
+        # host copy of the weights, pinned so that copies to the device are asynchronous
+        state = [t.detach().to("cpu") for t in self.tensors()]
+        if policy == "cpu":
+            self.state = [t.pin_memory() if torch.cuda.is_available() else t for t in state]
+        else:
+            os.makedirs(offload_dir, exist_ok=True)
+            torch.save(state, self.path)
+            self.state = None
+
+    def assign(self, tensors):
+        for attrs, key, i in self.slots:
+            if isinstance(attrs[key], nn.Parameter):
+                attrs[key].data = tensors[i]
+            else:
+                attrs[key] = tensors[i]
+
+    def load(self, device, stream):
+        # runs in the prefetch thread
+        state = self.state if self.state is not None else torch.load(self.path, map_location="cpu", mmap=True)
+        with torch.cuda.stream(stream) if stream is not None else nullcontext():
+            tensors = [t.to(device, non_blocking=True) for t in state]
+        event = None
+        if stream is not None:
+            event = torch.cuda.Event()
+            event.record(stream)
+        return tensors, event
+
+    def offload(self):
+        if self.policy == "cpu":
+            self.assign(self.state)
+        else:
+            self.assign([torch.empty_like(t, device="meta") for t in self.tensors()])
+        self.on_device = False
+
+    def tensors(self):
+        tensors = {}
+        for attrs, key, i in self.slots:
+            tensors.setdefault(i, attrs[key])
+        return [tensors[i] for i in range(len(tensors))]
+
+
+class OffloadScheduler:
+    """
+    Keep idle models off the device and move each one to the device only for the stage that needs it.
+
+    Registered components are offloaded immediately: with `policy="cpu"` their weights live in pinned host memory,
+    with `policy="disk"` they are saved to `offload_dir` and replaced by meta tensors, so they use neither device nor
+    host memory. `use(names, prefetch=...)` makes the named components resident, offloads all others, and starts
+    copying the components of the next stage to the device on a side stream while the current stage runs. Only
+    inference is supported: the weights are not copied back, the host copy stays the source of truth.
+
+    Args:
+        device (str): compute device
+        policy (str): "cpu" or "disk"
+        offload_dir (str): directory of the offloaded weights for the disk policy
+        prefetch (bool): copy the next stage's weights ahead of time, trades memory for latency
+    """
+
+    def __init__(self, device, policy="cpu", offload_dir="./offload", prefetch=True):
+        assert policy in ["cpu", "disk"], f"Unknown offload policy {policy}"
+        self.device = torch.device(device)
+        self.policy = policy
+        self.offload_dir = offload_dir
+        self.prefetch_enabled = prefetch
+        self.components = {}
+        self.stage = None
+        self.peak_memory = {}
+        self.is_cuda = self.device.type == "cuda" and torch.cuda.is_available()
+        self.stream = torch.cuda.Stream(self.device) if self.is_cuda else None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="offload")
+        self.logger = get_logger()
+
+    def register(self, name, component):
+        component = _Component(name, get_offload_module(component), self.policy, self.offload_dir)
+        self.components[name] = component
+        component.offload()
+        if self.is_cuda:
+            torch.cuda.empty_cache()
+        size = sum(t.numel() * t.element_size() for t in component.tensors()) / 1024**3
+        self.logger.info("Offloaded %s (%.2f GB) to %s", name, size, self.policy)
+
+    def prefetch(self, names):
+        for name in names:
+            component = self.components[name]
+            if not component.on_device and component.future is None:
+                component.future = self.executor.submit(component.load, self.device, self.stream)
+
+    def fetch(self, name):
+        component = self.components[name]
+        if component.on_device:
+            return
+        if component.future is None:
+            self.prefetch([name])
+        tensors, event = component.future.result()
+        component.future = None
+        if event is not None:
+            # the copies ran on the side stream, order them before the kernels of this stage
+            torch.cuda.current_stream(self.device).wait_event(event)
+            for t in tensors:
+                t.record_stream(torch.cuda.current_stream(self.device))
+        component.assign(tensors)
+        component.on_device = True
+
+    def use(self, names, stage=None, prefetch=()):
+        """
+        Make `names` resident for a stage, offload the other components and prefetch the next stage.
+
+        Args:
+            names (str or list[str]): components needed by the stage
+            stage (str): name under which the peak device memory is reported, defaults to the joined names
+            prefetch (str or list[str]): components of the next stage
+        """
+        names = [names] if isinstance(names, str) else list(names)
+        prefetch = [prefetch] if isinstance(prefetch, str) else list(prefetch)
+        self.record_peak_memory()
+        self.stage = stage or "+".join(names)
+
+        for name, component in self.components.items():
+            if name not in names and component.on_device:
+                component.offload()
+        for name in names:
+            self.fetch(name)
+        if self.prefetch_enabled:
+            self.prefetch([name for name in prefetch if name not in names])
+
+    def record_peak_memory(self):
+        if not self.is_cuda:
+            return
+        if self.stage is not None:
+            peak = torch.cuda.max_memory_allocated(self.device) / 1024**3
+            self.peak_memory[self.stage] = max(self.peak_memory.get(self.stage, 0.0), peak)
+        torch.cuda.reset_peak_memory_stats(self.device)
+
+    def summary(self):
+        self.record_peak_memory()
+        self.stage = None
+        return "\n".join(f"{stage}: peak {peak:.2f} GB" for stage, peak in self.peak_memory.items())
+
+    def close(self):
+        self.executor.shutdown()
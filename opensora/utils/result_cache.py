@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import torch
+
+from opensora.utils.misc import get_logger
+
+VIDEO_EXTENSIONS = (".mp4", ".png")
+
+
+def file_digest(paths, root=None, chunk_size=1 << 24):
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(os.path.relpath(path, root).encode("utf-8") if root is not None else b"")
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of generated samples.
+
+    An entry is keyed by everything that determines a sample: the content hash of the checkpoint, the final prompt,
+    the noise, the video size and the scheduler parameters (see `key`). It is a directory holding the sampled
+    latents of every loop (`latent.pt`) and/or the encoded video (`sample.mp4` or `sample.png`), depending on
+    `store`. Files are written to a temporary name and renamed, so concurrent readers never see partial entries.
+    Hits touch the entry, and the least recently used entries are evicted once the cache exceeds `max_size_gb`.
+
+    Args:
+        cache_dir (str): root directory of the cache
+        max_size_gb (float): size limit in GB
+        store (str): "video", "latent" or "both"
+    """
+
+    def __init__(self, cache_dir, max_size_gb=50.0, store="video"):
+        assert store in ["video", "latent", "both"], f"Unknown result cache store {store}"
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_gb * 1024**3)
+        self.store = store
+        self.lock = threading.Lock()
+        self.logger = get_logger()
+        self.hits = self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(size for _, _, size in self.entries())
+
+    # ======================================================
+    # keys
+    # ======================================================
+    def checkpoint_hash(self, path):
+        """
+        Content hash of a checkpoint file or sharded checkpoint directory, memoized by path, size and mtime so
+        that unchanged weights are hashed once. Paths that do not exist, such as hub ids, are used as is. Only the
+        `model` weights of a training checkpoint directory are hashed, which is what `load_checkpoint` reads, so
+        the optimizer states and running states neither cost reads nor change the hash.
+        """
+        if path is None or not os.path.exists(path):
+            return f"id:{path}"
+        if os.path.isdir(os.path.join(path, "model")):
+            path = os.path.join(path, "model")
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+        else:
+            files = [path]
+        stats = [(os.path.relpath(f, path), os.path.getsize(f), os.path.getmtime(f)) for f in files]
+        stat_key = hashlib.sha1(json.dumps([os.path.abspath(path), stats]).encode("utf-8")).hexdigest()
+
+        memo_path = os.path.join(self.cache_dir, "checkpoints", f"{stat_key}.txt")
+        if os.path.exists(memo_path):
+            with open(memo_path) as f:
+                return f.read().strip()
+        digest = file_digest(files, root=path if os.path.isdir(path) else None)
+
+        def write_digest(tmp_path):
+            with open(tmp_path, "w") as f:
+                f.write(digest)
+
+        self._write_atomic(memo_path, write_digest)
+        self.logger.info("Hashed checkpoint %s: %s", path, digest)
+        return digest
+
+    def key(self, **fields):
+        content = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    # ======================================================
+    # entries
+    # ======================================================
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def entries(self):
+        for prefix in os.scandir(self.cache_dir):
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    yield entry.path, entry.stat().st_mtime, size
+                except FileNotFoundError:
+                    continue  # evicted by another process
+
+    def lookup(self, key):
+        """
+        Returns:
+            dict: paths of the cached `video` and `latent` (None if not stored), None on a miss
+        """
+        entry_dir = self.entry_dir(key)
+        video = latent = None
+        if os.path.isdir(entry_dir):
+            for ext in VIDEO_EXTENSIONS:
+                if os.path.exists(os.path.join(entry_dir, f"sample{ext}")):
+                    video = os.path.join(entry_dir, f"sample{ext}")
+            if os.path.exists(os.path.join(entry_dir, "latent.pt")):
+                latent = os.path.join(entry_dir, "latent.pt")
+        if video is None and latent is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        try:
+            os.utime(entry_dir)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return dict(video=video, latent=latent)
+
+    def restore_video(self, video_path, save_path):
+        """
+        Copy a cached video to `save_path` (without extension), returns the path with extension.
+        """
+        save_path = save_path + os.path.splitext(video_path)[1]
+        shutil.copyfile(video_path, save_path)
+        return save_path
+
+    def load_latent(self, latent_path, device=None):
+        return [z.to(device) for z in torch.load(latent_path, map_location="cpu")]
+
+    def put_latent(self, key, latents):
+        """
+        Args:
+            latents (list[Tensor]): latents of one sample, one [C, T, H, W] tensor per loop
+        """
+        if self.store == "video":
+            return
+        latents = [z.detach().to("cpu").contiguous().clone() for z in latents]
+        self._put(key, "latent.pt", lambda tmp_path: torch.save(latents, tmp_path))
+
+    def put_video(self, key, video_path):
+        if self.store == "latent":
+            return
+        name = f"sample{os.path.splitext(video_path)[1]}"
+        self._put(key, name, lambda tmp_path: shutil.copyfile(video_path, tmp_path))
+
+    def _write_atomic(self, path, write_fn):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _put(self, key, name, write_fn):
+        path = os.path.join(self.entry_dir(key), name)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._write_atomic(path, write_fn)
+        with self.lock:
+            self.size += os.path.getsize(path) - old_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        # least recently used first, down to 90% of the limit so that eviction does not run on every put
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.size = sum(size for _, _, size in entries)
+        target = int(self.max_size * 0.9)
+        num_evicted = 0
+        for entry_dir, _, size in entries:
+            if self.size <= target:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.size -= size
+            num_evicted += 1
+        self.logger.info("Evicted %s result cache entries, %.2f GB left", num_evicted, self.size / 1024**3)
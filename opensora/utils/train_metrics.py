@@ -0,0 +1,131 @@
+import torch
+import torch.distributed as dist
+
+from opensora.datasets.aspect import ASPECT_RATIOS
+
+from .inference_pipeline import BackgroundWorker
+
+# slots of the accumulator, followed by the loss sum and the number of steps of every bucket
+LOSS, LAST_LOSS, STEPS, GRAD_NORM, GRAD_NORM_STEPS, WEIGHT_NORM = range(6)
+NUM_SLOTS = 6
+
+
+def get_bucket_names(bucket_config: dict) -> dict:
+    """
+    Map the (num_frames, height, width) of every bucket in `bucket_config` to the name "{resolution}-{num_frames}".
+    """
+    bucket_names = {}
+    for resolution, frames in bucket_config.items():
+        for num_frames in frames:
+            for height, width in ASPECT_RATIOS[resolution][1].values():
+                bucket_names[(num_frames, height, width)] = f"{resolution}-{num_frames}"
+    return bucket_names
+
+
+class TrainingMetrics:
+    """
+    Training metrics accumulated on the device, so that logging never blocks the host on the GPU.
+
+    `update` adds the loss of a step, its gradient norm and the loss of its bucket to a device tensor without reading
+    them back. `flush` reduces the tensor across ranks with a single all-reduce, queues its copy to pinned memory and
+    returns; a background thread on rank 0 waits for the copy and writes the averages over the interval to
+    tensorboard and wandb. `latest` holds the last written metrics.
+
+    Args:
+        device (torch.device): device of the accumulated tensors
+        bucket_config (dict): bucket config of the dataset, the loss is also averaged per (resolution, num_frames)
+        tb_writer (SummaryWriter): tensorboard writer of rank 0
+        use_wandb (bool): also log to wandb on rank 0
+    """
+
+    def __init__(self, device, bucket_config: dict = None, tb_writer=None, use_wandb: bool = False):
+        self.bucket_names = get_bucket_names(bucket_config) if bucket_config is not None else {}
+        self.bucket_slots = {}
+        for name in self.bucket_names.values():
+            self.bucket_slots.setdefault(name, NUM_SLOTS + 2 * len(self.bucket_slots))
+        self.sums = torch.zeros(NUM_SLOTS + 2 * len(self.bucket_slots), dtype=torch.float32, device=device)
+        self.tb_writer = tb_writer
+        self.use_wandb = use_wandb
+        self.world_size = dist.get_world_size()
+        self.is_master = dist.get_rank() == 0
+        self.latest = {}
+        self.worker = BackgroundWorker(self._write, "metrics", max_queue_size=4) if self.is_master else None
+
+    @torch.no_grad()
+    def update(self, loss: torch.Tensor, grad_norm=None, bucket: tuple = None):
+        """
+        Args:
+            loss (torch.Tensor): local loss of the step
+            grad_norm (float | torch.Tensor): global gradient norm, skipped if None
+            bucket (tuple): (num_frames, height, width) of the batch
+        """
+        loss = loss.detach().float()
+        self.sums[LOSS].add_(loss)
+        self.sums[LAST_LOSS].copy_(loss)
+        self.sums[STEPS].add_(1)
+        if grad_norm is not None:
+            self.sums[GRAD_NORM].add_(grad_norm)
+            self.sums[GRAD_NORM_STEPS].add_(1)
+        name = self.bucket_names.get(bucket, None)
+        if name is not None:
+            slot = self.bucket_slots[name]
+            self.sums[slot].add_(loss)
+            self.sums[slot + 1].add_(1)
+
+    @torch.no_grad()
+    def update_weight_norm(self, model: torch.nn.Module):
+        norms = torch._foreach_norm([param.detach() for param in model.parameters()])
+        self.sums[WEIGHT_NORM].copy_(torch.stack(norms).float().norm())
+
+    @torch.no_grad()
+    def flush(self, step: int, extra: dict = None):
+        """
+        Reduce the metrics accumulated since the last flush and hand them to the writer thread. Collective, every rank
+        has to call it at the same steps.
+
+        Args:
+            step (int): global step the metrics are logged at
+            extra (dict): host values logged as is, e.g. the learning rate
+        """
+        dist.all_reduce(self.sums)
+        values = torch.empty(self.sums.shape, dtype=self.sums.dtype, pin_memory=torch.cuda.is_available())
+        values.copy_(self.sums, non_blocking=True)
+        copied = None
+        if self.sums.is_cuda:
+            copied = torch.cuda.Event()
+            copied.record()
+        self.sums.zero_()
+        if self.is_master:
+            self.worker.submit((step, values, copied, extra or {}))
+
+    def _write(self, item):
+        step, values, copied, extra = item
+        if copied is not None:
+            copied.synchronize()
+        values = values.tolist()
+        metrics = {}
+        if values[STEPS] > 0:
+            # the sums are over ranks and steps, the last loss and the weight norm only over ranks
+            metrics["loss"] = values[LAST_LOSS] / self.world_size
+            metrics["avg_loss"] = values[LOSS] / values[STEPS]
+        if values[GRAD_NORM_STEPS] > 0:
+            metrics["grad_norm"] = values[GRAD_NORM] / values[GRAD_NORM_STEPS]
+        if values[WEIGHT_NORM] > 0:
+            metrics["weight_norm"] = values[WEIGHT_NORM] / self.world_size
+        for name, slot in self.bucket_slots.items():
+            if values[slot + 1] > 0:
+                metrics[f"bucket_loss/{name}"] = values[slot] / values[slot + 1]
+        metrics.update(extra)
+        self.latest = metrics
+
+        if self.tb_writer is not None:
+            for key, value in metrics.items():
+                self.tb_writer.add_scalar(key, value, step)
+        if self.use_wandb:
+            import wandb
+
+            wandb.log(metrics, step=step)
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.close()
@@ -1,6 +1,6 @@
 import math
+import os
 import random
-from collections import OrderedDict
 
 import torch
 import torch.distributed as dist
@@ -40,6 +40,37 @@ def create_colossalai_plugin(plugin, dtype, grad_clip, sp_size, reduce_bucket_si
     return plugin
 
 
+def get_ema_params(ema_model: torch.nn.Module, model: torch.nn.Module, optimizer=None, sharded: bool = True):
+    """
+    Pair the EMA parameters with the parameters they track: the fp32 master parameters of the ZeRO optimizer for
+    sharded low-precision parameters and the model parameters otherwise.
+
+    Returns:
+        tuple[list, list]: EMA parameters and their source parameters
+    """
+    ema_params = dict(ema_model.named_parameters())
+    targets, sources = [], []
+    for name, param in model.named_parameters():
+        if name == "pos_embed":
+            continue
+        if not param.requires_grad:
+            continue
+        if sharded and param.dtype != torch.float32:
+            param = optimizer._param_store.working_to_master_param[id(param)]
+        targets.append(ema_params[name])
+        sources.append(param)
+    return targets, sources
+
+
+def ema_step(targets: list, sources: list, decay: float):
+    # parameters are re-read through `.data` every step as model_sharding/model_gathering swap the EMA storage
+    target_data = [p.data for p in targets]
+    source_data = [p.data for p in sources]
+    # one multi-tensor kernel launch per op for all parameters on the same device and dtype
+    torch._foreach_mul_(target_data, decay)
+    torch._foreach_add_(target_data, source_data, alpha=1 - decay)
+
+
 @torch.no_grad()
 def update_ema(
     ema_model: torch.nn.Module, model: torch.nn.Module, optimizer=None, decay: float = 0.9999, sharded: bool = True
@@ -47,25 +78,102 @@ def update_ema(
     """
     Step the EMA model towards the current model.
     """
-    ema_params = OrderedDict(ema_model.named_parameters())
-    model_params = OrderedDict(model.named_parameters())
+    ema_step(*get_ema_params(ema_model, model, optimizer=optimizer, sharded=sharded), decay)
 
-    for name, param in model_params.items():
-        if name == "pos_embed":
-            continue
-        if not param.requires_grad:
-            continue
-        if not sharded:
-            param_data = param.data
-            ema_params[name].mul_(decay).add_(param_data, alpha=1 - decay)
-        else:
-            if param.data.dtype != torch.float32:
-                param_id = id(param)
-                master_param = optimizer._param_store.working_to_master_param[param_id]
-                param_data = master_param.data
-            else:
-                param_data = param.data
-            ema_params[name].mul_(decay).add_(param_data, alpha=1 - decay)
+
+class EMAUpdater:
+    """
+    EMA update with the parameter pairing of `update_ema` computed once.
+
+    With `every_n_steps` > 1 the EMA is only updated on every n-th call, with the decay raised to the n-th power so
+    that its time constant in steps is unchanged.
+
+    Args:
+        ema_model (torch.nn.Module): EMA model, sharded by `model_sharding` if `sharded`
+        model (torch.nn.Module): model being trained
+        optimizer: ZeRO optimizer holding the master parameters of `model`
+        decay (float): decay per training step
+        sharded (bool): whether the EMA tracks the sharded master parameters
+        every_n_steps (int): update interval in training steps
+    """
+
+    def __init__(
+        self,
+        ema_model: torch.nn.Module,
+        model: torch.nn.Module,
+        optimizer=None,
+        decay: float = 0.9999,
+        sharded: bool = True,
+        every_n_steps: int = 1,
+    ):
+        assert every_n_steps >= 1, f"every_n_steps should be at least 1, got {every_n_steps}"
+        self.targets, self.sources = get_ema_params(ema_model, model, optimizer=optimizer, sharded=sharded)
+        self.decay = decay**every_n_steps
+        self.every_n_steps = every_n_steps
+        self.num_steps = 0
+
+    @torch.no_grad()
+    def __call__(self) -> bool:
+        """
+        Count a training step and update the EMA if it is due.
+
+        Returns:
+            bool: whether the EMA was updated
+        """
+        self.num_steps += 1
+        if self.num_steps % self.every_n_steps != 0:
+            return False
+        ema_step(self.targets, self.sources, self.decay)
+        return True
+
+
+def create_profiler(profiler_cfg: dict, exp_dir: str):
+    """
+    Build a torch.profiler for the steps selected by the schedule in `profiler_cfg`.
+
+    After `skip_first` steps, every cycle waits `wait` steps, warms up for `warmup` steps and records `active` steps,
+    `repeat` times (0 for the whole run). At the end of each cycle, the traces of the ranks in `ranks` are exported to
+    `{exp_dir}/profile` for tensorboard or chrome://tracing and, with `memory_snapshot`, a CUDA memory snapshot of the
+    recorded steps is dumped next to them for https://pytorch.org/memory_viz.
+
+    Returns:
+        torch.profiler.profile: profiler to `start`, `step` after every training step and `stop`, None if disabled
+    """
+    if profiler_cfg is None or dist.get_rank() not in profiler_cfg.get("ranks", [0]):
+        return None
+    profile_dir = os.path.join(exp_dir, "profile")
+    os.makedirs(profile_dir, exist_ok=True)
+    rank = dist.get_rank()
+    trace_handler = torch.profiler.tensorboard_trace_handler(profile_dir, worker_name=f"rank{rank}")
+    memory_snapshot = profiler_cfg.get("memory_snapshot", False) and torch.cuda.is_available()
+
+    def on_trace_ready(profiler):
+        trace_handler(profiler)
+        if memory_snapshot:
+            snapshot_path = os.path.join(profile_dir, f"rank{rank}_step{profiler.step_num}_memory.pickle")
+            torch.cuda.memory._dump_snapshot(snapshot_path)
+            get_logger().info("Saved memory snapshot to %s", snapshot_path)
+
+    if memory_snapshot:
+        # allocations are recorded from the start, the snapshots keep the most recent `max_entries` of them
+        torch.cuda.memory._record_memory_history(max_entries=profiler_cfg.get("max_entries", 100000))
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(
+            skip_first=profiler_cfg.get("skip_first", 10),
+            wait=profiler_cfg.get("wait", 1),
+            warmup=profiler_cfg.get("warmup", 1),
+            active=profiler_cfg.get("active", 3),
+            repeat=profiler_cfg.get("repeat", 1),
+        ),
+        on_trace_ready=on_trace_ready,
+        record_shapes=profiler_cfg.get("record_shapes", True),
+        profile_memory=profiler_cfg.get("profile_memory", True),
+        with_stack=profiler_cfg.get("with_stack", False),
+    )
 
 
 class MaskGenerator:
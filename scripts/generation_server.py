@@ -0,0 +1,55 @@
+"""
+Local HTTP text-to-video server with dynamic batching of compatible requests.
+
+Example:
+    python scripts/generation_server.py configs/opensora-v1-2/inference/sample.py --port 8000
+    curl -X POST localhost:8000/generate -d '{"prompt": "a cat playing piano", "seed": 42, "wait": true}'
+"""
+
+import argparse
+
+from opensora.utils.config_utils import read_config
+from opensora.utils.generation_server import GenerationServer, serve
+from opensora.utils.inference_worker import InferenceWorker
+from opensora.utils.misc import create_logger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", nargs="?", default="configs/opensora-v1-2/inference/sample.py")
+    parser.add_argument("--ckpt-path", default=None, type=str, help="model weights, cfg.model.from_pretrained if unset")
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument("--save-dir", default="./samples/server", type=str)
+    parser.add_argument("--max-batch-size", default=4, type=int)
+    parser.add_argument("--max-batch-tokens", default=None, type=int, help="latent tokens per batch, no limit if unset")
+    parser.add_argument("--max-wait", default=0.1, type=float, help="seconds to wait for compatible requests")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logger = create_logger()
+    worker = InferenceWorker(read_config(args.config))
+    worker.load_model(args.ckpt_path)
+
+    server = GenerationServer(
+        worker,
+        args.save_dir,
+        max_batch_size=args.max_batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        max_wait=args.max_wait,
+    )
+    httpd = serve(server, args.host, args.port)
+    logger.info("Serving on http://%s:%s", args.host, args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,21 @@ import argparse
 
 import wandb
 
+from opensora.utils.ckpt_utils import CKPT_COMPLETE_MARKER
+from opensora.utils.config_utils import read_config
+from opensora.utils.inference_worker import InferenceWorker
+from opensora.utils.misc import create_logger
+
 wandb.require("core")
 
 project = "sora_speedrun"
 ckpt_dir = "outputs_speedrun"
+config_path = "configs/opensora-v1-2/inference/sample.py"
 
 api = wandb.Api()
 runs = list(api.runs())
 expnum_pattern = re.compile(r'(\d+)-')
-step_pattern = re.compile(r'.*global_step(\d+)')
+step_pattern = re.compile(r'.*global_step(\d+)$')
 def get_run_id(expnum):
     for run in runs:
         if "(" in run.name and ")" in run.name:
@@ -26,9 +32,17 @@ def get_run_id(expnum):
                 return run.id
 
 
+def is_ckpt_ready(name, require_complete=False):
+    # checkpoints are written into `*.tmp` and renamed when done, an unmarked directory next to its `.tmp` is being
+    # replaced; checkpoints saved before the completion marker existed have no marker and count as complete
+    if name.endswith(".tmp"):
+        return False
+    if os.path.exists(os.path.join(name, CKPT_COMPLETE_MARKER)):
+        return True
+    return not require_complete and not os.path.exists(name + ".tmp")
 
 
-def run_script(settings, global_settings, input_name, prompts, last_step, compute_only, commit):
+def run_script(settings, global_settings, input_name, prompts, last_step, compute_only, commit, worker=None):
     settingsstr = '_'.join(f'{v.replace(":", "-")}' for k, v in settings.items())
     output_dir = input_name.replace(ckpt_dir + "/", f"samples/{settingsstr}/")
     os.makedirs(output_dir, exist_ok=True)
@@ -53,13 +67,26 @@ def run_script(settings, global_settings, input_name, prompts, last_step, comput
     if not os.path.exists(output_file):
         if expnum == 999:
             input_name += "/model.safetensors"
-        full_settings = {**settings, **global_settings, "ckpt-path": input_name, "save-dir": output_dir}
-        script_args = [f"--{k} {v}" for k, v in full_settings.items()]
-        script_args = " ".join(script_args)
-        command = f"python scripts/inference.py configs/opensora-v1-2/inference/sample.py {script_args}"
-        result = subprocess.run(command, shell=True, env=os.environ.copy())
-        if result.returncode != 0:
-            return None
+        if worker is not None:
+            # keep text encoder & vae resident, only swap the diffusion weights
+            timings = worker.run(
+                input_name,
+                prompts,
+                output_dir,
+                num_frames=settings["num-frames"],
+                resolution=settings["resolution"],
+                aspect_ratio=settings["aspect-ratio"],
+                batch_size=global_settings["batch-size"],
+            )
+            print(f"{input_name}: load {timings['load_time']:.2f}s, sampling {timings['sample_time']:.2f}s")
+        else:
+            full_settings = {**settings, **global_settings, "ckpt-path": input_name, "save-dir": output_dir}
+            script_args = [f"--{k} {v}" for k, v in full_settings.items()]
+            script_args = " ".join(script_args)
+            command = f"python scripts/inference.py {config_path} {script_args}"
+            result = subprocess.run(command, shell=True, env=os.environ.copy())
+            if result.returncode != 0:
+                return None
     else:
         if compute_only:  # or global_step < 400:
             return None
@@ -101,6 +128,8 @@ def main():
     parser.add_argument('--last_step', type=int, default=None, help='Last processed step')
     parser.add_argument('--save_to', default=None, help='Attach to run with id "save_to".')
     parser.add_argument('--only-first-of-epoch', action='store_true', help='Use only the first folder for each epoch')
+    parser.add_argument('--require-complete', action='store_true', help='Skip checkpoints without the completion marker, e.g. saved before it existed')
+    parser.add_argument('--subprocess', action='store_true', help='Run scripts/inference.py once per checkpoint instead of the resident worker')
     args = parser.parse_args()
 
     save_to_new = args.save_to == "new"
@@ -131,6 +160,12 @@ def main():
 
     last_step = args.last_step
 
+    if args.subprocess:
+        worker = None
+    else:
+        create_logger()
+        worker = InferenceWorker(read_config(config_path))
+
     while True:
 
         # DEBUG
@@ -145,6 +180,7 @@ def main():
         input_names = []
         for expnum in expnums:
             input_names += glob.glob("./" + ckpt_dir + "/%03d-STDiT3-XL-2/epoch*" % expnum)
+        input_names = [name for name in input_names if is_ckpt_ready(name, args.require_complete)]
         #input_names = sorted(input_names, key=lambda name: int(re.search(r'epoch(\d+)-', name).group(1)))
 
         filtered_input_names = []
@@ -180,7 +216,7 @@ def main():
             for settings in settings_list:
                 job = (settings, {**global_settings, **({} if settings["num-frames"] == "4s" and settings["resolution"] == "360p" else {"batch-size": 2})}, input_name, prompts)
                 is_last_setting = settings == settings_list[-1]
-                last_step_new = run_script(*job, last_step, compute_only, is_last_setting)
+                last_step_new = run_script(*job, last_step, compute_only, is_last_setting, worker=worker)
                 if last_step_new:
                     last_step = last_step_new
 
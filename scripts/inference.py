@@ -1,37 +1,55 @@
 import os
 import time
+from collections import OrderedDict
+from functools import partial
 from pprint import pformat
 
 import colossalai
 import torch
 import torch.distributed as dist
-from colossalai.cluster import DistCoordinator
+import torch.nn.functional as F
+from colossalai.cluster import DistCoordinator, ProcessGroupMesh
 from mmengine.runner import set_random_seed
 from tqdm import tqdm
 
-from opensora.acceleration.parallel_states import set_sequence_parallel_group
-from opensora.datasets import save_sample
-from opensora.datasets.aspect import get_image_size, get_num_frames
+from opensora.acceleration.parallel_states import (
+    get_data_parallel_group,
+    get_sequence_parallel_group,
+    set_data_parallel_group,
+    set_sequence_parallel_group,
+)
+from opensora.acceleration.plugin import DP_AXIS, SP_AXIS
+from opensora.acceleration.quantization import STDIT3_QUANT_EXCLUDE, quantize_model
+from opensora.datasets import VideoWriter, save_sample, to_uint8_frames
+from opensora.datasets.aspect import get_closest_image_size, get_image_size, get_num_frames
 from opensora.models.text_encoder.t5 import text_preprocessing
 from opensora.registry import MODELS, SCHEDULERS, build_module
+from opensora.schedulers.rf import RFLOW, resample_cfg_schedule
 from opensora.utils.config_utils import parse_configs
 from opensora.utils.inference_utils import (
     add_watermark,
     append_generated,
     append_score_to_prompts,
     apply_mask_strategy,
-    collect_references_batch,
     dframe_to_frame,
+    encode_references_batch,
     extract_json_from_prompts,
     extract_prompts_loop,
+    get_sample_generators,
+    get_sample_noise,
+    get_sample_seed,
     get_save_path_name,
     load_prompts,
+    load_references_batch,
     merge_prompt,
     prepare_multi_resolution_info,
     refine_prompts_by_openai,
     split_prompt,
 )
-from opensora.utils.misc import all_exists, create_logger, is_distributed, is_main_process, to_torch_dtype
+from opensora.utils.inference_pipeline import BackgroundWorker, PrecomputedTextEncoder, StageTimer, prefetch
+from opensora.utils.misc import all_exists, create_logger, is_distributed, to_torch_dtype
+from opensora.utils.offload import OffloadScheduler, get_offload_module, set_input_device
+from opensora.utils.result_cache import ResultCache
 
 
 def main():
@@ -51,15 +69,25 @@ def main():
     torch.backends.cudnn.allow_tf32 = True
 
     # == init distributed env ==
+    # ranks form a dp_size x sp_size mesh: prompts are sharded across data-parallel groups
+    # and each group denoises its batches with sequence parallelism over sp_size ranks
+    dp_size, dp_rank, sp_size, sp_rank = 1, 0, 1, 0
     if is_distributed():
         colossalai.launch_from_torch({})
         coordinator = DistCoordinator()
-        enable_sequence_parallelism = coordinator.world_size > 1
-        if enable_sequence_parallelism:
-            set_sequence_parallel_group(dist.group.WORLD)
+        sp_size = cfg.get("sp_size", coordinator.world_size)
+        assert coordinator.world_size % sp_size == 0, "world_size must be divisible by sp_size"
+        dp_size = coordinator.world_size // sp_size
+        pg_mesh = ProcessGroupMesh(dp_size, sp_size)
+        dp_rank, sp_rank = pg_mesh.coordinate(DP_AXIS), pg_mesh.coordinate(SP_AXIS)
+        set_data_parallel_group(pg_mesh.get_group_along_axis(DP_AXIS))
+        set_sequence_parallel_group(pg_mesh.get_group_along_axis(SP_AXIS))
     else:
         coordinator = None
-        enable_sequence_parallelism = False
+    enable_sequence_parallelism = sp_size > 1
+    # the first rank of each sequence-parallel group refines prompts, looks up the cache and saves samples
+    is_group_main = sp_rank == 0
+    group_src = dp_rank * sp_size  # global rank of the first rank of the group
     set_random_seed(seed=cfg.get("seed", 1024))
 
     # == init logger ==
@@ -72,9 +100,34 @@ def main():
     # build model & load weights
     # ======================================================
     logger.info("Building models...")
+    # == prepare model offload ==
+    # idle models are kept on the host or on disk and moved to the device only for the stage that needs them
+    offloader = None
+    build_device = device
+    if cfg.get("offload_models", None) is not None:
+        offloader = OffloadScheduler(
+            device,
+            policy=cfg.offload_models,
+            offload_dir=cfg.get("offload_dir", "./offload"),
+            prefetch=cfg.get("offload_prefetch", True),
+        )
+        build_device = "cpu"
+
     # == build text-encoder and vae ==
-    text_encoder = build_module(cfg.text_encoder, MODELS, device=device)
-    vae = build_module(cfg.vae, MODELS).to(device, dtype).eval()
+    # the text encoder is built on the host when offloading, where the scheduler moves it to the device for encoding,
+    # or when quantizing, so that its full-precision weights never reach the device
+    quantize_text_encoder = cfg.get("quantize_text_encoder", None)
+    text_encoder_device = "cpu" if offloader is not None or quantize_text_encoder is not None else device
+    text_encoder = build_module(cfg.text_encoder, MODELS, device=text_encoder_device)
+    if quantize_text_encoder is not None:
+        num_quantized = quantize_model(
+            get_offload_module(text_encoder), quantize_text_encoder, cfg.get("quantize_group_size", None)
+        )
+        logger.info("Quantized %s text encoder layers to %s", num_quantized, quantize_text_encoder)
+        if offloader is None:
+            get_offload_module(text_encoder).to(device)
+    set_input_device(text_encoder, device)
+    vae = build_module(cfg.vae, MODELS).to(build_device, dtype).eval()
 
     # == prepare video size ==
     image_size = cfg.get("image_size", None)
@@ -90,33 +143,66 @@ def main():
     # == build diffusion model ==
     input_size = (num_frames, *image_size)
     latent_size = vae.get_latent_size(input_size)
-    model = (
-        build_module(
-            cfg.model,
-            MODELS,
-            input_size=latent_size,
-            in_channels=vae.out_channels,
-            caption_channels=text_encoder.output_dim,
-            model_max_length=text_encoder.model_max_length,
-            enable_sequence_parallelism=enable_sequence_parallelism,
-        )
-        .to(device, dtype)
-        .eval()
+    model = build_module(
+        cfg.model,
+        MODELS,
+        input_size=latent_size,
+        in_channels=vae.out_channels,
+        caption_channels=text_encoder.output_dim,
+        model_max_length=text_encoder.model_max_length,
+        enable_sequence_parallelism=enable_sequence_parallelism,
     )
+    if cfg.get("quantize_model", None) is not None:
+        # weights are quantized on the host, so the full-precision model never reaches the device
+        num_quantized = quantize_model(
+            model, cfg.quantize_model, cfg.get("quantize_group_size", None), exclude=STDIT3_QUANT_EXCLUDE
+        )
+        logger.info("Quantized %s model layers to %s", num_quantized, cfg.quantize_model)
+    model = model.to(build_device, dtype).eval()
     text_encoder.y_embedder = model.y_embedder  # HACK: for classifier-free guidance
+    if offloader is not None:
+        offloader.register("text_encoder", text_encoder)
+        offloader.register("vae", vae)
+        offloader.register("model", model)
 
     # == build scheduler ==
     scheduler = build_module(cfg.scheduler, SCHEDULERS)
 
+    # == build preview decoder ==
+    # maps the clean latents predicted during sampling to low-resolution frames, see scripts/misc/fit_preview_decoder.py
+    preview_decoder = build_module(cfg.get("preview_decoder", None), MODELS, in_channels=vae.out_channels)
+    if preview_decoder is not None:
+        assert isinstance(scheduler, RFLOW), "Previews require a rectified flow scheduler"
+        preview_decoder = preview_decoder.to(device).eval()
+        preview_every = cfg.get("preview_every", 5)
+
+    # == prepare cascade ==
+    # a draft is sampled at a lower resolution, upsampled in latent space and re-noised, so that only the last
+    # steps run at full resolution
+    cascade_resolution = cfg.get("cascade_resolution", None)
+    if cascade_resolution is not None:
+        assert isinstance(scheduler, RFLOW), "Cascade sampling requires a rectified flow scheduler"
+        draft_image_size = get_closest_image_size(cascade_resolution, image_size)
+        draft_latent_size = vae.get_latent_size((num_frames, *draft_image_size))
+        draft_steps = cfg.get("cascade_steps", None) or scheduler.num_sampling_steps
+        # per-step guidance options refer to the steps of the full-resolution schedule
+        draft_cfg_schedule = resample_cfg_schedule(scheduler.cfg_schedule, scheduler.num_sampling_steps, draft_steps)
+        draft_scheduler = build_module(
+            dict(cfg.scheduler, num_sampling_steps=draft_steps, cfg_schedule=draft_cfg_schedule), SCHEDULERS
+        )
+        cascade_strength = cfg.get("cascade_strength", 0.5)
+        assert 0 < cascade_strength <= 1, f"cascade_strength must be in (0, 1], got {cascade_strength}"
+        num_refine_steps = max(1, round(scheduler.num_sampling_steps * cascade_strength))
+        cascade_saved = []  # estimated seconds saved per sample
+
     # ======================================================
     # inference
     # ======================================================
     # == load prompts ==
     prompts = cfg.get("prompt", None)
-    start_idx = cfg.get("start_index", 0)
     if prompts is None:
         if cfg.get("prompt_path", None) is not None:
-            prompts = load_prompts(cfg.prompt_path, start_idx, cfg.get("end_index", None))
+            prompts = load_prompts(cfg.prompt_path, cfg.get("start_index", 0), cfg.get("end_index", None))
         else:
             prompts = [cfg.get("prompt_generator", "")] * 1_000_000  # endless loop
 
@@ -136,52 +222,128 @@ def main():
     condition_frame_length = cfg.get("condition_frame_length", 5)
     condition_frame_edit = cfg.get("condition_frame_edit", 0.0)
     align = cfg.get("align", None)
+    seed = cfg.get("seed", 1024)
 
     save_dir = cfg.save_dir
     os.makedirs(save_dir, exist_ok=True)
     sample_name = cfg.get("sample_name", None)
     prompt_as_path = cfg.get("prompt_as_path", False)
 
-    # == Iter over all samples ==
-    for i in progress_wrap(range(0, len(prompts), batch_size)):
-        # == prepare batch prompts ==
-        batch_prompts = prompts[i : i + batch_size]
-        ms = mask_strategy[i : i + batch_size]
-        refs = reference_path[i : i + batch_size]
-
-        # == get json from prompts ==
-        batch_prompts, refs, ms = extract_json_from_prompts(batch_prompts, refs, ms)
-        original_batch_prompts = batch_prompts
-
-        # == get reference for condition ==
-        refs = collect_references_batch(refs, vae, image_size)
-
-        # == multi-resolution info ==
-        model_args = prepare_multi_resolution_info(
-            multi_resolution, len(batch_prompts), image_size, num_frames, fps, device, dtype
+    # == prepare pipeline ==
+    # prompts of the next batch are prepared and encoded while the current one is denoised,
+    # decoding and video writing run in background workers
+    timer = StageTimer()
+    prefetch_batches = cfg.get("prefetch_batches", 1)
+    if enable_sequence_parallelism and cfg.get("llm_refine", False):
+        prefetch_batches = 0  # prompt refinement is broadcast with collectives, keep it on the main thread
+    if offloader is not None:
+        prefetch_batches = 0  # stages run one at a time so that only the weights of one stage are resident
+
+    # == prepare result cache ==
+    # samples are keyed by the checkpoint content, the final prompt, the noise and everything else that affects them,
+    # so they are reused across save_dirs and across checkpoints with identical weights
+    result_cache = None
+    if cfg.get("result_cache_dir", None) is not None:
+        result_cache = ResultCache(
+            cfg.result_cache_dir,
+            max_size_gb=cfg.get("result_cache_size_gb", 50),
+            store=cfg.get("result_cache_store", "video"),
         )
+        cache_fields = dict(
+            checkpoint=result_cache.checkpoint_hash(cfg.model.get("from_pretrained", None)),
+            model={k: v for k, v in cfg.model.items() if k != "from_pretrained"},
+            text_encoder=cfg.text_encoder,
+            vae=cfg.vae,
+            scheduler=cfg.scheduler,
+            dtype=cfg_dtype,
+            image_size=image_size,
+            num_frames=num_frames,
+            fps=fps,
+            save_fps=save_fps,
+            multi_resolution=multi_resolution,
+            loop=loop,
+            condition_frame_length=condition_frame_length,
+            condition_frame_edit=condition_frame_edit,
+            align=align,
+            watermark=cfg.get("watermark", False),
+            quantize_model=cfg.get("quantize_model", None),
+            quantize_text_encoder=cfg.get("quantize_text_encoder", None),
+            quantize_group_size=cfg.get("quantize_group_size", None),
+            cascade=dict(
+                resolution=cfg.get("cascade_resolution", None),
+                strength=cfg.get("cascade_strength", 0.5),
+                steps=cfg.get("cascade_steps", None),
+            ),
+        )
+        if enable_sequence_parallelism:
+            prefetch_batches = 0  # cache hits are broadcast with collectives, keep them on the main thread
+
+    def lookup_cache(keys):
+        hits = [result_cache.lookup(key) for key in keys] if is_group_main else None
+        if enable_sequence_parallelism:
+            # all ranks of a group must skip the same samples
+            broadcast_obj_list = [hits]
+            dist.broadcast_object_list(broadcast_obj_list, group_src, group=get_sequence_parallel_group())
+            hits = broadcast_obj_list[0]
+        return hits
+
+    def sample_batches():
+        # the num_sample repetitions of a prompt are packed into the batch dimension next to each other
+        batch = []
+        for i in range(len(prompts)):
+            for k in range(num_sample):
+                batch.append((i, k))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        if len(batch) > 0:
+            yield batch
+
+    num_restored = 0  # samples whose cached video was copied without reaching the sampling loop
+
+    def prepare_batches():
+        nonlocal num_restored
+        start_index = cfg.get("start_index", 0)
+        for batch_idx, samples in enumerate(sample_batches()):
+            # == shard batches across data-parallel groups ==
+            if batch_idx % dp_size != dp_rank:
+                continue
+
+            # == prepare batch prompts, each distinct prompt is processed once ==
+            prompt_ids = list(OrderedDict.fromkeys(i for i, _ in samples))
+            batch_prompts = [prompts[i] for i in prompt_ids]
+            ms = [mask_strategy[i] for i in prompt_ids]
+            refs = [reference_path[i] for i in prompt_ids]
 
-        # == Iter over number of sampling for one prompt ==
-        for k in range(num_sample):
-            # == prepare save paths ==
+            # == get json from prompts ==
+            batch_prompts, refs, ms = extract_json_from_prompts(batch_prompts, refs, ms)
+            original_batch_prompts = dict(zip(prompt_ids, batch_prompts))
+
+            # == prepare save paths and seeds ==
             save_paths = [
                 get_save_path_name(
                     save_dir,
                     sample_name=sample_name,
-                    sample_idx=start_idx + idx,
-                    prompt=original_batch_prompts[idx],
+                    sample_idx=start_index + i,
+                    prompt=original_batch_prompts[i],
                     prompt_as_path=prompt_as_path,
                     num_sample=num_sample,
                     k=k,
                 )
-                for idx in range(len(batch_prompts))
+                for i, k in samples
             ]
+            seeds = [get_sample_seed(seed, start_index + i, num_sample, k) for i, k in samples]
 
             # NOTE: Skip if the sample already exists
             # This is useful for resuming sampling VBench
             if prompt_as_path and all_exists(save_paths):
                 continue
 
+            # == get reference for condition ==
+            # only loaded here, they are encoded on the main thread
+            ref_paths = refs
+            refs = load_references_batch(refs, image_size)
+
             # == process prompts step by step ==
             # 0. split prompt
             # each element in the list is [prompt_segment_list, loop_idx_list]
@@ -196,14 +358,13 @@ def main():
             if cfg.get("llm_refine", False):
                 # only call openai API when
                 # 1. seq parallel is not enabled
-                # 2. seq parallel is enabled and the process is rank 0
-                if not enable_sequence_parallelism or (enable_sequence_parallelism and is_main_process()):
+                # 2. seq parallel is enabled and the process is the first rank of its group
+                if is_group_main:
                     for idx, prompt_segment_list in enumerate(batched_prompt_segment_list):
                         batched_prompt_segment_list[idx] = refine_prompts_by_openai(prompt_segment_list)
 
                 # sync the prompt if using seq parallel
                 if enable_sequence_parallelism:
-                    coordinator.block_all()
                     prompt_segment_length = [
                         len(prompt_segment_list) for prompt_segment_list in batched_prompt_segment_list
                     ]
@@ -215,9 +376,8 @@ def main():
                         for prompt_segment in prompt_segment_list
                     ]
 
-                    # create a list of size equal to world size
-                    broadcast_obj_list = [batched_prompt_segment_list] * coordinator.world_size
-                    dist.broadcast_object_list(broadcast_obj_list, 0)
+                    broadcast_obj_list = [batched_prompt_segment_list]
+                    dist.broadcast_object_list(broadcast_obj_list, group_src, group=get_sequence_parallel_group())
 
                     # recover the prompt list
                     batched_prompt_segment_list = []
@@ -247,57 +407,346 @@ def main():
             for prompt_segment_list, loop_idx_list in zip(batched_prompt_segment_list, batched_loop_idx_list):
                 batch_prompts.append(merge_prompt(prompt_segment_list, loop_idx_list))
 
-            # == Iter over loop generation ==
-            video_clips = []
-            for loop_i in range(loop):
-                # == get prompt for loop i ==
-                batch_prompts_loop = extract_prompts_loop(batch_prompts, loop_i)
-
-                # == add condition frames for loop ==
-                if loop_i > 0:
-                    refs, ms = append_generated(
-                        vae, video_clips[-1], refs, ms, loop_i, condition_frame_length, condition_frame_edit
+            # 5. expand the distinct prompts to the samples of the batch
+            # references get a list per sample since later loops append the generated clip to it
+            rows = [prompt_ids.index(i) for i, _ in samples]
+            batch_prompts = [batch_prompts[row] for row in rows]
+            ref_paths = [ref_paths[row] for row in rows]
+            refs = [list(refs[row]) for row in rows]
+            ms = [ms[row] for row in rows]
+
+            # 6. serve cached samples, cached videos are copied and cached latents skip denoising
+            kept_idx = list(range(len(batch_prompts)))
+            cache_keys = [None] * len(batch_prompts)
+            cached_latents = [None] * len(batch_prompts)
+            if result_cache is not None:
+                cache_keys = [
+                    result_cache.key(
+                        prompt=prompt,
+                        seed=seeds[idx],
+                        reference_path=ref_paths[idx],
+                        mask_strategy=ms[idx],
+                        **cache_fields,
+                    )
+                    for idx, prompt in enumerate(batch_prompts)
+                ]
+                hits = lookup_cache(cache_keys)
+                kept_idx, cached_latents = [], []
+                for idx, hit in enumerate(hits):
+                    if hit is not None and hit["video"] is not None:
+                        if is_group_main:
+                            result_cache.restore_video(hit["video"], save_paths[idx])
+                        num_restored += 1
+                        continue
+                    kept_idx.append(idx)
+                    cached_latents.append(
+                        result_cache.load_latent(hit["latent"], device) if hit is not None else None
                     )
+                if len(kept_idx) == 0:
+                    continue
+            denoise_idx = [idx for idx, z in zip(kept_idx, cached_latents) if z is None]
+            denoise_prompts = [batch_prompts[idx] for idx in denoise_idx]
+
+            # 7. encode the prompt of every loop ahead of sampling, repeated prompts share their embeddings
+            text_embeddings = None
+            if len(denoise_prompts) > 0:
+                if offloader is not None:
+                    offloader.use("text_encoder", stage="text", prefetch="model")
+                distinct_prompts = list(OrderedDict.fromkeys(denoise_prompts))
+                index = torch.tensor([distinct_prompts.index(prompt) for prompt in denoise_prompts], device=device)
+                text_embeddings = []
+                for loop_i in range(loop):
+                    encoded = text_encoder.encode(extract_prompts_loop(distinct_prompts, loop_i))
+                    text_embeddings.append({k: v.index_select(0, index.to(v.device)) for k, v in encoded.items()})
+
+            yield dict(
+                batch_prompts=[batch_prompts[idx] for idx in kept_idx],
+                save_paths=[save_paths[idx] for idx in kept_idx],
+                cache_keys=[cache_keys[idx] for idx in kept_idx],
+                cached_latents=cached_latents,
+                denoise_prompts=denoise_prompts,
+                seeds=[seeds[idx] for idx in denoise_idx],
+                refs=[refs[idx] for idx in denoise_idx],
+                ms=[ms[idx] for idx in denoise_idx],
+                model_args=prepare_multi_resolution_info(
+                    multi_resolution, len(denoise_idx), image_size, num_frames, fps, device, dtype
+                ),
+                text_embeddings=text_embeddings,
+            )
+
+    def decode_batch(batch):
+        if result_cache is not None:
+            for idx, (cache_key, cached) in enumerate(zip(batch["cache_keys"], batch["cached_latents"])):
+                if cached is None:
+                    result_cache.put_latent(cache_key, [z[idx] for z in batch["latent_clips"]])
+        # clips of all loops stay in latent space unless they were decoded to condition the next loop
+        if stream_decode:
+            stream_batch(batch)
+            return
+        video_clips = [
+            vae.decode(z.to(dtype), num_frames=num_frames) if x is None else x
+            for z, x in zip(batch["latent_clips"], batch["decoded_clips"])
+        ]
+        videos = []
+        for idx in range(len(batch["batch_prompts"])):
+            video = [video_clips[i][idx] for i in range(loop)]
+            for i in range(1, loop):
+                video[i] = video[i][:, dframe_to_frame(condition_frame_length) :]
+            videos.append(torch.cat(video, dim=1))
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()  # the writer reads the videos from another stream
+        for batch_prompt, save_path, cache_key, video in zip(
+            batch["batch_prompts"], batch["save_paths"], batch["cache_keys"], videos
+        ):
+            writer.submit(partial(write_sample, batch_prompt, save_path, cache_key, video))
+
+    def stream_batch(batch):
+        # frames are converted to uint8 chunk by chunk and encoded incrementally,
+        # so no full clip exists in pixel space unless it was decoded to condition the next loop
+        video_writers = [VideoWriter(f"{save_path}.mp4", fps=save_fps) for save_path in batch["save_paths"]]
+
+        def write_chunk(chunk):
+            for idx, video_writer in enumerate(video_writers):
+                if chunk.size(2) > 0:
+                    writer.submit(partial(video_writer.write, to_uint8_frames(chunk[idx])))
+
+        for loop_i, (z, x) in enumerate(zip(batch["latent_clips"], batch["decoded_clips"])):
+            # the condition frames at the start of later loops repeat the end of the previous loop
+            skip = dframe_to_frame(condition_frame_length) if loop_i > 0 else 0
+            chunks = [x] if x is not None else vae.decode_chunks(z.to(dtype), num_frames=num_frames)
+            for chunk in chunks:
+                drop = min(skip, chunk.size(2))
+                skip -= drop
+                write_chunk(chunk[:, :, drop:])
+        for batch_prompt, cache_key, video_writer in zip(batch["batch_prompts"], batch["cache_keys"], video_writers):
+            writer.submit(partial(close_sample, batch_prompt, cache_key, video_writer))
+
+    def write_sample(batch_prompt, save_path, cache_key, video):
+        if verbose >= 2:
+            logger.info("Prompt: %s", batch_prompt)
+        save_path = save_sample(
+            video,
+            fps=save_fps,
+            save_path=save_path,
+            verbose=verbose >= 2,
+        )
+        if save_path.endswith(".mp4") and cfg.get("watermark", False):
+            time.sleep(1)  # prevent loading previous generated video
+            add_watermark(save_path)
+        if result_cache is not None:
+            result_cache.put_video(cache_key, save_path)
+
+    def close_sample(batch_prompt, cache_key, video_writer):
+        save_path = video_writer.close()
+        if verbose >= 2:
+            logger.info("Prompt: %s", batch_prompt)
+            logger.info("Saved to %s", save_path)
+        if cfg.get("watermark", False):
+            add_watermark(save_path)
+        if result_cache is not None:
+            result_cache.put_video(cache_key, save_path)
+
+    # streamed chunks of one video must be written in order, so a single writer thread is used
+    stream_decode = cfg.get("stream_decode", False) and hasattr(vae, "decode_chunks") and num_frames > 1
+    writer = BackgroundWorker(
+        lambda task: task(),
+        "write",
+        timer=timer,
+        max_queue_size=cfg.get("write_queue_size", None) or batch_size,
+        num_workers=1 if stream_decode else cfg.get("num_write_workers", 1),
+    )
+    decoder = BackgroundWorker(
+        decode_batch, "decode", timer=timer, max_queue_size=cfg.get("decode_queue_size", 1), cuda_stream=True
+    )
+
+    def decode(batch):
+        if offloader is None:
+            decoder.submit(batch)
+            return
+        # with offloading the vae is resident only during the decode stage, so batches are decoded inline
+        start = time.time()
+        decode_batch(batch)
+        timer.add("decode", time.time() - start)
+
+    def save_previews(save_paths, step, num_steps, z, x0):
+        # the preview of every sample is overwritten each `preview_every` steps and after the last step
+        if (step + 1) % preview_every != 0 and step != num_steps - 1:
+            return
+        previews = preview_decoder(x0).float().cpu()
+        # one preview frame per latent frame, played at the speed of the final video
+        fps = max(1, round(save_fps * x0.size(2) / num_frames))
+        for save_path, preview in zip(save_paths, previews):
+            writer.submit(partial(save_sample, preview, fps=fps, save_path=save_path, verbose=False))
+
+    def stream_time():
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()  # a device-wide sync would also wait for the decoder
+        return time.time()
 
-                # == sampling ==
-                torch.manual_seed(1024)
-                z = torch.randn(len(batch_prompts), vae.out_channels, *latent_size, device=device, dtype=dtype)
-                masks = apply_mask_strategy(z, refs, ms, loop_i, align=align)
-                samples = scheduler.sample(
+    # == Iter over all samples ==
+    num_samples = 0
+    batches = prefetch(prepare_batches(), timer=timer, max_queue_size=prefetch_batches, cuda_stream=True)
+    for batch in progress_wrap(batches):
+        batch_prompts = batch["batch_prompts"]
+        denoise_prompts = batch["denoise_prompts"]
+        refs, ms, model_args = batch["refs"], batch["ms"], batch["model_args"]
+        if any(len(ref) > 0 for ref in refs):
+            # VAE sampling draws from the global RNG, encoding in the prefetch thread would make its order depend on
+            # the timing of the threads
+            if offloader is not None:
+                offloader.use("vae", stage="reference")
+            refs = encode_references_batch(refs, vae)
+
+        # == Iter over loop generation ==
+        sample_start = time.time()
+        latent_clips, decoded_clips = [], []
+        for loop_i in range(loop if len(denoise_prompts) > 0 else 0):
+            # == get prompt for loop i ==
+            batch_prompts_loop = extract_prompts_loop(denoise_prompts, loop_i)
+
+            # == add condition frames for loop ==
+            if loop_i > 0:
+                if offloader is not None:
+                    offloader.use("vae", stage="condition", prefetch="model")
+                generated_video = None
+                if condition_frame_edit > 0:
+                    # edited condition frames are re-encoded from pixels, keep the decoded clip for saving
+                    generated_video = vae.decode(latent_clips[-1].to(dtype), num_frames=num_frames)
+                    decoded_clips[-1] = generated_video
+                refs, ms = append_generated(
+                    vae,
+                    generated_video,
+                    refs,
+                    ms,
+                    loop_i,
+                    condition_frame_length,
+                    condition_frame_edit,
+                    generated_latent=latent_clips[-1],
+                )
+
+            # == sampling ==
+            if offloader is not None:
+                offloader.use("model", stage="sample", prefetch="vae")
+            # NOTE: every loop starts from the same per-sample noise
+            z = get_sample_noise(batch["seeds"], (vae.out_channels, *latent_size), device, dtype)
+            masks = apply_mask_strategy(z, refs, ms, loop_i, align=align)
+            loop_text_encoder = PrecomputedTextEncoder(text_encoder, batch["text_embeddings"][loop_i])
+            callback = None
+            if preview_decoder is not None and is_group_main:
+                preview_paths = [
+                    f"{save_path}_preview"
+                    for save_path, cached in zip(batch["save_paths"], batch["cached_latents"])
+                    if cached is None
+                ]
+                callback = partial(save_previews, preview_paths)
+            x_start, start_step = None, 0
+            # references only exist at full resolution, conditioned samples are generated directly
+            use_cascade = cascade_resolution is not None and all(len(ref) == 0 for ref in refs)
+            if use_cascade:
+                draft_start = stream_time()
+                draft = draft_scheduler.sample(
                     model,
-                    text_encoder,
-                    z=z,
+                    loop_text_encoder,
+                    z=get_sample_noise(batch["seeds"], (vae.out_channels, *draft_latent_size), device, dtype),
                     prompts=batch_prompts_loop,
                     device=device,
-                    additional_args=model_args,
+                    additional_args=prepare_multi_resolution_info(
+                        multi_resolution, len(batch_prompts_loop), draft_image_size, num_frames, fps, device, dtype
+                    ),
                     progress=verbose >= 2,
-                    mask=masks,
+                    callback=callback,
                 )
-                samples = vae.decode(samples.to(dtype), num_frames=num_frames)
-                video_clips.append(samples)
-
-            # == save samples ==
-            if is_main_process():
-                for idx, batch_prompt in enumerate(batch_prompts):
-                    if verbose >= 2:
-                        logger.info("Prompt: %s", batch_prompt)
-                    save_path = save_paths[idx]
-                    video = [video_clips[i][idx] for i in range(loop)]
-                    for i in range(1, loop):
-                        video[i] = video[i][:, dframe_to_frame(condition_frame_length) :]
-                    video = torch.cat(video, dim=1)
-                    save_path = save_sample(
-                        video,
-                        fps=save_fps,
-                        save_path=save_path,
-                        verbose=verbose >= 2,
+                x_start = F.interpolate(draft.float(), size=tuple(latent_size), mode="trilinear").to(dtype)
+                start_step = scheduler.num_sampling_steps - num_refine_steps
+                refine_start = stream_time()
+            samples = scheduler.sample(
+                model,
+                loop_text_encoder,
+                z=z,
+                prompts=batch_prompts_loop,
+                device=device,
+                additional_args=model_args,
+                progress=verbose >= 2,
+                mask=masks,
+                x_start=x_start,
+                start_step=start_step,
+                callback=callback,
+                generators=get_sample_generators(batch["seeds"], device),
+            )
+            if use_cascade:
+                refine_end = stream_time()
+                # every full-resolution step costs about as much as a refinement step
+                direct_time = (refine_end - refine_start) / num_refine_steps * scheduler.num_sampling_steps
+                saved = (direct_time - (refine_end - draft_start)) / len(batch_prompts_loop)
+                cascade_saved.extend([saved] * len(batch_prompts_loop))
+                if verbose >= 2:
+                    logger.info(
+                        "Cascade: draft %.2fs + refine %.2fs instead of about %.2fs, %.2fs saved per sample",
+                        refine_start - draft_start,
+                        refine_end - refine_start,
+                        direct_time,
+                        saved,
                     )
-                    if save_path.endswith(".mp4") and cfg.get("watermark", False):
-                        time.sleep(1)  # prevent loading previous generated video
-                        add_watermark(save_path)
-        start_idx += len(batch_prompts)
+            latent_clips.append(samples)
+            decoded_clips.append(None)
+
+        # == merge latents served by the result cache ==
+        if any(cached is not None for cached in batch["cached_latents"]):
+            sampled = iter(range(len(denoise_prompts)))
+            rows = [cached if cached is not None else next(sampled) for cached in batch["cached_latents"]]
+            latent_clips = [
+                torch.stack(
+                    [
+                        row[loop_i].to(device, dtype) if isinstance(row, list) else latent_clips[loop_i][row].to(dtype)
+                        for row in rows
+                    ]
+                )
+                for loop_i in range(loop)
+            ]
+            decoded_clips = [None] * loop
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()  # a device-wide sync would also wait for the decoder
+        timer.add("sample", time.time() - sample_start)
+
+        # == decode and save samples in the background ==
+        if is_group_main:
+            if offloader is not None:
+                offloader.use("vae", stage="decode", prefetch="text_encoder")
+            decode(
+                dict(
+                    batch_prompts=batch_prompts,
+                    save_paths=batch["save_paths"],
+                    cache_keys=batch["cache_keys"],
+                    cached_latents=batch["cached_latents"],
+                    latent_clips=latent_clips,
+                    decoded_clips=decoded_clips,
+                )
+            )
+        num_samples += len(batch_prompts)
+    num_samples += num_restored
+    decoder.close()
+    writer.close()
+    if dp_size > 1:
+        num_samples = torch.tensor(num_samples, device=device)
+        dist.all_reduce(num_samples, group=get_data_parallel_group())
+        num_samples = num_samples.item()
     logger.info("Inference finished.")
-    logger.info("Saved %s samples to %s", start_idx, save_dir)
+    logger.info("Saved %s samples to %s", num_samples, save_dir)
+    if result_cache is not None:
+        logger.info("Result cache: %s hits, %s misses", result_cache.hits, result_cache.misses)
+    logger.info("Stage timings:\n%s", timer.summary())
+    if cascade_resolution is not None and len(cascade_saved) > 0:
+        logger.info(
+            "Cascade saved about %.2fs per sample over %s samples (%s draft, %s of %s steps refined)",
+            sum(cascade_saved) / len(cascade_saved),
+            len(cascade_saved),
+            f"{draft_image_size[0]}x{draft_image_size[1]}",
+            num_refine_steps,
+            scheduler.num_sampling_steps,
+        )
+    if offloader is not None:
+        logger.info("Peak device memory per stage:\n%s", offloader.summary())
+        offloader.close()
 
 
 if __name__ == "__main__":
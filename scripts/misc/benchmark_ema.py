@@ -0,0 +1,84 @@
+"""
+Compare the per-parameter EMA update loop with the multi-tensor `update_ema` and the cached-pairing `EMAUpdater`
+(with and without `every_n_steps`) on the diffusion model. The ZeRO setup of training is mimicked on a single
+process: the model holds low-precision working parameters, a stand-in optimizer maps them to flat fp32 master
+parameters and the EMA is flattened by `model_sharding`.
+
+Example:
+    python scripts/misc/benchmark_ema.py  # STDiT3-XL/2 on cpu
+    python scripts/misc/benchmark_ema.py --model STDiT3-Tiny/2 --device cuda --every-n-steps 1 4
+"""
+
+import argparse
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from types import SimpleNamespace
+
+import torch
+
+from opensora.registry import MODELS, build_module
+from opensora.utils.misc import to_torch_dtype
+from opensora.utils.train_utils import EMAUpdater, update_ema
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="STDiT3-XL/2", type=str)
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--dtype", default="bf16", type=str, help="dtype of the working parameters")
+    parser.add_argument("--steps", default=20, type=int)
+    parser.add_argument("--every-n-steps", default=[1, 4], nargs="+", type=int)
+    return parser.parse_args()
+
+
+@torch.no_grad()
+def update_ema_loop(ema_model, model, optimizer=None, decay=0.9999, sharded=True):
+    # the previous implementation: pairing rebuilt on every call and two kernels per parameter
+    ema_params = OrderedDict(ema_model.named_parameters())
+    model_params = OrderedDict(model.named_parameters())
+    for name, param in model_params.items():
+        if name == "pos_embed" or not param.requires_grad:
+            continue
+        if sharded and param.data.dtype != torch.float32:
+            param_data = optimizer._param_store.working_to_master_param[id(param)].data
+        else:
+            param_data = param.data
+        ema_params[name].mul_(decay).add_(param_data, alpha=1 - decay)
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+def main():
+    args = parse_args()
+    device, dtype = args.device, to_torch_dtype(args.dtype)
+    model = build_module(dict(type=args.model), MODELS).to(device, dtype)
+    ema = deepcopy(model).float()
+    for param in ema.parameters():
+        param.data = param.data.view(-1)  # model_sharding with a world size of 1
+    master_params = {id(p): p.detach().float().view(-1) for p in model.parameters()}
+    optimizer = SimpleNamespace(_param_store=SimpleNamespace(working_to_master_param=master_params))
+    num_params = sum(1 for p in model.parameters() if p.requires_grad)
+    print(f"{args.model}: {num_params} parameters, {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M elements")
+
+    def benchmark(name, update):
+        update()  # warmup
+        synchronize(device)
+        start = time.time()
+        for _ in range(args.steps):
+            update()
+        synchronize(device)
+        print(f"{name:>24} | {(time.time() - start) / args.steps * 1000:>10.2f} ms/step")
+
+    benchmark("per-parameter loop", lambda: update_ema_loop(ema, model, optimizer=optimizer))
+    benchmark("update_ema", lambda: update_ema(ema, model, optimizer=optimizer))
+    for every_n_steps in args.every_n_steps:
+        updater = EMAUpdater(ema, model, optimizer=optimizer, every_n_steps=every_n_steps)
+        benchmark(f"EMAUpdater every {every_n_steps}", updater)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compare weight-only int8 and grouped int4 quantization of the diffusion model (and the T5 text encoder) against the
+unquantized model: the same prompts and noise are sampled with each variant and the MSE of the final latents is
+reported together with the size of the weights and the sampling time.
+
+Example:
+    python scripts/misc/benchmark_quantization.py configs/opensora-v1-2/inference/sample.py --dtype bf16 \
+        --ckpt-path hpcai-tech/OpenSora-STDiT-v3 --text-encoder
+    python scripts/misc/benchmark_quantization.py  # tiny random models on cpu
+"""
+
+import argparse
+import time
+from copy import deepcopy
+
+import torch
+import torch.nn.functional as F
+
+from opensora.acceleration.quantization import STDIT3_QUANT_EXCLUDE, get_model_size, quantize_model
+from opensora.datasets.aspect import get_image_size, get_num_frames
+from opensora.registry import MODELS, SCHEDULERS, build_module
+from opensora.utils.config_utils import read_config
+from opensora.utils.inference_utils import get_sample_noise, prepare_multi_resolution_info
+from opensora.utils.misc import to_torch_dtype
+from opensora.utils.offload import get_offload_module
+
+PROMPTS = [
+    "a cat playing the piano in a cozy living room",
+    "aerial view of waves crashing against a rocky coastline at sunset",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", nargs="?", default="configs/opensora-v1-2/inference/tiny_random.py")
+    parser.add_argument("--ckpt-path", default=None, type=str, help="model weights, cfg.model.from_pretrained if unset")
+    parser.add_argument("--variants", default=["int8", "int4"], nargs="+")
+    parser.add_argument("--group-size", default=None, type=int, help="defaults to per-channel int8 and 128 for int4")
+    parser.add_argument("--text-encoder", action="store_true", help="also quantize the text encoder")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+    parser.add_argument("--dtype", default=None, type=str, help="reference dtype, cfg.dtype if unset")
+    parser.add_argument("--seed", default=1024, type=int)
+    return parser.parse_args()
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+@torch.no_grad()
+def main():
+    args = parse_args()
+    cfg = read_config(args.config)
+    device = args.device
+    dtype = to_torch_dtype(args.dtype or cfg.get("dtype", "bf16"))
+    if args.ckpt_path is not None:
+        cfg.model["from_pretrained"] = args.ckpt_path
+
+    text_encoder = build_module(cfg.text_encoder, MODELS, device=device)
+    vae = build_module(cfg.vae, MODELS)
+    image_size = cfg.get("image_size", None) or get_image_size(cfg.resolution, cfg.aspect_ratio)
+    num_frames = get_num_frames(cfg.num_frames)
+    latent_size = vae.get_latent_size((num_frames, *image_size))
+    in_channels = vae.out_channels
+    model = build_module(
+        cfg.model,
+        MODELS,
+        input_size=latent_size,
+        in_channels=in_channels,
+        caption_channels=text_encoder.output_dim,
+        model_max_length=text_encoder.model_max_length,
+    ).eval()
+    del vae
+    scheduler = build_module(cfg.scheduler, SCHEDULERS)
+
+    seeds = [args.seed + i for i in range(len(PROMPTS))]
+    z = get_sample_noise(seeds, (in_channels, *latent_size), device, dtype)
+    model_args = prepare_multi_resolution_info(
+        cfg.get("multi_resolution", None), len(PROMPTS), image_size, num_frames, cfg.fps, device, dtype
+    )
+
+    def sample(variant_model):
+        text_encoder.y_embedder = variant_model.y_embedder  # HACK: for classifier-free guidance
+        synchronize(device)
+        start = time.time()
+        latents = scheduler.sample(
+            variant_model,
+            text_encoder,
+            z=z.clone(),
+            prompts=PROMPTS,
+            device=device,
+            additional_args=model_args,
+            progress=False,
+        )
+        synchronize(device)
+        return latents.float(), time.time() - start
+
+    reference_model = deepcopy(model).to(device, dtype)
+    reference, reference_time = sample(reference_model)
+    results = [dict(variant=str(dtype).split(".")[-1], size_gb=get_model_size(reference_model) / 1024**3)]
+    results[0].update(mse=0.0, rel_err=0.0, time_s=reference_time)
+    reference_embeddings = text_encoder.encode(PROMPTS)["y"].float() if args.text_encoder else None
+    del reference_model
+
+    text_encoder_module = get_offload_module(text_encoder) if args.text_encoder else None
+    text_encoder_original = deepcopy(text_encoder_module) if args.text_encoder else None
+    for variant in args.variants:
+        variant_model = deepcopy(model)
+        quantize_model(variant_model, variant, args.group_size, exclude=STDIT3_QUANT_EXCLUDE)
+        variant_model = variant_model.to(device, dtype)
+        result = dict(variant=variant, size_gb=get_model_size(variant_model) / 1024**3)
+        if args.text_encoder:
+            # swap the quantized submodules into the live text encoder, the latents then include its error too
+            quantized = deepcopy(text_encoder_original)
+            quantize_model(quantized, variant, args.group_size)
+            for name, child in quantized.named_children():
+                setattr(text_encoder_module, name, child)
+            embeddings = text_encoder.encode(PROMPTS)["y"].float()
+            result["text_mse"] = F.mse_loss(embeddings, reference_embeddings).item()
+        latents, sample_time = sample(variant_model)
+        mse = F.mse_loss(latents, reference).item()
+        result.update(mse=mse, rel_err=mse / reference.pow(2).mean().item(), time_s=sample_time)
+        results.append(result)
+        del variant_model
+
+    print(f"{args.config}, device {device}, reference dtype {dtype}, {len(PROMPTS)} prompts")
+    header = list(results[-1].keys())
+    print(" | ".join(f"{k:>10}" for k in header))
+    for r in results:
+        print(" | ".join(f"{r.get(k, 0.0):>10}" if k == "variant" else f"{r.get(k, 0.0):>10.4g}" for k in header))
+
+
+if __name__ == "__main__":
+    main()
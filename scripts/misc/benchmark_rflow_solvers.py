@@ -0,0 +1,110 @@
+"""
+Compare rectified flow samplers by the number of model evaluations (NFE) they need to approach a high-step reference.
+Every sampler starts from the same noise and prompts, and the relative RMSE of its final latents to the reference
+latents is reported for each step count.
+
+Example:
+    python scripts/misc/benchmark_rflow_solvers.py configs/opensora-v1-2/inference/sample.py \
+        --ckpt-path hpcai-tech/OpenSora-STDiT-v3 --steps 5 8 10 15 30
+    python scripts/misc/benchmark_rflow_solvers.py  # tiny random models on cpu
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.datasets.aspect import get_image_size, get_num_frames
+from opensora.registry import MODELS, SCHEDULERS, build_module
+from opensora.utils.config_utils import read_config
+from opensora.utils.inference_utils import get_sample_noise, prepare_multi_resolution_info
+from opensora.utils.misc import to_torch_dtype
+
+PROMPTS = [
+    "a cat playing the piano in a cozy living room",
+    "aerial view of waves crashing against a rocky coastline at sunset",
+]
+
+SOLVERS = {
+    "euler": dict(type="rflow"),
+    "heun": dict(type="rflow-heun", method="heun"),
+    "midpoint": dict(type="rflow-heun", method="midpoint"),
+    "dpm-solver++": dict(type="rflow-dpm-solver", order=2),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", nargs="?", default="configs/opensora-v1-2/inference/tiny_random.py")
+    parser.add_argument("--ckpt-path", default=None, type=str, help="model weights, cfg.model.from_pretrained if unset")
+    parser.add_argument("--solvers", default=list(SOLVERS), nargs="+", choices=list(SOLVERS))
+    parser.add_argument("--steps", default=[5, 8, 10, 15, 30], nargs="+", type=int, help="num_sampling_steps to try")
+    parser.add_argument("--reference-steps", default=100, type=int, help="steps of the Heun reference")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+    parser.add_argument("--dtype", default=None, type=str, help="cfg.dtype if unset")
+    parser.add_argument("--seed", default=1024, type=int)
+    return parser.parse_args()
+
+
+@torch.no_grad()
+def main():
+    args = parse_args()
+    cfg = read_config(args.config)
+    device = args.device
+    dtype = to_torch_dtype(args.dtype or cfg.get("dtype", "bf16"))
+    if args.ckpt_path is not None:
+        cfg.model["from_pretrained"] = args.ckpt_path
+
+    text_encoder = build_module(cfg.text_encoder, MODELS, device=device)
+    vae = build_module(cfg.vae, MODELS)
+    image_size = cfg.get("image_size", None) or get_image_size(cfg.resolution, cfg.aspect_ratio)
+    num_frames = get_num_frames(cfg.num_frames)
+    latent_size = vae.get_latent_size((num_frames, *image_size))
+    model = (
+        build_module(
+            cfg.model,
+            MODELS,
+            input_size=latent_size,
+            in_channels=vae.out_channels,
+            caption_channels=text_encoder.output_dim,
+            model_max_length=text_encoder.model_max_length,
+        )
+        .to(device, dtype)
+        .eval()
+    )
+    text_encoder.y_embedder = model.y_embedder  # HACK: for classifier-free guidance
+
+    # every forward is one function evaluation, classifier-free guidance batches both branches into it
+    nfe = [0]
+    model.register_forward_hook(lambda *_: nfe.__setitem__(0, nfe[0] + 1))
+
+    seeds = [args.seed + i for i in range(len(PROMPTS))]
+    z = get_sample_noise(seeds, (vae.out_channels, *latent_size), device, dtype)
+    model_args = prepare_multi_resolution_info(
+        cfg.get("multi_resolution", None), len(PROMPTS), image_size, num_frames, cfg.fps, device, dtype
+    )
+
+    def sample(solver, num_sampling_steps):
+        scheduler_cfg = {k: v for k, v in cfg.scheduler.items() if k not in ["type", "method", "order"]}
+        scheduler_cfg.update(SOLVERS[solver], num_sampling_steps=num_sampling_steps)
+        scheduler = build_module(scheduler_cfg, SCHEDULERS)
+        nfe[0] = 0
+        start = time.time()
+        latents = scheduler.sample(
+            model, text_encoder, z=z.clone(), prompts=PROMPTS, device=device, additional_args=model_args, progress=False
+        )
+        return latents.float(), nfe[0], time.time() - start
+
+    reference, reference_nfe, _ = sample("heun", args.reference_steps)
+    reference_norm = reference.pow(2).mean().sqrt().item()
+    print(f"{args.config}, device {device}, dtype {dtype}, reference: heun {reference_nfe} NFE")
+    print(" | ".join(f"{k:>12}" for k in ["solver", "steps", "NFE", "rel_rmse", "time_s"]))
+    for solver in args.solvers:
+        for steps in args.steps:
+            latents, num_evals, sample_time = sample(solver, steps)
+            rel_rmse = (latents - reference).pow(2).mean().sqrt().item() / reference_norm
+            print(f"{solver:>12} | {steps:>12} | {num_evals:>12} | {rel_rmse:>12.4g} | {sample_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compare eager and regionally compiled STDiT3 blocks across (T, H, W) buckets, including compile time and the number
+of graphs dynamo builds. Runs on CPU by default, where xformers cross attention needs a head dim of at most 32.
+
+Example:
+    python scripts/misc/benchmark_stdit3_compile.py --depth 4 --hidden-size 256 --num-heads 8 \
+        --buckets 4,16,16 8,16,16 8,12,20 16,8,8
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.models.stdit.stdit3 import STDiT3, STDiT3Config
+from opensora.utils.misc import to_torch_dtype
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", default=4, type=int)
+    parser.add_argument("--hidden-size", default=256, type=int)
+    parser.add_argument("--num-heads", default=8, type=int)
+    parser.add_argument("--batch-size", default=2, type=int)
+    parser.add_argument("--num-tokens", default=20, type=int, help="caption tokens per sample")
+    parser.add_argument(
+        "--buckets", default=["4,16,16", "8,16,16", "8,12,20", "16,8,8"], nargs="+", help="latent T,H,W per bucket"
+    )
+    parser.add_argument("--mode", default=None, type=str, help="torch.compile mode")
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--dtype", default="fp32", type=str)
+    parser.add_argument("--warmup", default=2, type=int)
+    parser.add_argument("--iters", default=5, type=int)
+    return parser.parse_args()
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+def run(model, inputs, device):
+    synchronize(device)
+    start = time.time()
+    model(**inputs)
+    synchronize(device)
+    return time.time() - start
+
+
+def num_graphs():
+    from torch._dynamo.utils import counters
+
+    return counters["stats"]["unique_graphs"]
+
+
+@torch.no_grad()
+def main():
+    args = parse_args()
+    device, dtype = args.device, to_torch_dtype(args.dtype)
+    torch.manual_seed(1024)
+    config = STDiT3Config(
+        depth=args.depth,
+        hidden_size=args.hidden_size,
+        num_heads=args.num_heads,
+        caption_channels=64,
+        model_max_length=args.num_tokens,
+    )
+    model = STDiT3(config).to(device, dtype).eval()
+
+    buckets = [tuple(int(v) for v in bucket.split(",")) for bucket in args.buckets]
+    B = args.batch_size
+    results = []
+    for T, H, W in buckets:
+        x = torch.randn(B, config.in_channels, T, H * 2, W * 2, device=device, dtype=dtype)
+        inputs = dict(
+            x=x,
+            timestep=torch.rand(B, device=device) * 1000,
+            y=torch.randn(B, 1, args.num_tokens, 64, device=device, dtype=dtype),
+            # xformers has no block-diagonal cross attention on cpu, attend to all captions there instead
+            mask=torch.ones(B, args.num_tokens, dtype=torch.long, device=device) if device != "cpu" else None,
+            fps=torch.full((B,), 24.0, device=device),
+            height=torch.full((B,), H * 16.0, device=device),
+            width=torch.full((B,), W * 16.0, device=device),
+        )
+        result = dict(bucket=f"{T}x{H}x{W}")
+        for compiled in [False, True]:
+            model.compile_blocks(args.mode, enabled=compiled)
+            graphs = num_graphs() if compiled else 0
+            first = run(model, inputs, device)
+            for _ in range(args.warmup):
+                run(model, inputs, device)
+            times = [run(model, inputs, device) for _ in range(args.iters)]
+            name = "compiled" if compiled else "eager"
+            result[f"{name}_first_s"] = first
+            result[f"{name}_s"] = sum(times) / len(times)
+            if compiled:
+                result["new_graphs"] = num_graphs() - graphs
+        result["speedup"] = result["eager_s"] / result["compiled_s"]
+        results.append(result)
+
+    print(f"device {device}, dtype {args.dtype}, depth {args.depth}, hidden {args.hidden_size}, batch {B}")
+    header = list(results[0].keys())
+    print(" | ".join(f"{k:>17}" for k in header))
+    for r in results:
+        print(" | ".join(f"{v:>17}" if isinstance(v, (str, int)) else f"{v:>17.4f}" for v in r.values()))
+
+
+if __name__ == "__main__":
+    main()
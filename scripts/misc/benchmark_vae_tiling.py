@@ -0,0 +1,108 @@
+"""
+Compare untiled and tiled spatial VAE encode/decode in quality, peak memory and speed.
+
+Example:
+    python scripts/misc/benchmark_vae_tiling.py configs/opensora-v1-2/inference/sample.py \
+        --video assets/videos/sample.mp4 --image-size 1080 1920 --num-frames 17 --tile-size 256 512
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.datasets.utils import read_from_path
+from opensora.registry import MODELS, build_module
+from opensora.utils.config_utils import read_config
+from opensora.utils.misc import to_torch_dtype
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="config file with a `vae` entry")
+    parser.add_argument("--video", default=None, type=str, help="input video or image, random frames if not set")
+    parser.add_argument("--image-size", default=(1080, 1920), type=int, nargs=2, help="(height, width)")
+    parser.add_argument("--num-frames", default=17, type=int)
+    parser.add_argument("--tile-size", default=[256, 512], type=int, nargs="+", help="tile sizes in pixels")
+    parser.add_argument("--tile-overlap", default=64, type=int, help="tile overlap in pixels")
+    parser.add_argument("--dtype", default="bf16", type=str)
+    parser.add_argument("--seed", default=1024, type=int)
+    return parser.parse_args()
+
+
+def psnr(x, y):
+    # inputs in [-1, 1]
+    mse = ((x.float().clamp(-1, 1) - y.float().clamp(-1, 1)) / 2).pow(2).mean().item()
+    return 100.0 if mse < 1e-10 else -10 * torch.log10(torch.tensor(mse)).item()
+
+
+def measure(fn, *args):
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    start = time.time()
+    try:
+        out = fn(*args)
+    except torch.cuda.OutOfMemoryError:
+        torch.cuda.empty_cache()
+        return None, float("nan"), float("inf")
+    torch.cuda.synchronize()
+    return out, time.time() - start, torch.cuda.max_memory_allocated() / 1024**3
+
+
+@torch.no_grad()
+def main():
+    args = parse_args()
+    cfg = read_config(args.config)
+    device, dtype = "cuda", to_torch_dtype(args.dtype)
+    vae = build_module(cfg.vae, MODELS).to(device, dtype).eval()
+    # tiling only affects the spatial VAE, benchmark it on its own
+    spatial_vae = getattr(vae, "spatial_vae", vae)
+
+    if args.video is not None:
+        x = read_from_path(args.video, args.image_size, transform_name="resize_crop")[:, : args.num_frames]
+    else:
+        torch.manual_seed(args.seed)
+        x = torch.rand(3, args.num_frames, *args.image_size).mul_(2).sub_(1)
+    x = x[None].to(device, dtype)
+
+    results = []
+    z_ref = x_ref = None
+    for tile_size in [None] + args.tile_size:
+        spatial_vae.tile_size, spatial_vae.tile_overlap = tile_size, args.tile_overlap
+        torch.manual_seed(args.seed)
+        z, encode_time, encode_mem = measure(spatial_vae.encode, x)
+        # decode the same latent in every setting so that only the decoder tiling differs
+        z_in = z_ref if z_ref is not None else z
+        x_rec, decode_time, decode_mem = None, float("nan"), float("inf")
+        if z_in is not None:
+            x_rec, decode_time, decode_mem = measure(spatial_vae.decode, z_in)
+        if tile_size is None:
+            z_ref, x_ref = z, x_rec
+
+        result = dict(
+            tile="none" if tile_size is None else f"{tile_size}/{args.tile_overlap}",
+            encode_s=encode_time,
+            encode_gb=encode_mem,
+            decode_s=decode_time,
+            decode_gb=decode_mem,
+            psnr_input=float("nan"),
+            psnr_untiled=float("nan"),
+            z_rel_err=float("nan"),
+        )
+        if x_rec is not None:
+            result["psnr_input"] = psnr(x_rec, x)
+            if x_ref is not None:
+                result["psnr_untiled"] = psnr(x_rec, x_ref)
+        if z is not None and z_ref is not None:
+            result["z_rel_err"] = ((z - z_ref).norm() / z_ref.norm()).item()
+        results.append(result)
+
+    print(f"input {tuple(x.shape)}, dtype {args.dtype}")
+    header = list(results[0].keys())
+    print(" | ".join(f"{k:>12}" for k in header))
+    for r in results:
+        print(" | ".join(f"{v:>12}" if isinstance(v, str) else f"{v:>12.4f}" for v in r.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Fit the linear latent-to-RGB preview decoder against the full VAE decoder on a few videos or images, and compare the
+cost of a preview with a full decode.
+
+Example:
+    python scripts/misc/fit_preview_decoder.py configs/opensora-v1-2/inference/sample.py \
+        --data assets/videos/*.mp4 assets/images/condition/*.png --save-path pretrained_models/preview_decoder.pt
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.datasets.aspect import get_image_size, get_num_frames
+from opensora.datasets.utils import read_from_path
+from opensora.models.vae.preview import LatentPreviewDecoder
+from opensora.registry import MODELS, build_module
+from opensora.utils.config_utils import read_config
+from opensora.utils.misc import to_torch_dtype
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", nargs="?", default="configs/opensora-v1-2/inference/sample.py")
+    parser.add_argument("--data", required=True, nargs="+", help="videos or images")
+    parser.add_argument("--save-path", default="./preview_decoder.pt", type=str)
+    parser.add_argument("--upsample", default=1, type=int, help="spatial upsampling of the previews")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+    return parser.parse_args()
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+@torch.no_grad()
+def main():
+    args = parse_args()
+    cfg = read_config(args.config)
+    device, dtype = args.device, to_torch_dtype(cfg.get("dtype", "bf16"))
+    vae = build_module(cfg.vae, MODELS).to(device, dtype).eval()
+    image_size = cfg.get("image_size", None) or get_image_size(cfg.resolution, cfg.aspect_ratio)
+    num_frames = get_num_frames(cfg.num_frames)
+
+    latents, videos, decode_times = [], [], []
+    for path in args.data:
+        x = read_from_path(path, image_size, transform_name="resize_crop")[:, :num_frames]
+        x = x[None].to(device, dtype)
+        z = vae.encode(x)
+        synchronize(device)
+        start = time.time()
+        video = vae.decode(z, num_frames=x.size(2))
+        synchronize(device)
+        decode_times.append(time.time() - start)
+        latents.append(z.float().cpu())
+        videos.append(video.float().cpu())
+        print(f"{path}: {tuple(x.shape[2:])} frames -> latent {tuple(z.shape[1:])}")
+
+    preview_decoder = LatentPreviewDecoder(in_channels=vae.out_channels, upsample=args.upsample)
+    psnr = preview_decoder.fit(latents, videos)
+    torch.save(preview_decoder.state_dict(), args.save_path)
+
+    preview_decoder = preview_decoder.to(device, dtype)
+    preview_times = []
+    for z in latents:
+        z = z.to(device, dtype)
+        synchronize(device)
+        start = time.time()
+        preview_decoder(z)
+        synchronize(device)
+        preview_times.append(time.time() - start)
+
+    print(f"Saved preview decoder to {args.save_path}")
+    print(f"PSNR against the pooled VAE decode: {psnr:.2f} dB")
+    print(
+        f"Decode {sum(decode_times) / len(decode_times) * 1000:.1f} ms, "
+        f"preview {sum(preview_times) / len(preview_times) * 1000:.3f} ms per sample"
+    )
+
+
+if __name__ == "__main__":
+    main()
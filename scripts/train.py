@@ -1,6 +1,4 @@
 import os
-from contextlib import nullcontext
-from copy import deepcopy
 from datetime import timedelta
 from pprint import pformat
 
@@ -17,29 +15,27 @@ from opensora.acceleration.checkpoint import set_grad_checkpoint
 from opensora.acceleration.parallel_states import get_data_parallel_group
 from opensora.datasets.dataloader import prepare_dataloader
 from opensora.registry import DATASETS, MODELS, SCHEDULERS, build_module
-from opensora.utils.ckpt_utils import load, model_gathering, model_sharding, record_model_param_shape, save
+from opensora.utils.ckpt_utils import (
+    AsyncCheckpointSaver,
+    build_sharded_ema,
+    load,
+    model_gathering,
+    model_sharding,
+    record_model_param_shape,
+    save,
+)
 from opensora.utils.config_utils import define_experiment_workspace, parse_configs, save_training_config
 from opensora.utils.lr_scheduler import LinearWarmupLR, OneCycleScheduler
 from opensora.utils.misc import (
-    Timer,
-    all_reduce_mean,
+    EventTimers,
     create_logger,
     create_tensorboard_writer,
     format_numel_str,
     get_model_numel,
-    requires_grad,
     to_torch_dtype,
 )
-from opensora.utils.train_utils import MaskGenerator, create_colossalai_plugin, update_ema
-
-
-def calculate_weight_norm(model):
-    total_norm = 0.0
-    for param in model.parameters():
-        param_norm = param.data.norm(2)
-        total_norm += param_norm.item() ** 2
-    total_norm = total_norm ** 0.5
-    return total_norm
+from opensora.utils.train_metrics import TrainingMetrics
+from opensora.utils.train_utils import EMAUpdater, MaskGenerator, create_colossalai_plugin, create_profiler
 
 
 def main():
@@ -76,6 +72,7 @@ def main():
     logger = create_logger(exp_dir)
     logger.info("Experiment directory created at %s", exp_dir)
     logger.info("Training configuration:\n %s", pformat(cfg.to_dict()))
+    tb_writer = None
     if coordinator.is_master():
         tb_writer = create_tensorboard_writer(exp_dir)
         if cfg.get("wandb", False):
@@ -166,11 +163,9 @@ def main():
     )
 
     # == build ema for diffusion model ==
-    ema = deepcopy(model).to(torch.float32).to(device)
-    requires_grad(ema, False)
-    ema_shape_dict = record_model_param_shape(ema)
+    ema = build_sharded_ema(model)
+    ema_shape_dict = record_model_param_shape(model)
     ema.eval()
-    update_ema(ema, model, decay=0, sharded=False)
 
     # == setup loss function, build scheduler ==
     scheduler = build_module(cfg.scheduler, SCHEDULERS)
@@ -228,9 +223,11 @@ def main():
 
     # == global variables ==
     cfg_epochs = cfg.get("epochs", 1000)
-    start_epoch = start_step = log_step = acc_step = 0
-    running_loss = 0.0
+    start_epoch = start_step = acc_step = 0
     logger.info("Training for %s epochs with %s steps per epoch", cfg_epochs, num_steps_per_epoch)
+    # checkpoints are snapshotted into pinned memory and written in the background
+    ckpt_saver = AsyncCheckpointSaver() if cfg.get("async_ckpt", False) else None
+    save_ckpt = ckpt_saver.save if ckpt_saver is not None else save
 
     # == resume ==
     if cfg.get("load", None) is not None:
@@ -253,29 +250,32 @@ def main():
         for g in optimizer.param_groups:
             g["lr"] = cfg.lr
     else:
-        save(booster, exp_dir, model=model, ema=ema, optimizer=optimizer, lr_scheduler=lr_scheduler, sampler=sampler, epoch=0, step=0, global_step=0, batch_size=cfg.get("batch_size", None))
-
-    model_sharding(ema)
+        model_gathering(ema, ema_shape_dict)
+        save_ckpt(booster, exp_dir, model=model, ema=ema, optimizer=optimizer, lr_scheduler=lr_scheduler, sampler=sampler, epoch=0, step=0, global_step=0, batch_size=cfg.get("batch_size", None))
+        if dist.get_rank() == 0:
+            model_sharding(ema)
+
+    ema_updater = EMAUpdater(
+        ema,
+        model.module,
+        optimizer=optimizer,
+        decay=cfg.get("ema_decay", 0.9999),
+        every_n_steps=cfg.get("ema_every_n_steps", 1),
+    )
 
     # =======================================================
     # 5. training loop
     # =======================================================
+    # metrics stay on the device and are reduced and written every log_every steps
+    metrics = TrainingMetrics(
+        device, bucket_config=cfg.get("bucket_config", None), tb_writer=tb_writer, use_wandb=cfg.get("wandb", False)
+    )
     dist.barrier()
-    timers = {}
-    timer_keys = [
-        "move_data",
-        "encode",
-        "mask",
-        "diffusion",
-        "backward",
-        "update_ema",
-        "reduce_loss",
-    ]
-    for key in timer_keys:
-        if record_time:
-            timers[key] = Timer(key, coordinator=coordinator)
-        else:
-            timers[key] = nullcontext()
+    # stage times are measured with CUDA events and averaged over each log interval
+    timers = EventTimers(enabled=record_time)
+    profiler = create_profiler(cfg.get("profiler", None), exp_dir)
+    if profiler is not None:
+        profiler.start()
     for epoch in range(start_epoch, cfg_epochs):
         # == set dataloader to new epoch ==
         sampler.set_epoch(epoch)
@@ -291,20 +291,18 @@ def main():
             total=num_steps_per_epoch,
         ) as pbar:
             for step, batch in pbar:
-                timer_list = []
                 is_empty = batch.pop("is_empty")
                 if is_empty:
                     # If the batch is empty, decrement the step counter and adjust the progress bar
                     pbar.n -= 1
                     continue
-                with timers["move_data"] as move_data_t:
+                bucket = tuple(int(batch[k][0]) for k in ["num_frames", "height", "width"] if k in batch)
+                with timers("move_data"):
                     x = batch.pop("video").to(device, dtype)  # [B, C, T, H, W]
                     y = batch.pop("text")
-                if record_time:
-                    timer_list.append(move_data_t)
 
                 # == visual and text encoding ==
-                with timers["encode"] as encode_t:
+                with timers("encode"):
                     with torch.no_grad():
                         # Prepare visual inputs
                         if cfg.get("load_video_features", False):
@@ -320,17 +318,13 @@ def main():
                             model_args["mask"] = mask
                         else:
                             model_args = text_encoder.encode(y)
-                if record_time:
-                    timer_list.append(encode_t)
 
                 # == mask ==
-                with timers["mask"] as mask_t:
+                with timers("mask"):
                     mask = None
                     if cfg.get("mask_ratios", None) is not None:
                         mask = mask_generator.get_masks(x)
                         model_args["x_mask"] = mask
-                if record_time:
-                    timer_list.append(mask_t)
 
                 # == video meta info ==
                 for k, v in batch.items():
@@ -338,13 +332,11 @@ def main():
                         model_args[k] = v.to(device, dtype)
 
                 # == diffusion loss computation ==
-                with timers["diffusion"] as loss_t:
+                with timers("diffusion"):
                     loss_dict = scheduler.training_losses(model, x, model_args, mask=mask)
-                if record_time:
-                    timer_list.append(loss_t)
 
                 # == backward & update ==
-                with timers["backward"] as backward_t:
+                with timers("backward"):
                     loss = loss_dict["loss"].mean()
                     booster.backward(loss=loss, optimizer=optimizer)
                     optimizer.step()
@@ -353,65 +345,46 @@ def main():
                     # update learning rate
                     if lr_scheduler is not None:
                         lr_scheduler.step()
-                if record_time:
-                    timer_list.append(backward_t)
 
                 # == update EMA ==
-                with timers["update_ema"] as ema_t:
-                    update_ema(ema, model.module, optimizer=optimizer, decay=cfg.get("ema_decay", 0.9999))
-                if record_time:
-                    timer_list.append(ema_t)
+                with timers("update_ema"):
+                    ema_updater()
 
                 # == update log info ==
-                with timers["reduce_loss"] as reduce_loss_t:
-                    all_reduce_mean(loss)
-                    running_loss += loss.item()
+                with timers("reduce_loss"):
+                    get_grad_norm = getattr(optimizer, "get_grad_norm", None)
+                    metrics.update(loss, grad_norm=get_grad_norm() if get_grad_norm else None, bucket=bucket)
                     global_step = epoch * num_steps_per_epoch + step
-                    log_step += 1
                     acc_step += 1
-                if record_time:
-                    timer_list.append(reduce_loss_t)
 
                 # == logging ==
-                if coordinator.is_master() and (global_step + 1) % cfg.get("log_every", 1) == 0:
-                    weight_norm = calculate_weight_norm(model)
-                    avg_loss = running_loss / log_step
-                    # progress bar
-                    pbar.set_postfix({"loss": avg_loss, "step": step, "global_step": global_step})
-                    # tensorboard
-                    tb_writer.add_scalar("loss", loss.item(), global_step)
-                    # wandb
-                    if cfg.get("wandb", False):
-                        wandb_dict = {
-                            "iter": global_step,
-                            "acc_step": acc_step,
-                            "epoch": epoch,
-                            "loss": loss.item(),
-                            "avg_loss": avg_loss,
-                            "lr": optimizer.param_groups[0]["lr"],
-                            "weight_norm": weight_norm,
-                        }
-                        if record_time:
-                            wandb_dict.update(
-                                {
-                                    "debug/move_data_time": move_data_t.elapsed_time,
-                                    "debug/encode_time": encode_t.elapsed_time,
-                                    "debug/mask_time": mask_t.elapsed_time,
-                                    "debug/diffusion_time": loss_t.elapsed_time,
-                                    "debug/backward_time": backward_t.elapsed_time,
-                                    "debug/update_ema_time": ema_t.elapsed_time,
-                                    "debug/reduce_loss_time": reduce_loss_t.elapsed_time,
-                                }
-                            )
-                        wandb.log(wandb_dict, step=global_step)
-                    running_loss = 0.0
-                    log_step = 0
+                if (global_step + 1) % cfg.get("log_every", 1) == 0:
+                    metrics.update_weight_norm(model)
+                    log_dict = {
+                        "iter": global_step,
+                        "acc_step": acc_step,
+                        "epoch": epoch,
+                        "lr": optimizer.param_groups[0]["lr"],
+                    }
+                    if record_time:
+                        stage_times = timers.summary()
+                        log_dict.update({f"debug/{name}_time": t for name, t in stage_times.items()})
+                        logger.info(
+                            "Rank %s | Epoch %s | Step %s | %s",
+                            dist.get_rank(),
+                            epoch,
+                            step,
+                            " | ".join(f"{name}: {t:.3f}s" for name, t in stage_times.items()),
+                        )
+                    metrics.flush(global_step, log_dict)
+                    # progress bar, lagging one log interval behind
+                    pbar.set_postfix({"loss": metrics.latest.get("avg_loss"), "step": step, "global_step": global_step})
 
                 # == checkpoint saving ==
                 ckpt_every = cfg.get("ckpt_every", 0)
                 if ckpt_every > 0 and (global_step + 1) % ckpt_every == 0:
                     model_gathering(ema, ema_shape_dict)
-                    save_dir = save(
+                    save_dir = save_ckpt(
                         booster,
                         exp_dir,
                         model=model,
@@ -433,18 +406,15 @@ def main():
                         global_step + 1,
                         save_dir,
                     )
-                if record_time:
-                    log_str = f"Rank {dist.get_rank()} | Epoch {epoch} | Step {step} | "
-                    for timer in timer_list:
-                        log_str += f"{timer.name}: {timer.elapsed_time:.3f}s | "
-                    print(log_str)
+                if profiler is not None:
+                    profiler.step()
 
         sampler.reset()
         start_step = 0
 
     model_gathering(ema, ema_shape_dict)
     global_step = epoch * num_steps_per_epoch + step
-    save_dir = save(
+    save_dir = save_ckpt(
         booster,
         exp_dir,
         model=model,
@@ -457,6 +427,12 @@ def main():
         global_step=global_step + 1,
         batch_size=cfg.get("batch_size", None),
     )
+    if profiler is not None:
+        profiler.stop()
+    metrics.close()
+    if ckpt_saver is not None:
+        ckpt_saver.close()
+        dist.barrier()
 
 
 if __name__ == "__main__":
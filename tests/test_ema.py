@@ -0,0 +1,52 @@
+from copy import deepcopy
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn as nn
+
+from opensora.utils.train_utils import EMAUpdater, update_ema
+
+
+def build_models():
+    torch.manual_seed(1024)
+    model = nn.Sequential(nn.Linear(8, 16), nn.LayerNorm(16), nn.Linear(16, 4))
+    ema = deepcopy(model)
+    for param in ema.parameters():
+        param.data.normal_()
+    return model, ema
+
+
+def test_update_ema_matches_reference():
+    model, ema = build_models()
+    expected = {name: 0.9 * p + 0.1 * dict(model.named_parameters())[name] for name, p in ema.named_parameters()}
+    update_ema(ema, model, decay=0.9, sharded=False)
+    for name, param in ema.named_parameters():
+        assert torch.allclose(param, expected[name])
+
+
+def test_sharded_update_uses_master_params():
+    model, ema = build_models()
+    model = model.to(torch.bfloat16)
+    for param in ema.parameters():
+        param.data = param.data.view(-1)
+    master_params = {id(p): torch.randn(p.numel()) for p in model.parameters()}
+    optimizer = SimpleNamespace(_param_store=SimpleNamespace(working_to_master_param=master_params))
+    expected = [0.5 * e + 0.5 * master_params[id(p)] for e, p in zip(ema.parameters(), model.parameters())]
+    EMAUpdater(ema, model, optimizer=optimizer, decay=0.5)()
+    for param, value in zip(ema.parameters(), expected):
+        assert torch.allclose(param, value)
+
+
+@pytest.mark.parametrize("every_n_steps", [1, 3])
+def test_every_n_steps_decay_compensation(every_n_steps):
+    model, ema = build_models()
+    reference = deepcopy(ema)
+    updater = EMAUpdater(ema, model, decay=0.9, sharded=False, every_n_steps=every_n_steps)
+    updated = [updater() for _ in range(6)]
+    assert updated == [(i + 1) % every_n_steps == 0 for i in range(6)]
+    # with a constant model, n updates with decay 0.9^n equal n single-step updates
+    for _ in range(6):
+        update_ema(reference, model, decay=0.9, sharded=False)
+    for param, value in zip(ema.parameters(), reference.parameters()):
+        assert torch.allclose(param, value, atol=1e-6)
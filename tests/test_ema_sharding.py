@@ -0,0 +1,61 @@
+import colossalai
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from colossalai.testing import spawn
+
+from opensora.utils.ckpt_utils import build_sharded_ema, model_gathering, model_sharding, record_model_param_shape
+
+
+def build_model():
+    torch.manual_seed(1024)
+    # odd sizes, so that the shards are padded
+    return nn.Sequential(nn.Linear(7, 13), nn.LayerNorm(13), nn.Linear(13, 3), nn.BatchNorm1d(3)).to(torch.bfloat16)
+
+
+def run_ema_sharding(rank, world_size):
+    model = build_model()
+    shape_dict = record_model_param_shape(model)
+    # a tiny bucket size to gather in several buckets
+    ema = build_sharded_ema(model, bucket_size_in_m=1e-4)
+    assert len(ema.flat_shard.buckets) > 1
+    for (name, param), ema_param in zip(model.named_parameters(), ema.parameters()):
+        shard_numel = (param.numel() + world_size - 1) // world_size
+        assert ema_param.dtype == torch.float32 and ema_param.numel() == shard_numel
+        assert ema_param.data_ptr() >= ema.flat_shard.buffer.data_ptr()
+        expected = param.float().flatten()[rank * shard_numel : (rank + 1) * shard_numel]
+        assert torch.equal(ema_param[: expected.numel()], expected), name
+    assert ema[3].running_var.dtype == torch.float32
+
+    model_gathering(ema, shape_dict)
+    if rank == 0:
+        for param, ema_param in zip(model.parameters(), ema.parameters()):
+            assert torch.equal(ema_param, param.float())
+        model_sharding(ema)
+        for param, ema_param in zip(model.parameters(), ema.parameters()):
+            shard_numel = (param.numel() + world_size - 1) // world_size
+            assert torch.equal(ema_param, param.float().flatten()[:shard_numel])
+
+    # loading a full state dict fills every rank's shards
+    torch.manual_seed(0)
+    state_dict = {name: torch.randn(shape) for name, shape in shape_dict.items()}
+    rest = ema.flat_shard.load_state_dict(state_dict)
+    assert len(rest) == 0
+    model_gathering(ema, shape_dict)
+    if rank == 0:
+        for name, param in ema.named_parameters():
+            assert torch.equal(param, state_dict[name]), name
+
+
+def run_dist(rank, world_size, port):
+    colossalai.launch({}, rank=rank, world_size=world_size, host="localhost", port=port, backend="gloo")
+    run_ema_sharding(rank, world_size)
+    dist.barrier()
+
+
+def test_ema_sharding():
+    spawn(run_dist, nprocs=2)
+
+
+if __name__ == "__main__":
+    test_ema_sharding()
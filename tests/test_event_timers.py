@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+from opensora.utils.misc import EventTimers
+
+
+def test_event_timers_window():
+    timers = EventTimers()
+    for _ in range(2):
+        with timers("short"):
+            time.sleep(0.01)
+        with timers("long"):
+            time.sleep(0.03)
+    summary = timers.summary()
+    assert summary.keys() == {"short", "long"}
+    assert summary["long"] > summary["short"] >= 0.01
+    # every window only averages its own stages
+    with timers("short"):
+        pass
+    assert timers.summary()["short"] == pytest.approx(0, abs=5e-3)
+    assert timers.summary() == {}
+
+
+def test_event_timers_disabled():
+    timers = EventTimers(enabled=False)
+    with timers("stage"):
+        pass
+    assert timers.summary() == {}
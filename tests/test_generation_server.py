@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from opensora.utils.config_utils import read_config
+from opensora.utils.generation_server import GenerationServer, serve
+from opensora.utils.inference_worker import InferenceWorker
+
+CONFIG = "configs/opensora-v1-2/inference/tiny_random.py"
+
+
+def request_json(url, body=None):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+        return json.loads(response.read())
+
+
+def test_generation_server(tmp_path):
+    worker = InferenceWorker(read_config(CONFIG))
+    worker.load_model(None)
+    # every batch fills up long before max_wait, so batching does not depend on when the HTTP request arrives
+    server = GenerationServer(worker, str(tmp_path), max_batch_size=2, max_wait=60.0)
+
+    # queue before the scheduling thread starts, the 8-frame dog waits for the 8-frame fish sent over HTTP
+    requests = [
+        server.submit("a cat", seed=1),
+        server.submit("a dog", seed=2, num_frames=8),
+        server.submit("a cat", seed=3),
+        server.submit("a bird", seed=4),
+        server.submit("a bird", seed=6),
+    ]
+    httpd = serve(server, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        result = request_json(f"{url}/generate", dict(prompt="a fish", seed=5, num_frames=8, wait=True))
+        assert result["status"] == "done"
+        for request in requests:
+            assert request.done.wait(60)
+
+        # compatible requests are batched in arrival order, different num_frames are not mixed
+        assert [request.batch_size for request in requests] == [2, 2, 2, 2, 2]
+        assert result["batch_size"] == 2
+        for request in requests:
+            status = request_json(f"{url}/requests/{request.id}")
+            assert status["status"] == "done"
+            assert set(status["latency"]) == {"queue", "denoise", "decode", "encode", "total"}
+            assert os.path.exists(request.save_path)
+        with urllib.request.urlopen(f"{url}/videos/{requests[0].id}") as response:
+            assert len(response.read()) == os.path.getsize(requests[0].save_path)
+
+        stats = request_json(f"{url}/stats")
+        assert stats["completed"] == 6 and stats["batches"] == 3
+
+        # misspelled fields are rejected instead of generating with the defaults
+        with pytest.raises(urllib.error.HTTPError) as error:
+            request_json(f"{url}/generate", dict(prompt="a fish", cfg_sacle=7.0))
+        assert error.value.code == 400
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        server.stop()
+
+
+def test_batch_token_budget(tmp_path):
+    worker = InferenceWorker(read_config(CONFIG))
+    worker.load_model(None)
+    server = GenerationServer(worker, str(tmp_path), max_batch_size=4, max_wait=0.0)
+    for i in range(3):
+        server.submit("a cat", seed=i)
+    server.max_batch_tokens = 2 * server.num_tokens(server.queue[0])
+    assert len(server.take_batch()) == 2
+    assert len(server.take_batch()) == 1
+
+
+def test_submit_keeps_explicit_zeros(tmp_path):
+    worker = InferenceWorker(read_config(CONFIG))
+    worker.load_model(None)
+    server = GenerationServer(worker, str(tmp_path))
+    assert server.submit("a cat", cfg_scale=0).cfg_scale == 0
+    assert server.submit("a cat").cfg_scale == worker.scheduler.cfg_scale
+    assert server.stats()["queued"] == 2
@@ -0,0 +1,59 @@
+import torch
+import torch.nn.functional as F
+
+from opensora.models.vae.preview import LatentPreviewDecoder
+from opensora.schedulers.rf import RFLOW
+
+
+def test_fit_recovers_linear_decoder():
+    torch.manual_seed(1024)
+    weight, bias = torch.randn(3, 4) * 0.1, torch.randn(3) * 0.1
+    latents, videos = [], []
+    for _ in range(2):
+        z = torch.randn(1, 4, 5, 6, 8)
+        x = torch.einsum("oc,bcthw->bothw", weight, z) + bias[:, None, None, None]
+        # a "decoder" with 4x temporal and 8x spatial upsampling whose frames pool back to the linear map
+        x = x.repeat_interleave(4, dim=2)[:, :, :17]
+        x = F.interpolate(x, scale_factor=(1, 8, 8), mode="nearest")
+        latents.append(z)
+        videos.append(x.clamp(-1, 1))
+
+    preview_decoder = LatentPreviewDecoder(in_channels=4, upsample=2)
+    psnr = preview_decoder.fit(latents, videos)
+    assert psnr > 40
+    assert torch.allclose(preview_decoder.proj.weight.flatten(1), weight, atol=1e-2)
+
+    preview = preview_decoder(latents[0])
+    assert preview.shape == (1, 3, 5, 12, 16)
+    assert preview.min() >= -1 and preview.max() <= 1
+
+
+class ConstantVelocity:
+    def __call__(self, z, t, **kwargs):
+        return torch.ones_like(z).repeat(1, 2, 1, 1, 1)
+
+
+class NullTextEncoder:
+    def encode(self, prompts):
+        return dict(y=torch.zeros(len(prompts), 1, 4, 8))
+
+    def null(self, n):
+        return torch.zeros(n, 1, 4, 8)
+
+
+def test_rflow_callback():
+    steps = []
+
+    def callback(step, num_steps, z, x0):
+        steps.append((step, num_steps))
+        # with a constant velocity the predicted clean sample is exact at every step
+        assert torch.allclose(x0, z_final)
+
+    z = torch.randn(2, 4, 3, 8, 8)
+    z_final = z + 1
+    scheduler = RFLOW(num_sampling_steps=6)
+    out = scheduler.sample(
+        ConstantVelocity(), NullTextEncoder(), z, ["a", "b"], "cpu", progress=False, callback=callback
+    )
+    assert torch.allclose(out, z_final)
+    assert steps == [(i, 6) for i in range(6)]
@@ -0,0 +1,106 @@
+import pytest
+import torch
+import torch.nn as nn
+from colossalai.utils.common import set_seed
+
+from opensora.acceleration.quantization import (
+    STDIT3_QUANT_EXCLUDE,
+    QuantLinear,
+    dequantize_weight,
+    get_model_size,
+    quantize_model,
+    quantize_weight,
+)
+from opensora.models.stdit.stdit3 import STDiT3, STDiT3Config
+
+
+def get_tiny_stdit3():
+    config = STDiT3Config(
+        caption_channels=64,
+        depth=2,
+        hidden_size=128,
+        num_heads=4,
+        model_max_length=20,
+        enable_flash_attn=False,
+        enable_layernorm_kernel=False,
+    )
+    model = STDiT3(config).eval()
+    # zero-initialized projections would hide the quantization error
+    for p in model.parameters():
+        p.data.normal_(std=0.02)
+    return model
+
+
+def get_inputs(batch_size=2):
+    return dict(
+        x=torch.randn(batch_size, 4, 2, 8, 8),
+        timestep=torch.tensor([500.0] * batch_size),
+        y=torch.randn(batch_size, 1, 20, 64),
+        mask=None,  # xformers has no block-diagonal cross attention on cpu
+        fps=torch.tensor([24.0] * batch_size),
+        height=torch.tensor([64.0] * batch_size),
+        width=torch.tensor([64.0] * batch_size),
+    )
+
+
+@pytest.mark.parametrize("bits,group_size", [(8, None), (8, 32), (4, 32)])
+def test_quantize_weight_error(bits, group_size):
+    set_seed(1024)
+    weight = torch.randn(48, 128)
+    qweight, scale = quantize_weight(weight, bits, group_size)
+    assert qweight.dtype == torch.int8
+    assert qweight.shape == (48, 128 // 2 if bits == 4 else 128)
+    assert scale.shape == (48, 128 // (group_size or 128))
+    error = (dequantize_weight(qweight, scale, bits) - weight).abs()
+    # round to nearest is off by at most half a step
+    step = scale.repeat_interleave(group_size or 128, dim=1)
+    assert (error <= step / 2 + 1e-6).all()
+
+
+def test_int4_packing():
+    # with a scale of 1 every value from -7 to 7 survives packing at both nibble positions
+    values = torch.cat([torch.arange(-7, 8), torch.zeros(1)]).repeat(2, 2)
+    qweight, scale = quantize_weight(values, bits=4, group_size=16)
+    assert torch.equal(scale, torch.ones(2, 2))
+    assert torch.equal(dequantize_weight(qweight, scale, bits=4), values)
+
+
+@torch.no_grad()
+@pytest.mark.parametrize("bits", [8, 4])
+def test_quant_linear(bits):
+    set_seed(1024)
+    linear = nn.Linear(256, 64)
+    quant = QuantLinear.from_linear(linear, bits=bits, group_size=64)
+    x = torch.randn(3, 7, 256)
+    out, ref = quant(x), linear(x)
+    assert out.shape == ref.shape
+    assert (out - ref).pow(2).mean() / ref.pow(2).mean() < (1e-4 if bits == 8 else 1e-2)
+
+    # weights load back into a layer built without them, and casting keeps the scales in float32
+    loaded = QuantLinear(256, 64, bits=bits, group_size=64)
+    loaded.load_state_dict(quant.state_dict())
+    loaded = loaded.to(torch.bfloat16)
+    assert loaded.weight.dtype == torch.int8 and loaded.scale.dtype == torch.float
+    assert loaded.bias.dtype == torch.bfloat16
+    assert torch.allclose(loaded(x.bfloat16()).float(), out, rtol=5e-2, atol=5e-2)
+
+
+@torch.no_grad()
+@pytest.mark.parametrize("bits", ["int8", "int4"])
+def test_quantize_stdit3(bits):
+    set_seed(1024)
+    model = get_tiny_stdit3()
+    inputs = get_inputs()
+    ref = model(**inputs)
+    size = get_model_size(model)
+
+    num_quantized = quantize_model(model, bits, exclude=STDIT3_QUANT_EXCLUDE)
+    assert num_quantized == 2 * 2 * 7  # qkv, proj, q, kv, proj, fc1 and fc2 of every spatial and temporal block
+    assert all(type(m) is nn.Linear for m in [model.t_block[1], model.final_layer.linear])
+    assert isinstance(model.spatial_blocks[0].attn.qkv, QuantLinear)
+    assert isinstance(model.temporal_blocks[0].cross_attn.kv_linear, QuantLinear)
+    assert isinstance(model.spatial_blocks[0].mlp.fc1, QuantLinear)
+    assert get_model_size(model) < size * (0.5 if bits == "int8" else 0.4)
+
+    out = model(**inputs)
+    assert (out - ref).pow(2).mean() / ref.pow(2).mean() < (1e-3 if bits == "int8" else 5e-2)
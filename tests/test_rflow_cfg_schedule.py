@@ -0,0 +1,95 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from opensora.schedulers.rf import RFLOW, get_guidance_scales, resample_cfg_schedule
+
+
+class LinearVelocity:
+    """
+    Velocity that depends on the caption, so that guided and unguided steps differ. Records the batch size of
+    every call.
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.x_masks = []
+
+    def __call__(self, z, t, y, x_mask=None, **kwargs):
+        self.batch_sizes.append(z.shape[0])
+        self.x_masks.append(x_mask)
+        v = z * 0.5 + y.mean(dim=(1, 2, 3))[:, None, None, None, None]
+        return torch.cat([v, v], dim=1)  # learned sigma channels
+
+
+class PromptTextEncoder:
+    def encode(self, prompts):
+        y = [torch.full((1, 4, 8), float(len(prompt)), dtype=torch.float64) for prompt in prompts]
+        return dict(y=torch.stack(y))
+
+    def null(self, n):
+        return torch.zeros(n, 1, 4, 8, dtype=torch.float64)
+
+
+def test_guidance_scales():
+    assert get_guidance_scales(4, 5.0) == [5.0] * 4
+    assert get_guidance_scales(4, 5.0, scales=[7.0, 6.0, 1.0, 2.0]) == [7.0, 6.0, 1.0, 2.0]
+    # positions 0, 0.25, 0.5, 0.75 of which only [0.25, 0.75) are guided
+    assert get_guidance_scales(4, 5.0, interval=(0.25, 0.75)) == [1.0, 5.0, 5.0, 1.0]
+    assert get_guidance_scales(4, 5.0, cond_only_steps=[0, 3]) == [1.0, 5.0, 5.0, 1.0]
+    # the options compose
+    scales = get_guidance_scales(4, 5.0, scales=[7.0, 6.0, 3.0, 2.0], interval=(0.0, 0.75), cond_only_steps=[1])
+    assert scales == [7.0, 1.0, 3.0, 1.0]
+    with pytest.raises(AssertionError):
+        get_guidance_scales(4, 5.0, scales=[7.0, 6.0])
+
+
+def test_cond_only_step_runs_conditional_half():
+    scheduler = RFLOW(num_sampling_steps=4)
+    model = LinearVelocity()
+    z = torch.randn(2, 4, 3, 8, 8, generator=torch.Generator().manual_seed(1024), dtype=torch.float64)
+    t = torch.tensor([500.0, 500.0], dtype=torch.float64)
+    text_encoder = PromptTextEncoder()
+    y = torch.cat([text_encoder.encode(["a", "bb"])["y"], text_encoder.null(2)], 0)
+    x_mask = torch.tensor([[True, False, True], [True, True, False]] * 2)
+    model_args = dict(y=y, x_mask=x_mask)
+
+    v = scheduler.predict_velocity(model, z, t, model_args, guidance_scale=1.0)
+    assert model.batch_sizes == [2]
+    assert torch.equal(model.x_masks[0], x_mask[:2])
+
+    # same as evaluating both branches with a guidance scale of 1, which is the conditional prediction
+    pred = model(torch.cat([z, z], 0), torch.cat([t, t], 0), **model_args).chunk(2, dim=1)[0]
+    pred_cond, pred_uncond = pred.chunk(2, dim=0)
+    torch.testing.assert_close(v, pred_uncond + 1.0 * (pred_cond - pred_uncond))
+    assert not torch.allclose(v, scheduler.predict_velocity(model, z, t, model_args, guidance_scale=4.0))
+
+
+def test_cascade_with_per_step_cfg_schedule():
+    num_sampling_steps, draft_steps, num_refine_steps = 10, 4, 3
+    cfg_schedule = dict(scales=[7.0 - 0.5 * i for i in range(num_sampling_steps)], cond_only_steps=[8, 9])
+    scheduler = RFLOW(num_sampling_steps=num_sampling_steps, cfg_schedule=cfg_schedule)
+    draft_cfg_schedule = resample_cfg_schedule(cfg_schedule, num_sampling_steps, draft_steps)
+    draft_scheduler = RFLOW(num_sampling_steps=draft_steps, cfg_schedule=draft_cfg_schedule)
+    assert draft_cfg_schedule == dict(scales=[6.5, 5.5, 4.0, 3.0], cond_only_steps=[3])
+    assert get_guidance_scales(draft_steps, 4.0, **draft_cfg_schedule) == [6.5, 5.5, 4.0, 1.0]
+
+    # same flow as scripts/inference.py: a small draft, upsampled and refined over the last steps
+    model = LinearVelocity()
+    z = torch.randn(2, 4, 3, 8, 8, generator=torch.Generator().manual_seed(1024), dtype=torch.float64)
+    draft_z = torch.randn(2, 4, 3, 4, 4, generator=torch.Generator().manual_seed(1024), dtype=torch.float64)
+    draft = draft_scheduler.sample(model, PromptTextEncoder(), draft_z, ["a", "bb"], "cpu", progress=False)
+    x_start = F.interpolate(draft, size=(3, 8, 8), mode="trilinear")
+    samples = scheduler.sample(
+        model,
+        PromptTextEncoder(),
+        z,
+        ["a", "bb"],
+        "cpu",
+        progress=False,
+        x_start=x_start,
+        start_step=num_sampling_steps - num_refine_steps,
+    )
+    assert samples.shape == z.shape and torch.isfinite(samples).all()
+    # the last draft step and the last two refinement steps only run the conditional half
+    assert model.batch_sizes == [4, 4, 4, 2, 4, 2, 2]
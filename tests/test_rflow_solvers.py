@@ -0,0 +1,77 @@
+import pytest
+import torch
+
+from opensora.schedulers.rf import RFLOW, RFLOWDPMSolver, RFLOWHeun
+
+MEAN, STD = 0.5, 0.3
+
+
+class GaussianVelocity:
+    """
+    Exact velocity of the rectified flow from N(0, 1) noise to N(MEAN, STD^2) data, the ODE maps noise z1 to
+    MEAN + STD * z1.
+    """
+
+    def __call__(self, z, t, **kwargs):
+        sigma = (t / 1000)[:, None, None, None, None].double()
+        z = z.double()
+        x0 = MEAN + (1 - sigma) * STD**2 / ((1 - sigma) ** 2 * STD**2 + sigma**2) * (z - (1 - sigma) * MEAN)
+        v = (x0 - z) / sigma
+        return torch.cat([v, v], dim=1)  # learned sigma channels
+
+
+class NullTextEncoder:
+    def encode(self, prompts):
+        return dict(y=torch.zeros(len(prompts), 1, 4, 8))
+
+    def null(self, n):
+        return torch.zeros(n, 1, 4, 8)
+
+
+def sample_error(scheduler):
+    z1 = torch.randn(2, 4, 3, 8, 8, generator=torch.Generator().manual_seed(1024), dtype=torch.float64)
+    z0 = scheduler.sample(GaussianVelocity(), NullTextEncoder(), z1, ["a", "b"], "cpu", progress=False)
+    return (z0 - (MEAN + STD * z1)).abs().max().item()
+
+
+@pytest.mark.parametrize("num_sampling_steps", [5, 10])
+def test_dpm_solver_first_order_is_euler(num_sampling_steps):
+    euler = sample_error(RFLOW(num_sampling_steps=num_sampling_steps))
+    dpm = sample_error(RFLOWDPMSolver(num_sampling_steps=num_sampling_steps, order=1))
+    assert dpm == pytest.approx(euler, rel=1e-6)
+
+
+def test_higher_order_solvers():
+    euler_errors = [sample_error(RFLOW(num_sampling_steps=n)) for n in [10, 20]]
+    for scheduler_cls, kwargs in [
+        (RFLOWHeun, dict(method="heun")),
+        (RFLOWHeun, dict(method="midpoint")),
+        (RFLOWDPMSolver, dict(order=2)),
+    ]:
+        errors = [sample_error(scheduler_cls(num_sampling_steps=n, **kwargs)) for n in [10, 20]]
+        # more accurate than Euler at the same number of steps, and converging faster when the steps are doubled
+        assert errors[0] < euler_errors[0], scheduler_cls
+        assert errors[1] / errors[0] < euler_errors[1] / euler_errors[0], scheduler_cls
+
+
+def test_masked_noise_is_per_sample():
+    # the noise of partially conditioned frames comes from per-sample generators, so a sample does not depend on
+    # the other samples of its batch
+    z1 = torch.randn(2, 4, 3, 8, 8, generator=torch.Generator().manual_seed(1024), dtype=torch.float64)
+    mask = torch.tensor([[0.5, 1.0, 1.0]] * 2, dtype=torch.float64)
+    samples = []
+    for rows in [[0, 1], [1]]:
+        generators = [torch.Generator().manual_seed(seed) for seed in rows]
+        samples.append(
+            RFLOW(num_sampling_steps=10).sample(
+                GaussianVelocity(),
+                NullTextEncoder(),
+                z1[rows],
+                ["a"] * len(rows),
+                "cpu",
+                mask=mask[rows],
+                progress=False,
+                generators=generators,
+            )
+        )
+    torch.testing.assert_close(samples[0][1:], samples[1])
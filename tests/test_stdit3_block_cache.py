@@ -0,0 +1,118 @@
+import torch
+from colossalai.utils.common import set_seed
+
+from opensora.models.stdit.stdit3 import STDiT3, STDiT3Config
+from opensora.schedulers.rf import RFLOW, get_block_cache_refresh_steps
+
+CAPTION_CHANNELS, MODEL_MAX_LENGTH = 64, 20
+
+
+def get_tiny_stdit3():
+    config = STDiT3Config(
+        caption_channels=CAPTION_CHANNELS,
+        class_dropout_prob=0.0,
+        depth=4,
+        hidden_size=128,
+        num_heads=4,
+        model_max_length=MODEL_MAX_LENGTH,
+        enable_flash_attn=False,
+        enable_layernorm_kernel=False,
+    )
+    model = STDiT3(config).cuda().eval()
+    # temporal blocks are zero-initialized, randomize them so that they contribute to the output
+    for p in model.parameters():
+        p.data.normal_(std=0.02)
+    return model
+
+
+class RandomTextEncoder:
+    def __init__(self, y_embedder):
+        self.y_embedder = y_embedder
+
+    def encode(self, prompts):
+        y = torch.randn(len(prompts), 1, MODEL_MAX_LENGTH, CAPTION_CHANNELS, device="cuda")
+        mask = torch.zeros(len(prompts), MODEL_MAX_LENGTH, dtype=torch.long, device="cuda")
+        for i, prompt in enumerate(prompts):
+            mask[i, : len(prompt.split())] = 1
+        return dict(y=y, mask=mask)
+
+    def null(self, n):
+        return self.y_embedder.y_embedding[None].repeat(n, 1, 1)[:, None]
+
+
+def get_model_args(batch_size):
+    return dict(
+        height=torch.tensor([64.0] * batch_size, device="cuda"),
+        width=torch.tensor([64.0] * batch_size, device="cuda"),
+        num_frames=torch.tensor([17.0] * batch_size, device="cuda"),
+        fps=torch.tensor([24.0] * batch_size, device="cuda"),
+    )
+
+
+def get_inputs(batch_size, t):
+    y = torch.randn(batch_size, 1, MODEL_MAX_LENGTH, CAPTION_CHANNELS, device="cuda")
+    x = torch.randn(batch_size, 4, 5, 8, 8, device="cuda")
+    return x, torch.tensor([t] * batch_size, device="cuda"), dict(y=y, **get_model_args(batch_size))
+
+
+@torch.no_grad()
+def test_forward_block_cache():
+    set_seed(1024)
+    model = get_tiny_stdit3()
+    x, timestep, model_args = get_inputs(2, 900.0)
+    expected = model(x, timestep, **model_args)
+
+    model.enable_block_cache(1, 3)
+    # refresh steps compute every block and store the residual of the cached range
+    torch.testing.assert_close(model(x, timestep, **model_args), expected)
+    assert list(model.block_cache["residuals"]) == [torch.Size([2, 5 * 4 * 4, 128])]
+
+    # cheap steps reuse the residual, which is exact for the input it was computed on
+    model.block_cache["refresh"] = False
+    torch.testing.assert_close(model(x, timestep, **model_args), expected)
+    x_next, timestep_next = x * 0.9, torch.full_like(timestep, 700.0)
+    cached = model(x_next, timestep_next, **model_args)
+    model.block_cache["refresh"] = True
+    assert not torch.allclose(cached, model(x_next, timestep_next, **model_args))
+
+    # residuals are kept per input shape, a new batch size is computed in full on its first cheap step
+    model.block_cache["refresh"] = False
+    x_4, timestep_4, model_args_4 = get_inputs(4, 700.0)
+    out = model(x_4, timestep_4, **model_args_4)
+    assert len(model.block_cache["residuals"]) == 2
+    model.disable_block_cache()
+    torch.testing.assert_close(out, model(x_4, timestep_4, **model_args_4))
+    assert model.block_cache is None
+
+
+@torch.no_grad()
+def test_sample_all_refresh_steps():
+    set_seed(1024)
+    model = get_tiny_stdit3()
+    text_encoder = RandomTextEncoder(model.y_embedder)
+    prompts = ["a cat", "a dog on a skateboard"]
+    z = torch.randn(2, 4, 5, 8, 8, device="cuda")
+
+    samples = []
+    for block_cache in [None, dict(blocks=(1, 3), refresh_interval=1)]:
+        scheduler = RFLOW(num_sampling_steps=5, use_timestep_transform=True, block_cache=block_cache)
+        torch.manual_seed(0)
+        samples.append(
+            scheduler.sample(
+                model, text_encoder, z=z, prompts=prompts, device="cuda", additional_args=get_model_args(2)
+            )
+        )
+    assert model.block_cache is None
+    # with a refresh on every step the cache never changes the result
+    torch.testing.assert_close(samples[0], samples[1])
+
+
+def test_explicit_refresh_steps_start_full():
+    # refinement runs only the tail of the schedule, so explicit indices can miss step 0 or exceed the length
+    assert get_block_cache_refresh_steps(4, refresh_steps=[2, 5]) == [True, False, True, False]
+
+
+if __name__ == "__main__":
+    test_forward_block_cache()
+    test_sample_all_refresh_steps()
+    test_explicit_refresh_steps_start_full()
@@ -0,0 +1,55 @@
+import torch
+from torch._dynamo.utils import counters
+
+from opensora.models.stdit.stdit3 import STDiT3, STDiT3Config
+
+CAPTION_CHANNELS, MODEL_MAX_LENGTH = 64, 20
+
+
+def get_tiny_stdit3(depth):
+    torch.manual_seed(1024)
+    config = STDiT3Config(
+        caption_channels=CAPTION_CHANNELS,
+        class_dropout_prob=0.0,
+        depth=depth,
+        hidden_size=128,
+        num_heads=4,
+        model_max_length=MODEL_MAX_LENGTH,
+    )
+    model = STDiT3(config).eval()
+    # temporal blocks are zero-initialized, randomize them so that they contribute to the output
+    for p in model.parameters():
+        p.data.normal_(std=0.02)
+    return model
+
+
+def get_inputs(T, H, W, batch_size=2):
+    return dict(
+        x=torch.randn(batch_size, 4, T, H, W),
+        timestep=torch.rand(batch_size) * 1000,
+        y=torch.randn(batch_size, 1, MODEL_MAX_LENGTH, CAPTION_CHANNELS),
+        fps=torch.full((batch_size,), 24.0),
+        height=torch.full((batch_size,), H * 8.0),
+        width=torch.full((batch_size,), W * 8.0),
+    )
+
+
+def count_graphs(model, buckets):
+    torch._dynamo.reset()
+    counters.clear()
+    model.compile_blocks()
+    outputs = [model(**inputs) for inputs in buckets]
+    model.compile_blocks(enabled=False)
+    for inputs, out in zip(buckets, outputs):
+        torch.testing.assert_close(out, model(**inputs), rtol=1e-4, atol=1e-4)
+    return counters["stats"]["unique_graphs"]
+
+
+@torch.no_grad()
+def test_compiled_blocks_share_graphs():
+    torch.manual_seed(0)
+    buckets = [get_inputs(4, 8, 8), get_inputs(6, 8, 12)]
+    num_graphs = [count_graphs(get_tiny_stdit3(depth), buckets) for depth in [2, 4]]
+    # graphs of the attention and MLP regions of spatial and temporal blocks, independent of the depth and the
+    # bucket; compiling per block would build at least one graph for each of the 16 regions of depth 4
+    assert num_graphs[0] == num_graphs[1] < 16
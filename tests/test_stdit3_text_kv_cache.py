@@ -0,0 +1,97 @@
+import torch
+from colossalai.utils.common import set_seed
+
+from opensora.models.stdit.stdit3 import STDiT3, STDiT3Config
+from opensora.schedulers.rf import RFLOW
+
+CAPTION_CHANNELS, MODEL_MAX_LENGTH = 64, 20
+
+
+def get_tiny_stdit3():
+    config = STDiT3Config(
+        caption_channels=CAPTION_CHANNELS,
+        class_dropout_prob=0.0,
+        depth=2,
+        hidden_size=128,
+        num_heads=4,
+        model_max_length=MODEL_MAX_LENGTH,
+        enable_flash_attn=False,
+        enable_layernorm_kernel=False,
+    )
+    model = STDiT3(config).cuda().eval()
+    # temporal blocks are zero-initialized, randomize them so that they contribute to the output
+    for p in model.parameters():
+        p.data.normal_(std=0.02)
+    return model
+
+
+class RandomTextEncoder:
+    def __init__(self, y_embedder):
+        self.y_embedder = y_embedder
+
+    def encode(self, prompts):
+        y = torch.randn(len(prompts), 1, MODEL_MAX_LENGTH, CAPTION_CHANNELS, device="cuda")
+        mask = torch.zeros(len(prompts), MODEL_MAX_LENGTH, dtype=torch.long, device="cuda")
+        for i, prompt in enumerate(prompts):
+            mask[i, : len(prompt.split())] = 1
+        return dict(y=y, mask=mask)
+
+    def null(self, n):
+        return self.y_embedder.y_embedding[None].repeat(n, 1, 1)[:, None]
+
+
+def get_model_args(batch_size):
+    return dict(
+        height=torch.tensor([64.0] * batch_size, device="cuda"),
+        width=torch.tensor([64.0] * batch_size, device="cuda"),
+        num_frames=torch.tensor([17.0] * batch_size, device="cuda"),
+        fps=torch.tensor([24.0] * batch_size, device="cuda"),
+    )
+
+
+@torch.no_grad()
+def test_forward_parity():
+    set_seed(1024)
+    model = get_tiny_stdit3()
+    text_encoder = RandomTextEncoder(model.y_embedder)
+    text = text_encoder.encode(["a cat", "a dog on a skateboard"])
+    y = torch.cat([text["y"], text_encoder.null(2)], 0)
+    x = torch.randn(4, 4, 5, 8, 8, device="cuda")
+    model_args = dict(y=y, mask=text["mask"], **get_model_args(4))
+
+    model.cache_text_condition(y, text["mask"])
+    for t in [900.0, 300.0]:
+        timestep = torch.tensor([t] * 4, device="cuda")
+        cached_out = model(x, timestep, **model_args)
+        model.text_cache, text_cache = None, model.text_cache
+        out = model(x, timestep, **model_args)
+        model.text_cache = text_cache
+        torch.testing.assert_close(cached_out, out)
+    model.clear_text_cache()
+    assert model.text_cache is None
+
+
+@torch.no_grad()
+def test_sample_parity():
+    set_seed(1024)
+    model = get_tiny_stdit3()
+    text_encoder = RandomTextEncoder(model.y_embedder)
+    prompts = ["a cat", "a dog on a skateboard"]
+    z = torch.randn(2, 4, 5, 8, 8, device="cuda")
+
+    samples = []
+    for text_kv_cache in [False, True]:
+        scheduler = RFLOW(num_sampling_steps=5, use_timestep_transform=True, text_kv_cache=text_kv_cache)
+        torch.manual_seed(0)
+        samples.append(
+            scheduler.sample(
+                model, text_encoder, z=z, prompts=prompts, device="cuda", additional_args=get_model_args(2)
+            )
+        )
+    assert model.text_cache is None
+    torch.testing.assert_close(samples[0], samples[1])
+
+
+if __name__ == "__main__":
+    test_forward_parity()
+    test_sample_parity()
@@ -0,0 +1,82 @@
+import os
+
+import torch
+
+from opensora.models.text_encoder.embedding_cache import TextEmbeddingCache
+
+MODEL_MAX_LENGTH, DIM = 8, 4
+
+
+class FakeEncoder:
+    """
+    Padded embeddings with one token per word, the padding holds non-zero values as T5 outputs do.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        y = torch.full((len(texts), MODEL_MAX_LENGTH, DIM), -1.0)
+        mask = torch.zeros(len(texts), MODEL_MAX_LENGTH, dtype=torch.long)
+        for i, text in enumerate(texts):
+            seed = sum(map(ord, text))
+            length = len(text.split())
+            y[i, :length] = torch.randn(length, DIM, generator=torch.Generator().manual_seed(seed))
+            mask[i, :length] = 1
+        return y, mask
+
+
+def expected_embeddings(texts):
+    y, mask = FakeEncoder()(texts)
+    return y * mask[..., None], mask
+
+
+def test_matches_encode_fn():
+    cache = TextEmbeddingCache("t5", MODEL_MAX_LENGTH)
+    encoder = FakeEncoder()
+    texts = ["a cat", "a dog on a skateboard", "a cat"]
+    for _ in range(2):
+        y, mask = cache.get_text_embeddings(texts, encoder, "cpu")
+        expected_y, expected_mask = expected_embeddings(texts)
+        # padded back to model_max_length with zeros
+        assert y.shape == (3, MODEL_MAX_LENGTH, DIM)
+        torch.testing.assert_close(y, expected_y)
+        assert torch.equal(mask, expected_mask)
+    # repeated prompts are encoded once, the second batch is served from memory
+    assert encoder.calls == [["a cat", "a dog on a skateboard"]]
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_lru_eviction():
+    cache = TextEmbeddingCache("t5", MODEL_MAX_LENGTH, max_memory_items=2)
+    encoder = FakeEncoder()
+    for text in ["a", "b", "a", "c"]:
+        cache.get_text_embeddings([text], encoder, "cpu")
+    # "b" is the least recently used entry when "c" is added
+    assert list(cache.memory) == [cache.key("a"), cache.key("c")]
+    cache.get_text_embeddings(["b"], encoder, "cpu")
+    assert encoder.calls == [["a"], ["b"], ["c"], ["b"]]
+
+
+def test_disk_round_trip(tmp_path):
+    texts = ["a cat", "a dog on a skateboard"]
+    encoder = FakeEncoder()
+    cache = TextEmbeddingCache("t5", MODEL_MAX_LENGTH, cache_dir=str(tmp_path))
+    y, mask = cache.get_text_embeddings(texts, encoder, "cpu")
+    # only the unpadded tokens are stored
+    key = cache.key(texts[1])
+    stored = torch.load(os.path.join(tmp_path, key[:2], f"{key}.pt"))
+    assert stored.shape == (5, DIM)
+
+    # a new cache, e.g. of the next run, reads the memory-mapped files and does not encode again
+    cache = TextEmbeddingCache("t5", MODEL_MAX_LENGTH, cache_dir=str(tmp_path), max_memory_items=0)
+    cached_y, cached_mask = cache.get_text_embeddings(texts, encoder, "cpu")
+    assert len(encoder.calls) == 1 and cache.hits == 2
+    torch.testing.assert_close(cached_y, y)
+    assert torch.equal(cached_mask, mask)
+
+    # other encoders or lengths do not share entries
+    other = TextEmbeddingCache("t5-other", MODEL_MAX_LENGTH, cache_dir=str(tmp_path))
+    other.get_text_embeddings(texts[:1], encoder, "cpu")
+    assert other.misses == 1
@@ -0,0 +1,58 @@
+import colossalai
+import pytest
+import torch
+import torch.nn as nn
+from colossalai.testing import spawn
+
+from opensora.utils.train_metrics import TrainingMetrics
+
+
+class ScalarWriter:
+    def __init__(self):
+        self.scalars = {}
+
+    def add_scalar(self, key, value, step):
+        self.scalars[(key, step)] = value
+
+
+def run_metrics(rank, world_size):
+    writer = ScalarWriter()
+    bucket_config = {"144p": {1: (1.0, 8), 16: (1.0, 2)}}
+    metrics = TrainingMetrics("cpu", bucket_config=bucket_config, tb_writer=writer)
+    # rank r sees losses r, r + 1, r + 2 on the 144p-16 bucket and an image with loss 10
+    for i in range(3):
+        metrics.update(torch.tensor(float(rank + i)), grad_norm=2.0, bucket=(16, 144, 256))
+    metrics.update(torch.tensor(10.0), grad_norm=torch.tensor(4.0), bucket=(1, 144, 256))
+    model = nn.Linear(3, 4, bias=False)
+    nn.init.constant_(model.weight, 1.0)
+    metrics.update_weight_norm(model)
+    metrics.flush(3, {"lr": 1e-4})
+    # the accumulator is reset, so the next interval only contains its own steps
+    metrics.update(torch.tensor(1.0), bucket=(16, 144, 256))
+    metrics.flush(4)
+    metrics.close()
+
+    if rank == 0:
+        rank_mean = (world_size - 1) / 2
+        assert writer.scalars[("loss", 3)] == pytest.approx(10.0)
+        assert writer.scalars[("avg_loss", 3)] == pytest.approx((3 * (rank_mean + 1) + 10) / 4)
+        assert writer.scalars[("grad_norm", 3)] == pytest.approx(2.5)
+        assert writer.scalars[("weight_norm", 3)] == pytest.approx(12**0.5)
+        assert writer.scalars[("bucket_loss/144p-16", 3)] == pytest.approx(rank_mean + 1)
+        assert writer.scalars[("bucket_loss/144p-1", 3)] == pytest.approx(10.0)
+        assert writer.scalars[("lr", 3)] == 1e-4
+        assert metrics.latest == {"loss": 1.0, "avg_loss": 1.0, "bucket_loss/144p-16": 1.0}
+        assert ("grad_norm", 4) not in writer.scalars
+
+
+def run_dist(rank, world_size, port):
+    colossalai.launch({}, rank=rank, world_size=world_size, host="localhost", port=port, backend="gloo")
+    run_metrics(rank, world_size)
+
+
+def test_train_metrics():
+    spawn(run_dist, nprocs=2)
+
+
+if __name__ == "__main__":
+    test_train_metrics()
@@ -0,0 +1,75 @@
+import torch
+import torch.nn as nn
+
+from opensora.models.vae.vae_temporal import VAE_Temporal, VAE_Temporal_SD
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_tiny_vae_temporal():
+    torch.manual_seed(1024)
+    model = VAE_Temporal(filters=32, num_res_blocks=1, temporal_downsample=(False, True, True), num_groups=8)
+    # GroupNorm normalizes over the whole clip and only over the frames seen so far when streaming,
+    # remove it so that the causal convolutions can be compared exactly
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, nn.GroupNorm):
+                setattr(module, name, nn.Identity())
+    return model.to(DEVICE, torch.float64).eval()
+
+
+@torch.no_grad()
+def test_encode_stream_parity():
+    model = get_tiny_vae_temporal()
+    x = torch.randn(2, 4, 18, 8, 8, device=DEVICE, dtype=torch.float64)
+    expected = model.encode(x).mean
+
+    # 2 frames are padded to 4, the following chunks are multiples of 4
+    chunks = [x[:, :, :2], x[:, :, 2:6], x[:, :, 6:14], x[:, :, 14:]]
+    streamed = torch.cat([posterior.mean for posterior in model.encode_stream(chunks)], dim=2)
+    torch.testing.assert_close(streamed, expected)
+
+
+@torch.no_grad()
+def test_decode_stream_parity():
+    model = get_tiny_vae_temporal()
+    num_frames = 18
+    z = torch.randn(2, 4, 5, 8, 8, device=DEVICE, dtype=torch.float64)
+    expected = model.decode(z, num_frames=num_frames)
+
+    chunks = [z[:, :, :1], z[:, :, 1:3], z[:, :, 3:4], z[:, :, 4:]]
+    streamed = torch.cat(list(model.decode_stream(chunks, num_frames=num_frames)), dim=2)
+    assert streamed.shape[2] == num_frames
+    torch.testing.assert_close(streamed, expected)
+
+    # the caches are cleared once the stream ends
+    assert all(not getattr(m, "streaming", False) and getattr(m, "cache", None) is None for m in model.modules())
+
+
+@torch.no_grad()
+def test_stream_group_norm():
+    # the block configuration of the released VAE, with its GroupNorm, at a tiny spatial size
+    torch.manual_seed(1024)
+    model = VAE_Temporal_SD().to(DEVICE, torch.float64).eval()
+    x = torch.randn(1, 4, 16, 4, 4, device=DEVICE, dtype=torch.float64)
+    expected = model.encode(x).mean
+
+    # a single chunk sees every frame, so its statistics are those of the whole clip
+    torch.testing.assert_close(next(model.encode_stream([x])).mean, expected)
+    torch.testing.assert_close(
+        next(model.decode_stream([expected], num_frames=16)), model.decode(expected, num_frames=16)
+    )
+
+    # streaming is causal: every chunk is normalized with the statistics of the frames so far, so the first chunk
+    # matches a whole-clip pass over its own frames. Later chunks only approximate the whole-clip pass.
+    chunks = [x[:, :, :4], x[:, :, 4:8], x[:, :, 8:]]
+    streamed = [posterior.mean for posterior in model.encode_stream(chunks)]
+    torch.testing.assert_close(streamed[0], model.encode(chunks[0]).mean)
+    assert torch.cat(streamed, dim=2).shape == expected.shape
+    assert all(getattr(m, "stats", None) is None for m in model.modules())
+
+
+if __name__ == "__main__":
+    test_encode_stream_parity()
+    test_decode_stream_parity()
+    test_stream_group_norm()